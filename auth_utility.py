@@ -0,0 +1,430 @@
+"""
+Authentication and profile lookups off the Streamlit script thread
+
+Sign-in, sign-up, token refresh and profile reads are network round-trips
+to Firebase. They run on a small process-wide thread pool; each browser
+session keeps an AuthSession that caches the profile for AUTH_PROFILE_TTL
+seconds, prefetches it right after sign-in and refreshes the ID token in
+the background before it expires, so a rerun never waits on Firebase.
+
+AUTH_BACKEND=stub swaps Firebase for an in-memory backend (with optional
+simulated latency) so the flow can be exercised and benchmarked offline.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics_utility import AUTH_ERRORS, AUTH_SECONDS, record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+FIREBASE_BACKEND = 'firebase'
+STUB_BACKEND = 'stub'
+
+DEFAULT_PROFILE_TTL = 300
+DEFAULT_TIMEOUT = 10
+DEFAULT_WORKERS = 4
+
+# Refresh the ID token this many seconds before Firebase expires it
+TOKEN_REFRESH_MARGIN = 300
+
+# Environment variables needed by the Firebase backend
+FIREBASE_ENV_VARS = ['FIREBASE_API_KEY', 'FIREBASE_AUTH_DOMAIN', 'FIREBASE_DATABASE_URL',
+                     'FIREBASE_PROJECT_ID', 'FIREBASE_STORAGE_BUCKET', 'FIREBASE_MESSAGING_SENDER_ID',
+                     'FIREBASE_APP_ID', 'FIREBASE_MEASUREMENT_ID']
+
+
+class AuthError(Exception):
+    """A rejected authentication request; the message is the backend's reason code."""
+
+
+def get_auth_backend_name():
+    """
+    Get the configured authentication backend name
+
+    AUTH_BACKEND is 'firebase' (default) or 'stub'.
+    """
+    backend = os.getenv('AUTH_BACKEND', FIREBASE_BACKEND).strip().lower()
+    if backend not in (FIREBASE_BACKEND, STUB_BACKEND):
+        raise ValueError(f"Unknown AUTH_BACKEND: {backend}")
+    return backend
+
+
+def missing_firebase_vars():
+    """Firebase environment variables that are not set (empty for the stub backend)."""
+    if get_auth_backend_name() != FIREBASE_BACKEND:
+        return []
+    return [var for var in FIREBASE_ENV_VARS if not os.getenv(var)]
+
+
+class FirebaseBackend:
+    """
+    Blocking calls to Firebase Authentication and the Realtime Database
+
+    Args:
+        config: pyrebase configuration dictionary
+    """
+
+    def __init__(self, config):
+        import pyrebase
+
+        self._app = pyrebase.initialize_app(config)
+        self._auth = self._app.auth()
+
+    def _database(self):
+        # pyrebase Database objects accumulate the child() path, so concurrent
+        # calls each need their own
+        return self._app.database()
+
+    @staticmethod
+    def _reason(error):
+        """Extract Firebase's reason code (e.g. EMAIL_EXISTS) from a pyrebase HTTPError."""
+        try:
+            return json.loads(error.args[1])['error']['message']
+        except (IndexError, KeyError, TypeError, ValueError):
+            return str(error)
+
+    def _call(self, func, *args):
+        from requests.exceptions import HTTPError
+
+        try:
+            return func(*args)
+        except HTTPError as e:
+            raise AuthError(self._reason(e)) from e
+
+    def sign_in(self, email, password):
+        return self._call(self._auth.sign_in_with_email_and_password, email, password)
+
+    def sign_up(self, email, password):
+        # The sign-up response already carries idToken and localId
+        return self._call(self._auth.create_user_with_email_and_password, email, password)
+
+    def refresh(self, refresh_token):
+        user = self._call(self._auth.refresh, refresh_token)
+        return {'localId': user['userId'], 'idToken': user['idToken'],
+                'refreshToken': user['refreshToken'], 'expiresIn': '3600'}
+
+    def get_profile(self, local_id, token=None):
+        return self._call(lambda: self._database().child(local_id).get(token).val()) or {}
+
+    def update_profile(self, local_id, values, token=None):
+        # One multi-field write instead of one request per field
+        self._call(lambda: self._database().child(local_id).update(values, token))
+
+
+class StubAuthBackend:
+    """
+    In-memory stand-in for FirebaseBackend
+
+    Args:
+        latency: Seconds each call sleeps, to simulate network round-trips
+                 (default: AUTH_STUB_LATENCY_MS)
+    """
+
+    def __init__(self, latency=None):
+        if latency is None:
+            latency = float(os.getenv('AUTH_STUB_LATENCY_MS', '0')) / 1000
+        self.latency = latency
+        self.calls = 0
+        self._users = {}
+        self._profiles = {}
+        self._refresh_tokens = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _issue(self, local_id, email):
+        refresh_token = uuid.uuid4().hex
+        self._refresh_tokens[refresh_token] = local_id
+        return {'localId': local_id, 'email': email, 'idToken': uuid.uuid4().hex,
+                'refreshToken': refresh_token, 'expiresIn': '3600'}
+
+    @staticmethod
+    def _digest(password):
+        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+    def sign_up(self, email, password):
+        self._round_trip()
+        if len(password or '') < 6:
+            raise AuthError('WEAK_PASSWORD')
+        with self._lock:
+            if email in self._users:
+                raise AuthError('EMAIL_EXISTS')
+            local_id = uuid.uuid4().hex[:28]
+            self._users[email] = (local_id, self._digest(password))
+            return self._issue(local_id, email)
+
+    def sign_in(self, email, password):
+        self._round_trip()
+        with self._lock:
+            local_id, digest = self._users.get(email, (None, None))
+            if local_id is None or digest != self._digest(password):
+                raise AuthError('INVALID_LOGIN_CREDENTIALS')
+            return self._issue(local_id, email)
+
+    def refresh(self, refresh_token):
+        self._round_trip()
+        with self._lock:
+            local_id = self._refresh_tokens.pop(refresh_token, None)
+            if local_id is None:
+                raise AuthError('INVALID_REFRESH_TOKEN')
+            return self._issue(local_id, None)
+
+    def get_profile(self, local_id, token=None):
+        self._round_trip()
+        with self._lock:
+            return dict(self._profiles.get(local_id, {}))
+
+    def update_profile(self, local_id, values, token=None):
+        self._round_trip()
+        with self._lock:
+            self._profiles.setdefault(local_id, {}).update(values)
+
+
+class TTLCache:
+    """
+    Small dictionary whose entries expire after a fixed time
+
+    Args:
+        ttl: Seconds an entry stays valid
+        clock: Time source, monotonic by default
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if self.clock() >= expires_at:
+            del self._entries[key]
+            return None
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (value, self.clock() + self.ttl)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+
+class AuthClient:
+    """
+    Runs backend calls on a shared thread pool
+
+    Args:
+        backend: FirebaseBackend or StubAuthBackend
+        max_workers: Threads for concurrent remote calls
+        timeout: Seconds a caller waits for a result before giving up
+        profile_ttl: Seconds an AuthSession caches the profile
+    """
+
+    def __init__(self, backend, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 profile_ttl=DEFAULT_PROFILE_TTL):
+        self.backend = backend
+        self.timeout = timeout
+        self.profile_ttl = profile_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='auth')
+
+    def submit(self, func, *args):
+        return self._executor.submit(self._timed, func, *args)
+
+    @staticmethod
+    def _timed(func, *args):
+        """Run one backend call, recording its latency and failures by method name."""
+        call = getattr(func, '__name__', 'call')
+        with AUTH_SECONDS.time(call=call):
+            try:
+                return func(*args)
+            except Exception:
+                AUTH_ERRORS.inc(call=call)
+                raise
+
+    def sign_in(self, email, password):
+        """
+        Sign in and start fetching the profile at the same time
+
+        Returns:
+            session: AuthSession with the profile lookup already in flight
+        """
+        user = self.submit(self.backend.sign_in, email, password).result(self.timeout)
+        session = AuthSession(self, user, email)
+        session.prefetch()
+        return session
+
+    def sign_up(self, email, password, handle):
+        """
+        Create an account and write its profile
+
+        The account creation response is already signed in, so no second
+        sign-in request is made, and the profile fields go in one write.
+
+        Returns:
+            session: AuthSession with the profile cached
+        """
+        user = self.submit(self.backend.sign_up, email, password).result(self.timeout)
+        profile = {'Handle': handle, 'ID': user['localId']}
+        self.submit(self.backend.update_profile, user['localId'], profile,
+                    user.get('idToken')).result(self.timeout)
+        session = AuthSession(self, user, email)
+        session.profiles.put(user['localId'], profile)
+        session._last_profile = profile
+        return session
+
+
+class AuthSession:
+    """
+    Per-browser-session view of the signed-in user
+
+    Keep one in st.session_state; it is cheap to query on every rerun.
+
+    Attributes:
+        user: Latest sign-in or refresh response (localId, idToken, refreshToken)
+        email: Email address used to sign in
+        profiles: TTLCache of profile dictionaries by localId
+    """
+
+    def __init__(self, client, user, email, clock=time.monotonic):
+        self.client = client
+        self.user = user
+        self.email = email
+        self.clock = clock
+        self.profiles = TTLCache(client.profile_ttl, clock=clock)
+        self.expires_at = clock() + float(user.get('expiresIn', 3600))
+        self._last_profile = None
+        self._pending_profile = None
+        self._pending_refresh = None
+        self._lock = threading.Lock()
+
+    @property
+    def local_id(self):
+        return self.user['localId']
+
+    def token(self):
+        """
+        Current ID token, refreshed in the background as expiry approaches
+
+        Only blocks when the token has already expired.
+        """
+        with self._lock:
+            refresh = self._pending_refresh
+            if refresh is None and self.user.get('refreshToken') \
+                    and self.clock() >= self.expires_at - TOKEN_REFRESH_MARGIN:
+                refresh = self._pending_refresh = self.client.submit(self.client.backend.refresh,
+                                                                     self.user['refreshToken'])
+        if refresh is not None and (refresh.done() or self.clock() >= self.expires_at):
+            try:
+                user = refresh.result(self.client.timeout)
+                with self._lock:
+                    self.user = {**self.user, **user}
+                    self.expires_at = self.clock() + float(user.get('expiresIn', 3600))
+            except Exception as e:
+                logger.warning("Token refresh failed: %s", e)
+            finally:
+                with self._lock:
+                    self._pending_refresh = None
+        return self.user.get('idToken')
+
+    def prefetch(self):
+        """Start loading the profile unless it is cached or already loading."""
+        token = self.token()
+        with self._lock:
+            if self.profiles.get(self.local_id) is None and self._pending_profile is None:
+                self._pending_profile = self.client.submit(self.client.backend.get_profile,
+                                                           self.local_id, token)
+            return self._pending_profile
+
+    def profile(self, wait=True):
+        """
+        The user's profile, from the cache when it is fresh
+
+        Once the cached profile expires, the previous one is returned while
+        the lookup runs, so only the very first call can block.
+
+        Args:
+            wait: Block (up to the client timeout) for the first lookup;
+                  with False, return None instead of waiting
+
+        Returns:
+            profile: Dictionary of profile fields, or None if unavailable
+        """
+        cached = self.profiles.get(self.local_id)
+        record_cache_lookup('auth_profile', cached is not None)
+        if cached is not None:
+            return cached
+        pending = self.prefetch()
+        if not pending.done() and (not wait or self._last_profile is not None):
+            return self._last_profile
+        try:
+            profile = pending.result(self.client.timeout)
+        except Exception as e:
+            logger.warning("Profile lookup failed: %s", e)
+            profile = None
+        with self._lock:
+            self._pending_profile = None
+        if profile is not None:
+            self.profiles.put(self.local_id, profile)
+            self._last_profile = profile
+        return profile if profile is not None else self._last_profile
+
+    def handle(self, wait=True):
+        """Display name: the profile Handle, or the email's local part as a fallback."""
+        profile = self.profile(wait=wait) or {}
+        return profile.get('Handle') or (self.email or '').split('@')[0]
+
+
+# Process-wide client, created lazily on first use
+_auth_client = None
+_auth_client_lock = threading.Lock()
+
+
+def get_auth_client(config=None):
+    """
+    Get the shared, process-wide authentication client
+
+    Configuration comes from the environment:
+
+        AUTH_BACKEND          firebase (default) or stub
+        AUTH_PROFILE_TTL      seconds a session caches the profile (default: 300)
+        AUTH_TIMEOUT          seconds to wait for a remote call (default: 10)
+        AUTH_WORKERS          threads for remote calls (default: 4)
+        AUTH_STUB_LATENCY_MS  simulated round-trip of the stub backend (default: 0)
+
+    Args:
+        config: pyrebase configuration, required for the Firebase backend
+
+    Returns:
+        client: AuthClient shared by all sessions
+    """
+    global _auth_client
+
+    if _auth_client is None:
+        with _auth_client_lock:
+            if _auth_client is None:
+                if get_auth_backend_name() == STUB_BACKEND:
+                    backend = StubAuthBackend()
+                else:
+                    backend = FirebaseBackend(config)
+                _auth_client = AuthClient(
+                    backend,
+                    max_workers=int(os.getenv('AUTH_WORKERS', str(DEFAULT_WORKERS))),
+                    timeout=float(os.getenv('AUTH_TIMEOUT', str(DEFAULT_TIMEOUT))),
+                    profile_ttl=float(os.getenv('AUTH_PROFILE_TTL', str(DEFAULT_PROFILE_TTL)))
+                )
+    return _auth_client
@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+from model_utility import get_tensorflow, get_thread_config, resolve_model_path
+
+logger = logging.getLogger(__name__)
+
+# Supported values for the INFERENCE_BACKEND environment variable
+KERAS_BACKEND = 'keras'
+TFLITE_DYNAMIC_BACKEND = 'tflite-dynamic'
+TFLITE_INT8_BACKEND = 'tflite-int8'
+ONNX_BACKEND = 'onnx'
+BACKENDS = (KERAS_BACKEND, TFLITE_DYNAMIC_BACKEND, TFLITE_INT8_BACKEND, ONNX_BACKEND)
+
+# Converted artifacts are cached next to MODEL_PATH with these suffixes
+ARTIFACT_SUFFIXES = {
+    TFLITE_DYNAMIC_BACKEND: '.dynamic.tflite',
+    TFLITE_INT8_BACKEND: '.int8.tflite',
+    ONNX_BACKEND: '.onnx'
+}
+
+# Bundled scans used to calibrate int8 quantization
+CALIBRATION_IMAGES = ['image1.jpg', 'image2.jpg', 'image3.jpg', 'image4.jpg']
+
+
+def get_inference_backend():
+    """
+    Get the configured inference backend name
+
+    INFERENCE_BACKEND selects how the model runs:
+
+        keras           full-precision Keras model (default)
+        tflite-dynamic  TFLite with dynamic-range (int8 weight) quantization
+        tflite-int8     TFLite with int8 quantization calibrated on sample scans
+        onnx            ONNX Runtime (requires tf2onnx and onnxruntime)
+
+    Returns:
+        backend: One of BACKENDS
+    """
+    backend = os.getenv('INFERENCE_BACKEND', KERAS_BACKEND).strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND: {backend} (expected one of {', '.join(BACKENDS)})")
+    return backend
+
+
+def artifact_path(model_path, backend):
+    """Return where the converted artifact for a backend is cached."""
+    return os.path.splitext(model_path)[0] + ARTIFACT_SUFFIXES[backend]
+
+
+def _is_stale(artifact, model_path):
+    return not os.path.exists(artifact) or os.path.getmtime(artifact) < os.path.getmtime(model_path)
+
+
+def _calibration_dataset(input_shape, calibration_dir=None):
+    """Yield preprocessed sample scans for int8 calibration."""
+    from PIL import Image
+    from model_utility import preprocess_image_segmentation
+
+    calibration_dir = calibration_dir or os.path.dirname(os.path.abspath(__file__))
+    height, width = input_shape[1] or 256, input_shape[2] or 256
+    for name in CALIBRATION_IMAGES:
+        path = os.path.join(calibration_dir, name)
+        if os.path.exists(path):
+            image = Image.open(path).convert('RGB')
+            yield [np.asarray(preprocess_image_segmentation(image, target_size=(height, width)), dtype=np.float32)]
+
+
+def convert_model(model_path, backend):
+    """
+    Convert the Keras model for a backend and cache the artifact
+
+    Args:
+        model_path: Path to the Keras model
+        backend: One of the converted backends
+
+    Returns:
+        artifact: Path to the converted model
+    """
+    artifact = artifact_path(model_path, backend)
+    tf = get_tensorflow()
+    keras_model = tf.keras.models.load_model(model_path, compile=False)
+
+    if backend == ONNX_BACKEND:
+        try:
+            import tf2onnx
+        except ImportError:
+            raise ImportError("The onnx backend requires tf2onnx and onnxruntime (pip install tf2onnx onnxruntime)")
+        input_signature = [tf.TensorSpec(keras_model.input_shape, tf.float32, name='input')]
+        tf2onnx.convert.from_keras(keras_model, input_signature=input_signature, output_path=artifact)
+    else:
+        converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if backend == TFLITE_INT8_BACKEND:
+            # Inputs and outputs stay float32; ops fall back to float where int8 is unsupported
+            converter.representative_dataset = lambda: _calibration_dataset(keras_model.input_shape)
+        with open(artifact + '.tmp', 'wb') as f:
+            f.write(converter.convert())
+        os.replace(artifact + '.tmp', artifact)
+
+    logger.info("converted %s to %s backend at %s", model_path, backend, artifact)
+    return artifact
+
+
+class TFLiteModel:
+    """
+    Keras-compatible wrapper around a TFLite interpreter
+
+    Exposes input_shape and predict() so predict_tumor, the warm-up and
+    the micro-batcher work unchanged.
+    """
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            Interpreter = get_tensorflow().lite.Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output_index = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = int(self._input['shape'][0])
+        self.input_shape = (None,) + tuple(int(dim) for dim in self._input['shape'][1:])
+        # A TFLite interpreter must not be invoked from several threads at once
+        self._lock = threading.Lock()
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        inputs = np.asarray(inputs, dtype=np.float32)
+        with self._lock:
+            if inputs.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], list(inputs.shape))
+                self.interpreter.allocate_tensors()
+                self._batch_size = inputs.shape[0]
+            self.interpreter.set_tensor(self._input['index'], inputs)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output_index).copy()
+
+
+class OnnxModel:
+    """Keras-compatible wrapper around an ONNX Runtime session."""
+
+    def __init__(self, path, intra_op_threads=None, inter_op_threads=None):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.session = onnxruntime.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self.input_shape = tuple(dim if isinstance(dim, int) else None for dim in model_input.shape)
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        return self.session.run(None, {self._input_name: np.asarray(inputs, dtype=np.float32)})[0]
+
+
+def load_backend_model(model_path=None, backend=None):
+    """
+    Load the model for a converted backend, converting once if needed
+
+    Args:
+        model_path: Keras model path, or None to resolve it from MODEL_PATH
+        backend: Backend name, or None to use INFERENCE_BACKEND
+
+    Returns:
+        model: TFLiteModel or OnnxModel with a Keras-like predict()
+    """
+    backend = backend or get_inference_backend()
+    model_path = resolve_model_path(model_path)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found at: {model_path}")
+
+    artifact = artifact_path(model_path, backend)
+    if _is_stale(artifact, model_path):
+        convert_model(model_path, backend)
+
+    # Same thread budget as the Keras model (see get_thread_config)
+    threads = get_thread_config()
+    if backend == ONNX_BACKEND:
+        return OnnxModel(artifact, intra_op_threads=threads['intra_op_threads'],
+                         inter_op_threads=threads['inter_op_threads'])
+    return TFLiteModel(artifact, num_threads=threads['intra_op_threads'])
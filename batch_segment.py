@@ -0,0 +1,224 @@
+"""
+Headless bulk segmentation of brain scan images
+
+Processes a directory or glob of scans with the segmentation model, writes
+one mask PNG per scan and a CSV or JSONL report with tumor_present,
+confidence and accuracy. No Streamlit or Firebase is required.
+
+Usage:
+    python batch_segment.py scans/ "archive/**/*.png" --output-dir out --workers 4
+    python batch_segment.py scans/ --report out/results.jsonl --skip-existing
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image
+
+from metrics_utility import start_metrics_exporter
+from model_utility import (TILE_WINDOWS, get_thread_config, get_tiling_config, load_model, predict_tumor_batch,
+                           predict_tumor_tiled)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+REPORT_FIELDS = ['file', 'mask', 'tumor_present', 'confidence', 'accuracy', 'error']
+
+
+def collect_scan_paths(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of image paths
+
+    Args:
+        inputs: Directories, files or glob patterns
+
+    Returns:
+        paths: Sorted, de-duplicated list of image file paths
+    """
+    paths = set()
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                for name in files:
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.add(os.path.join(root, name))
+        else:
+            for path in glob.glob(entry, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.add(path)
+    return sorted(paths)
+
+
+def mask_path_for(scan_path, mask_dir):
+    """Return the output mask path for a scan."""
+    stem = os.path.splitext(os.path.basename(scan_path))[0]
+    # Suffix with a short digest of the directory so equal names don't collide
+    digest = hashlib.sha1(os.path.dirname(os.path.abspath(scan_path)).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(mask_dir, f"{stem}_{digest}_mask.png")
+
+
+def process_batch(scan_paths, model, mask_dir, threshold, min_size, tiling=None):
+    """
+    Decode, segment and write masks for one batch of scans
+
+    Args:
+        scan_paths: Paths of the scans in this batch
+        model: Loaded segmentation model
+        mask_dir: Directory to write mask PNGs to
+        threshold: Probability threshold for the mask
+        min_size: Minimum component size kept in the mask
+        tiling: Optional predict_tiled keyword arguments; when given, each
+                scan is segmented at native resolution with tiled inference
+
+    Returns:
+        rows: One report row (dictionary) per scan
+    """
+    rows = []
+    images = []
+    decoded_paths = []
+
+    for path in scan_paths:
+        try:
+            with Image.open(path) as image:
+                images.append(image.convert('RGB'))
+            decoded_paths.append(path)
+        except Exception as e:
+            rows.append({'file': path, 'error': f"decode error: {str(e)}"})
+
+    if not images:
+        return rows
+
+    try:
+        if tiling:
+            results = [predict_tumor_tiled(image, model, threshold=threshold, min_size=min_size, **tiling)
+                       for image in images]
+        else:
+            results = predict_tumor_batch(images, model, batch_size=len(images),
+                                          threshold=threshold, min_size=min_size)
+    except Exception as e:
+        rows.extend({'file': path, 'error': f"inference error: {str(e)}"} for path in decoded_paths)
+        return rows
+
+    for path, result in zip(decoded_paths, results):
+        mask_path = mask_path_for(path, mask_dir)
+        Image.fromarray(result.mask * 255).save(mask_path)
+        rows.append({
+            'file': path,
+            'mask': mask_path,
+            'tumor_present': result.tumor_present,
+            'confidence': round(result.confidence, 2),
+            'accuracy': round(result.accuracy, 2),
+            'error': ''
+        })
+    return rows
+
+
+class ReportWriter:
+    """Append report rows to a CSV or JSONL file as they are produced."""
+
+    def __init__(self, path, append=False):
+        self.format = 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv'
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.file = open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        self.writer = None
+        if self.format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=REPORT_FIELDS)
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, row):
+        row = {field: row.get(field, '') for field in REPORT_FIELDS}
+        if self.writer:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def main(argv=None):
+    # Load .env first so it can provide the tiling defaults below
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description="Headless bulk segmentation of brain scan images")
+    parser.add_argument('inputs', nargs='+', help='Directories, files or glob patterns of scans')
+    parser.add_argument('--output-dir', default='segmentation_output', help='Directory for masks and the report')
+    parser.add_argument('--report', default=None,
+                        help='Report path; .csv or .jsonl (default: <output-dir>/results.csv)')
+    parser.add_argument('--workers', type=int, default=2, help='Number of concurrent worker threads')
+    parser.add_argument('--batch-size', type=int, default=get_thread_config()['batch_size'],
+                        help='Scans per model forward pass (default: INFERENCE_BATCH_SIZE or the tuned value)')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Mask probability threshold')
+    parser.add_argument('--min-size', type=int, default=200, help='Minimum tumor component size in pixels')
+    parser.add_argument('--model', default=None, help='Model path (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--skip-existing', action='store_true',
+                        help='Skip scans whose mask already exists and append to the report')
+    tiling_defaults = get_tiling_config() or {'overlap': 64, 'window': 'hann', 'tile_batch_size': 8}
+    parser.add_argument('--tiled', action='store_true', default=os.getenv('TILED_INFERENCE', '0') == '1',
+                        help='Segment at native resolution with overlapping 256x256 tiles')
+    parser.add_argument('--tile-overlap', type=int, default=tiling_defaults['overlap'], help='Pixels shared by neighbouring tiles')
+    parser.add_argument('--tile-window', choices=TILE_WINDOWS, default=tiling_defaults['window'], help='Tile blending window')
+    parser.add_argument('--tile-batch-size', type=int, default=tiling_defaults['tile_batch_size'],
+                        help='Tiles per model forward pass')
+    args = parser.parse_args(argv)
+
+    mask_dir = os.path.join(args.output_dir, 'masks')
+    os.makedirs(mask_dir, exist_ok=True)
+    report_path = args.report or os.path.join(args.output_dir, 'results.csv')
+
+    scan_paths = collect_scan_paths(args.inputs)
+    if args.skip_existing:
+        scan_paths = [path for path in scan_paths if not os.path.exists(mask_path_for(path, mask_dir))]
+    if not scan_paths:
+        print("ℹ️ No scans to process")
+        return 0
+
+    try:
+        model = load_model(args.model)
+    except FileNotFoundError as e:
+        print(f"❌ {str(e)}")
+        return 1
+
+    tiling = None
+    if args.tiled:
+        tiling = {'overlap': args.tile_overlap, 'window': args.tile_window, 'tile_batch_size': args.tile_batch_size}
+
+    start_metrics_exporter()
+    batches = [scan_paths[i:i + args.batch_size] for i in range(0, len(scan_paths), args.batch_size)]
+    report = ReportWriter(report_path, append=args.skip_existing)
+    processed = failed = 0
+    start = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            futures = [
+                executor.submit(process_batch, batch, model, mask_dir, args.threshold, args.min_size, tiling)
+                for batch in batches
+            ]
+            for future in as_completed(futures):
+                for row in future.result():
+                    report.write(row)
+                    processed += 1
+                    failed += bool(row.get('error'))
+                print(f"🔄 {processed}/{len(scan_paths)} scans processed", end='\r', flush=True)
+    finally:
+        report.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Processed {processed} scans ({failed} failed) in {elapsed:.1f}s "
+          f"({processed / elapsed:.2f} scans/s). Report: {report_path}")
+    return 0 if failed == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Latency of the sign-in flow and of reruns against the stub auth backend
+
+Simulates a browser session against StubAuthBackend with a fixed
+round-trip time. It compares the previous flow (sign-up, then a separate
+sign-in, then one write per profile field, and a blocking profile read on
+every rerun) with AuthClient / AuthSession (sign-up response reused, one
+profile write, profile prefetched at sign-in and served from the session's
+TTL cache). It reports wall time on the script thread and the number of
+remote calls.
+
+Usage:
+    python benchmarks/bench_auth.py [--latency-ms 80] [--reruns 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth_utility import AuthClient, StubAuthBackend
+
+
+def previous_flow(backend, email, reruns):
+    """Sequential calls as finale.py made them, one profile read per rerun."""
+    start = time.perf_counter()
+    user = backend.sign_up(email, 'password')
+    user = backend.sign_in(email, 'password')
+    backend.update_profile(user['localId'], {'Handle': 'Tester'})
+    backend.update_profile(user['localId'], {'ID': user['localId']})
+    signed_up = time.perf_counter()
+    for _ in range(reruns):
+        backend.get_profile(user['localId']).get('Handle')
+    return signed_up - start, time.perf_counter() - signed_up
+
+
+def cached_flow(client, email, reruns):
+    start = time.perf_counter()
+    session = client.sign_up(email, 'password', 'Tester')
+    signed_up = time.perf_counter()
+    for _ in range(reruns):
+        session.token()
+        session.handle()
+    return signed_up - start, time.perf_counter() - signed_up
+
+
+def login_flow(client, email, reruns, think_time):
+    """Sign in, let the page rerun, then time the reruns."""
+    start = time.perf_counter()
+    session = client.sign_in(email, 'password')
+    signed_in = time.perf_counter()
+    time.sleep(think_time)
+    first = time.perf_counter()
+    session.handle()
+    first_rerun = time.perf_counter() - first
+    for _ in range(reruns - 1):
+        session.token()
+        session.handle()
+    return signed_in - start, first_rerun, time.perf_counter() - first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--latency-ms', type=float, default=80, help='Simulated round-trip per remote call')
+    parser.add_argument('--reruns', type=int, default=50, help='Page reruns after signing in')
+    parser.add_argument('--think-time-ms', type=float, default=100,
+                        help='Delay between sign-in and the first rerun (st.rerun round-trip)')
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    print(f"{'flow':<26}{'sign-in ms':>11}{'reruns ms':>11}{'ms/rerun':>10}{'remote calls':>14}")
+
+    backend = StubAuthBackend(latency=latency)
+    sign_up, reruns = previous_flow(backend, 'previous@example.com', args.reruns)
+    print(f"{'previous sign-up':<26}{sign_up * 1000:>11.0f}{reruns * 1000:>11.0f}"
+          f"{reruns / args.reruns * 1000:>10.2f}{backend.calls:>14}")
+
+    backend = StubAuthBackend(latency=latency)
+    client = AuthClient(backend)
+    sign_up, reruns = cached_flow(client, 'cached@example.com', args.reruns)
+    print(f"{'cached sign-up':<26}{sign_up * 1000:>11.0f}{reruns * 1000:>11.0f}"
+          f"{reruns / args.reruns * 1000:>10.2f}{backend.calls:>14}")
+
+    calls = backend.calls
+    sign_in, first_rerun, reruns = login_flow(client, 'cached@example.com', args.reruns,
+                                              args.think_time_ms / 1000)
+    print(f"{'cached login (prefetch)':<26}{sign_in * 1000:>11.0f}{reruns * 1000:>11.0f}"
+          f"{reruns / args.reruns * 1000:>10.2f}{backend.calls - calls:>14}"
+          f"   first rerun waited {first_rerun * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Throughput comparison of predict_tumor vs predict_tumor_batch
+
+Runs the bundled sample images (repeated to the requested count) through
+the single-image and batched inference paths, checks that both return the
+same results and reports images/second for each.
+
+Usage:
+    python benchmarks/bench_batch_inference.py [--images N] [--batch-sizes 1 4 8 16]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from model_utility import load_model, predict_tumor, predict_tumor_batch
+
+SAMPLE_IMAGES = ['image1.jpg', 'image2.jpg', 'image3.jpg', 'image4.jpg']
+
+
+def load_sample_images(count):
+    """Load the bundled sample images, cycling through them up to count."""
+    samples = [Image.open(os.path.join(ROOT, name)).convert('RGB') for name in SAMPLE_IMAGES]
+    return [samples[i % len(samples)] for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default=None,
+                        help='Path to the Keras model (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--images', type=int, default=32, help='Number of images to process')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16],
+                        help='Batch sizes to compare')
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    images = load_sample_images(args.images)
+
+    # Warm up graph tracing so it does not count against either path
+    predict_tumor(images[0], model)
+
+    start = time.perf_counter()
+    single_results = [predict_tumor(image, model) for image in images]
+    single_seconds = time.perf_counter() - start
+    print(f"predict_tumor:             {len(images) / single_seconds:8.2f} images/s")
+
+    for batch_size in args.batch_sizes:
+        predict_tumor_batch(images[:batch_size], model, batch_size=batch_size)
+
+        start = time.perf_counter()
+        batch_results = predict_tumor_batch(images, model, batch_size=batch_size)
+        batch_seconds = time.perf_counter() - start
+
+        matches = all(
+            np.array_equal(single.result_image, batched.result_image) and single.tumor_present == batched.tumor_present
+            and np.isclose(single.accuracy, batched.accuracy, atol=1e-3)
+            and np.isclose(single.confidence, batched.confidence, atol=1e-3)
+            for single, batched in zip(single_results, batch_results)
+        )
+        print(f"predict_tumor_batch (bs={batch_size:3d}): {len(images) / batch_seconds:8.2f} images/s"
+              f"  speedup {single_seconds / batch_seconds:5.2f}x  {'✅ same results' if matches else '❌ results differ'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Throughput of bulk ingestion vs one uploading() call per scan
+
+Writes synthetic JPEG scans to a temporary directory, then stores them
+once through a loop of uploading() (one insert_one per scan) and once
+through ingest_scans.ingest (decode on a thread pool, unordered
+insert_many batches). Reports images/s for each. Run it against a local
+mongod for representative numbers; --mongomock uses an in-memory stand-in.
+
+Usage:
+    python benchmarks/bench_ingest.py [--uri mongodb://localhost:27017/] [--count 500]
+    python benchmarks/bench_ingest.py --mongomock --batch-size 100 --workers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+
+import numpy as np
+import pymongo
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_EMAIL = 'benchmark-ingest@example.com'
+
+
+def write_scans(directory, count, size):
+    """Write count distinct synthetic JPEG scans and return their paths."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for index in range(count):
+        pixels = rng.integers(0, 256, (size, size), dtype=np.uint8)
+        path = os.path.join(directory, f"scan_{index:05d}.jpg")
+        Image.fromarray(pixels).save(path, format='JPEG', quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'),
+                        help='MongoDB URI of a local mongod')
+    parser.add_argument('--mongomock', action='store_true', help='Use mongomock instead of a real server')
+    parser.add_argument('--count', type=int, default=500, help='Scans to ingest per variant')
+    parser.add_argument('--size', type=int, default=256, help='Side of the square synthetic scans')
+    parser.add_argument('--batch-size', type=int, default=100, help='Scans per insert_many')
+    parser.add_argument('--workers', type=int, default=4, help='Decode threads for bulk ingestion')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        pymongo.MongoClient = mongomock.MongoClient
+    else:
+        os.environ['MONGO_URI'] = args.uri
+    os.environ.setdefault('STORAGE_BACKEND', 'inline')
+
+    from db_utility import close_client, get_scans_collection
+    from ingest_scans import collect_sources, ingest
+    from upload_utility import uploading
+
+    collection = get_scans_collection()
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_scans(directory, args.count, args.size)
+
+        collection.delete_many({'user': BENCH_EMAIL})
+        start = time.perf_counter()
+        for path in paths:
+            with open(path, 'rb') as f:
+                source = f.read()
+            ok, message = uploading(Image.open(path), BENCH_EMAIL, source=source)
+            if not ok:
+                raise RuntimeError(message)
+        sequential = args.count / (time.perf_counter() - start)
+
+        collection.delete_many({'user': BENCH_EMAIL})
+        start = time.perf_counter()
+        with ExitStack() as archives:
+            counts = ingest(collect_sources([directory], archives), BENCH_EMAIL, batch_size=args.batch_size,
+                            workers=args.workers)
+        bulk = args.count / (time.perf_counter() - start)
+        if counts['inserted'] != args.count:
+            raise RuntimeError(f"bulk ingestion stored {counts}")
+
+    collection.delete_many({'user': BENCH_EMAIL})
+    close_client()
+
+    print(f"{'variant':<34}{'images/s':>10}")
+    print(f"{'uploading() per scan':<34}{sequential:>10.1f}")
+    print(f"{f'ingest (batch {args.batch_size}, {args.workers} workers)':<34}{bulk:>10.1f}")
+    print(f"speedup: {bulk / sequential:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
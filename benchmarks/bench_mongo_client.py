@@ -0,0 +1,82 @@
+"""
+Per-call latency of a fresh MongoClient vs the shared pooled client
+
+Times get_user_image_count through the shared client from db_utility
+against the previous pattern of building and closing a new MongoClient on
+every call. Run it against a local mongod for representative numbers;
+--mongomock uses an in-memory stand-in (no connection setup cost, so it
+only checks that both paths work).
+
+Usage:
+    python benchmarks/bench_mongo_client.py [--uri mongodb://localhost:27017/] [--calls 200]
+    python benchmarks/bench_mongo_client.py --mongomock
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import pymongo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_EMAIL = 'benchmark@example.com'
+
+
+def fresh_client_count(uri, email):
+    """The previous per-call pattern: connect, count, close."""
+    client = pymongo.MongoClient(uri)
+    try:
+        return client['Brain']['scans'].count_documents({'user': email})
+    finally:
+        client.close()
+
+
+def time_calls(func, calls):
+    """Return per-call latencies in milliseconds."""
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<14} mean {statistics.mean(latencies):8.3f} ms  "
+          f"p50 {statistics.median(latencies):8.3f} ms  p95 {p95:8.3f} ms")
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'),
+                        help='MongoDB URI of a local mongod')
+    parser.add_argument('--calls', type=int, default=200, help='Calls per variant')
+    parser.add_argument('--mongomock', action='store_true', help='Use mongomock instead of a real server')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        pymongo.MongoClient = mongomock.MongoClient
+    os.environ['MONGO_URI'] = args.uri
+
+    from db_utility import close_client
+    from retrieval_utility import get_user_image_count
+
+    # Warm up both paths (imports, first server discovery)
+    fresh_client_count(args.uri, BENCH_EMAIL)
+    get_user_image_count(BENCH_EMAIL)
+
+    fresh_mean = summarize('fresh client', time_calls(lambda: fresh_client_count(args.uri, BENCH_EMAIL), args.calls))
+    pooled_mean = summarize('pooled client', time_calls(lambda: get_user_image_count(BENCH_EMAIL), args.calls))
+    print(f"per-call saving: {fresh_mean - pooled_mean:.3f} ms ({fresh_mean / pooled_mean:.1f}x)")
+
+    close_client()
+
+
+if __name__ == '__main__':
+    main()
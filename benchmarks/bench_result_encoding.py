@@ -0,0 +1,76 @@
+"""
+Size and timing of compact result encoding
+
+For synthetic masks on a sample scan, compares what a session used to hold
+(the (H, 2W, 3) uint8 result image) with a CompactResult (packed, deflated
+mask plus scores), both as pickled by Streamlit's session state, and
+reports the time to pack and unpack the mask and the time and payload size
+of each composite layout and encoding.
+
+Usage:
+    python benchmarks/bench_result_encoding.py [--sizes 256 512 1024] [--runs 20]
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from model_utility import analyze_prediction, prepare_image
+from result_utility import COMPOSITE_FORMATS, COMPOSITE_LAYOUTS, CompactResult, PackedMask, render_result
+
+
+def make_prediction(size):
+    """A smooth blob on a low-probability background."""
+    yy, xx = np.mgrid[:size, :size]
+    blob = np.exp(-(((yy - size * 0.4) ** 2 + (xx - size * 0.6) ** 2) / (2 * (size / 10) ** 2)))
+    return (0.1 + blob).astype(np.float32)[np.newaxis, ..., np.newaxis]
+
+
+def time_call(func, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024], help='Square mask sizes')
+    parser.add_argument('--runs', type=int, default=20, help='Timed calls per configuration')
+    args = parser.parse_args()
+
+    source = Image.open(os.path.join(ROOT, 'image1.jpg'))
+    print(f"{'size':>6}  {'result_image KB':>16}{'compact KB':>12}{'pack ms':>9}{'unpack ms':>11}")
+    rendered = []
+    for size in args.sizes:
+        image = source.resize((size, size))
+        display, _ = prepare_image(image, target_size=(size, size))
+        result = analyze_prediction(image, make_prediction(size), display_image=display)
+        compact = CompactResult.from_analysis(result, '0' * 64)
+
+        full_kb = len(pickle.dumps(result.result_image)) / 1024
+        compact_kb = len(pickle.dumps(compact)) / 1024
+        pack_ms = time_call(lambda: PackedMask.pack(result.mask), args.runs)
+        unpack_ms = time_call(compact.mask.unpack, args.runs)
+        print(f"{size:>6}  {full_kb:>16.1f}{compact_kb:>12.2f}{pack_ms:>9.2f}{unpack_ms:>11.2f}")
+
+        for layout in COMPOSITE_LAYOUTS:
+            for image_format in COMPOSITE_FORMATS:
+                payload = render_result(image, compact, layout, image_format)
+                milliseconds = time_call(lambda: render_result(image, compact, layout, image_format), args.runs)
+                rendered.append((size, layout, image_format, milliseconds, len(payload) / 1024))
+
+    print(f"\n{'size':>6}  {'layout':<14}{'format':<8}{'render ms':>10}{'payload KB':>12}")
+    for size, layout, image_format, milliseconds, payload_kb in rendered:
+        print(f"{size:>6}  {layout:<14}{image_format:<8}{milliseconds:>10.2f}{payload_kb:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
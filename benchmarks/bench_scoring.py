@@ -0,0 +1,94 @@
+"""
+Equivalence check and timing for prediction scoring
+
+Compares analyze_prediction (one shared clipped copy, float64-accurate
+moments) with analyze_prediction_reference (separate min / max / clip /
+mean / std passes and a second threshold) on synthetic probability maps,
+end to end and for the statistics alone (end to end, both are dominated
+by connected-component labelling in remove_small_objects). It exits with
+a non-zero status if the masks differ or the scores drift by more than
+1e-3.
+
+Usage:
+    python benchmarks/bench_scoring.py [--sizes 256 1024 2048] [--runs 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_utility import analyze_prediction, analyze_prediction_reference, prediction_statistics
+
+
+def make_prediction(size, seed=0, tumor=True):
+    """Smooth background noise slightly outside [0, 1] plus an optional blob."""
+    rng = np.random.default_rng(seed)
+    prediction = rng.normal(0.1, 0.08, (1, size, size, 1)).astype(np.float32)
+    if tumor:
+        yy, xx = np.mgrid[:size, :size]
+        blob = np.exp(-(((yy - size * 0.4) ** 2 + (xx - size * 0.6) ** 2) / (2 * (size / 10) ** 2)))
+        prediction[0, ..., 0] += blob.astype(np.float32)
+    return prediction
+
+
+def reference_statistics(prediction, threshold=0.5):
+    """The separate passes analyze_prediction_reference makes over the map."""
+    np.min(prediction), np.max(prediction)
+    prediction = np.clip(prediction, 0, 1)
+    above = np.squeeze(prediction) > threshold
+    np.max(prediction), np.mean(prediction), np.std(prediction)
+    tumor_region = prediction[prediction > threshold]
+    if tumor_region.size:
+        np.mean(tumor_region), np.var(tumor_region)
+    return above
+
+
+def time_call(func, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024, 2048])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    ok = True
+    print(f"{'size':>6} {'tumor':>6}  {'reference ms':>13}{'fused ms':>10}{'speedup':>9}"
+          f"  {'stats ref ms':>13}{'stats fused ms':>15}{'speedup':>9}  result")
+    for size in args.sizes:
+        for tumor in (True, False):
+            prediction = make_prediction(size, tumor=tumor)
+            display = np.zeros((size, size, 3), dtype=np.uint8)
+            image = Image.fromarray(display)
+
+            result_image, tumor_present, accuracy, confidence = analyze_prediction_reference(
+                image, prediction, display_image=display)
+            result = analyze_prediction(image, prediction, display_image=display)
+            same = (np.array_equal(result_image, result.result_image) and bool(tumor_present) == result.tumor_present
+                    and abs(float(accuracy) - result.accuracy) < 1e-3
+                    and abs(float(confidence) - result.confidence) < 1e-3)
+            ok &= same
+
+            reference_ms = time_call(lambda: analyze_prediction_reference(image, prediction, display_image=display),
+                                     args.runs)
+            fused_ms = time_call(lambda: analyze_prediction(image, prediction, display_image=display), args.runs)
+            stats_reference_ms = time_call(lambda: reference_statistics(prediction), args.runs)
+            stats_fused_ms = time_call(lambda: prediction_statistics(prediction), args.runs)
+            print(f"{size:>6} {str(tumor):>6}  {reference_ms:>13.2f}{fused_ms:>10.2f}{reference_ms / fused_ms:>8.2f}x"
+                  f"  {stats_reference_ms:>13.2f}{stats_fused_ms:>15.2f}{stats_reference_ms / stats_fused_ms:>8.2f}x"
+                  f"  {'✅ same' if same else '❌ differs'}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
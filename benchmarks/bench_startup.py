@@ -0,0 +1,104 @@
+"""
+Startup benchmark: time to first render and time to first prediction
+
+Each measurement runs in a fresh Python process so import and model-load
+costs are not hidden by caches:
+
+  first render      finale.py rendered once (login page) via Streamlit's AppTest
+  cold prediction   load_model + the first predict_tumor call, no warm-up
+  warm prediction   background warm-up started at "server start"; the first
+                    request arrives --think-time seconds later
+
+Firebase variables that are not set are filled with placeholders; the
+login page is rendered without contacting Firebase.
+
+Usage:
+    python benchmarks/bench_startup.py [--model model.keras] [--think-time 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIREBASE_VARS = ['FIREBASE_API_KEY', 'FIREBASE_AUTH_DOMAIN', 'FIREBASE_DATABASE_URL',
+                 'FIREBASE_PROJECT_ID', 'FIREBASE_STORAGE_BUCKET', 'FIREBASE_MESSAGING_SENDER_ID',
+                 'FIREBASE_APP_ID', 'FIREBASE_MEASUREMENT_ID']
+
+FIRST_RENDER = '''
+import json, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+at = AppTest.from_file({finale!r}, default_timeout=300)
+at.run()
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "errors": [str(e.value) for e in at.exception]}}))
+'''
+
+COLD_PREDICTION = '''
+import json, time
+start = time.perf_counter()
+from PIL import Image
+import model_utility
+model = model_utility.load_model({model!r})
+model_utility.predict_tumor(Image.open({image!r}).convert('RGB'), model)
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+'''
+
+WARM_PREDICTION = '''
+import json, time
+start = time.perf_counter()
+from PIL import Image
+import model_utility
+model_utility.start_background_warmup({model!r})
+time.sleep({think_time})
+request = time.perf_counter()
+model = model_utility.get_model({model!r})
+model_utility.predict_tumor(Image.open({image!r}).convert('RGB'), model)
+done = time.perf_counter()
+print(json.dumps({{"seconds": done - start, "request_latency": done - request}}))
+'''
+
+
+def run_child(code, env):
+    """Run code in a fresh interpreter and parse the JSON it prints last."""
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default=os.getenv('MODEL_PATH', os.path.join(ROOT, 'model.keras')),
+                        help='Path to the Keras model')
+    parser.add_argument('--image', default=os.path.join(ROOT, 'image1.jpg'), help='Sample scan')
+    parser.add_argument('--think-time', type=float, default=5.0,
+                        help='Seconds between server start and the first request in the warm scenario')
+    parser.add_argument('--json', default=None, help='Optional path to write the results as JSON')
+    args = parser.parse_args()
+
+    env = dict(os.environ, MODEL_PATH=args.model, PYTHONPATH=ROOT)
+    for var in FIREBASE_VARS:
+        env.setdefault(var, 'benchmark-placeholder')
+
+    results = {
+        'first_render_s': run_child(FIRST_RENDER.format(finale=os.path.join(ROOT, 'finale.py')), env),
+        'cold_first_prediction_s': run_child(COLD_PREDICTION.format(model=args.model, image=args.image), env),
+        'warm_first_prediction_s': run_child(WARM_PREDICTION.format(model=args.model, image=args.image,
+                                                                    think_time=args.think_time), env)
+    }
+
+    print(f"time to first render:             {results['first_render_s']['seconds']:7.2f} s")
+    print(f"time to first prediction (cold):  {results['cold_first_prediction_s']['seconds']:7.2f} s")
+    print(f"first request latency (warmed):   {results['warm_first_prediction_s']['request_latency']:7.2f} s "
+          f"(request sent {args.think_time:.1f} s after start)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
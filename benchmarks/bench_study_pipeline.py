@@ -0,0 +1,59 @@
+"""
+Benchmark the streaming study pipeline
+
+Builds synthetic NumPy volumes of increasing depth from a sample scan and
+reports slices/s and peak Python-side memory (tracemalloc) of
+analyze_study next to the size a float32 copy of the volume would take.
+The streaming stages hold a bounded number of slices; only the uint8 mask
+and the int32 labels of the 3D component filter scale with depth.
+
+Usage:
+    python benchmarks/bench_study_pipeline.py [--model model.keras]
+        [--depths 16 64 128] [--batch-size 8] [--queue-size 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image
+
+from model_utility import load_model
+from study_utility import analyze_study, open_study
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default=None, help='Model path (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--depths', type=int, nargs='+', default=[16, 64, 128], help='Slices per synthetic study')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=16)
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    scan = np.array(Image.open(os.path.join(ROOT, 'image1.jpg')).convert('L').resize((256, 256)))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        print(f"{'slices':>7}{'seconds':>9}{'slices/s':>10}{'peak MB':>10}{'float32 volume MB':>19}")
+        for depth in args.depths:
+            path = os.path.join(temp_dir, f"study_{depth}.npy")
+            np.save(path, np.repeat(scan[np.newaxis], depth, axis=0))
+            with open_study(path) as study:
+                tracemalloc.start()
+                start = time.perf_counter()
+                analyze_study(study, model, batch_size=args.batch_size, queue_size=args.queue_size)
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+            full_volume = depth * 256 * 256 * 3 * 4 / (1024 * 1024)
+            print(f"{depth:>7}{seconds:>9.2f}{depth / seconds:>10.1f}{peak:>10.1f}{full_volume:>19.1f}")
+
+
+if __name__ == '__main__':
+    main()
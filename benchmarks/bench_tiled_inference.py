@@ -0,0 +1,64 @@
+"""
+Benchmark tiled inference against the whole-image resize path
+
+For increasing scan sizes, reports wall time and peak Python-side memory
+(tracemalloc) of predict_tiled for a few tile batch sizes, next to the
+default resize-to-256 path. Peak memory of the tiled path should grow with
+the output map (H x W), not with the number of tiles.
+
+Usage:
+    python benchmarks/bench_tiled_inference.py [--model model.keras]
+        [--sizes 512 1024 2048] [--tile-batch-sizes 1 4 8] [--overlap 64]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image
+
+from model_utility import load_model, predict_tiled, preprocess_image_segmentation
+
+
+def measure(func):
+    """Run func once and return (seconds, peak traced MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default=None, help='Model path (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048], help='Square scan sizes')
+    parser.add_argument('--tile-batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--overlap', type=int, default=64)
+    parser.add_argument('--window', default='hann')
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    source = Image.open(os.path.join(ROOT, 'image1.jpg')).convert('RGB')
+    # Trace the model once so the first measurement is not dominated by it
+    predict_tiled(source.resize((256, 256)), model)
+
+    print(f"{'size':>6}  {'mode':<18}{'seconds':>9}{'peak MB':>10}")
+    for size in args.sizes:
+        image = source.resize((size, size))
+        seconds, peak = measure(lambda: model.predict(preprocess_image_segmentation(image), verbose=0))
+        print(f"{size:>6}  {'resize to 256':<18}{seconds:>9.3f}{peak:>10.1f}")
+        for tile_batch_size in args.tile_batch_sizes:
+            seconds, peak = measure(lambda: predict_tiled(image, model, overlap=args.overlap, window=args.window,
+                                                          tile_batch_size=tile_batch_size))
+            print(f"{size:>6}  {f'tiled, batch {tile_batch_size}':<18}{seconds:>9.3f}{peak:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Compare inference backends against the Keras baseline
+
+For each backend (in its own process so memory numbers are isolated) this
+reports model load time, mean per-image latency, peak resident memory and
+artifact size on the bundled sample images, plus the mean mask IoU against
+the Keras baseline.
+
+Usage:
+    python benchmarks/compare_backends.py [--model model.keras]
+        [--backends keras tflite-dynamic tflite-int8 onnx] [--runs 5] [--json out.json]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_IMAGES = ['image1.jpg', 'image2.jpg', 'image3.jpg', 'image4.jpg']
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_backend(backend, model_path, runs, masks_path):
+    """Measure one backend in the current process and save its masks."""
+    from PIL import Image
+    from backend_utility import artifact_path
+    from model_utility import load_model, predict_tumor, resolve_model_path
+
+    images = [Image.open(os.path.join(ROOT, name)).convert('RGB') for name in SAMPLE_IMAGES]
+
+    start = time.perf_counter()
+    model = load_model(model_path, backend=backend)
+    load_seconds = time.perf_counter() - start
+
+    # First call includes graph tracing / tensor allocation; not timed
+    results = [predict_tumor(image, model) for image in images]
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for image in images:
+            predict_tumor(image, model)
+    latency_ms = (time.perf_counter() - start) / (runs * len(images)) * 1000
+
+    masks = np.stack([result.mask > 0 for result in results])
+    np.save(masks_path, masks)
+
+    resolved = resolve_model_path(model_path)
+    artifact = resolved if backend == 'keras' else artifact_path(resolved, backend)
+    return {
+        'backend': backend,
+        'load_s': load_seconds,
+        'latency_ms': latency_ms,
+        'peak_rss_mb': peak_rss_mb(),
+        'artifact_mb': os.path.getsize(artifact) / (1024 * 1024)
+    }
+
+
+def mask_iou(a, b):
+    """Mean IoU over images; two empty masks count as a perfect match."""
+    scores = []
+    for mask_a, mask_b in zip(a, b):
+        union = np.logical_or(mask_a, mask_b).sum()
+        scores.append(1.0 if union == 0 else np.logical_and(mask_a, mask_b).sum() / union)
+    return float(np.mean(scores))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default=None, help='Keras model path (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--backends', nargs='+', default=['keras', 'tflite-dynamic', 'tflite-int8'],
+                        help='Backends to compare (keras is always run as the baseline)')
+    parser.add_argument('--runs', type=int, default=5, help='Timed passes over the sample images')
+    parser.add_argument('--json', default=None, help='Optional path to write the results as JSON')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--masks', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_backend(args.child, args.model, args.runs, args.masks)))
+        return
+
+    backends = ['keras'] + [backend for backend in args.backends if backend != 'keras']
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        masks = {}
+        for backend in backends:
+            masks_path = os.path.join(temp_dir, f"{backend}.npy")
+            command = [sys.executable, os.path.abspath(__file__), '--child', backend,
+                       '--runs', str(args.runs), '--masks', masks_path]
+            if args.model:
+                command += ['--model', args.model]
+            completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"❌ {backend} failed: {completed.stderr.strip().splitlines()[-1]}")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            masks[backend] = np.load(masks_path)
+            result['mask_iou_vs_keras'] = mask_iou(masks['keras'], masks[backend]) if 'keras' in masks else None
+            results.append(result)
+
+    print(f"{'backend':<16}{'load s':>9}{'ms/image':>10}{'peak RSS MB':>13}{'artifact MB':>13}{'IoU':>8}")
+    for result in results:
+        iou = result['mask_iou_vs_keras']
+        print(f"{result['backend']:<16}{result['load_s']:>9.2f}{result['latency_ms']:>10.1f}"
+              f"{result['peak_rss_mb']:>13.1f}{result['artifact_mb']:>13.2f}"
+              f"{iou if iou is not None else float('nan'):>8.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
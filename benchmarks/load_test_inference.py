@@ -0,0 +1,85 @@
+"""
+Concurrent load test for the inference server
+
+Simulates several Streamlit sessions analysing scans at the same time and
+reports request latency percentiles and throughput. With --inline the same
+load runs predict_tumor directly in each client thread on one shared model,
+which is what sessions do without the server, for comparison.
+
+Usage:
+    python inference_server.py --max-batch-size 8 --max-wait-ms 10 &
+    python benchmarks/load_test_inference.py --url http://127.0.0.1:8765 --concurrency 8 --requests 64
+    python benchmarks/load_test_inference.py --inline --concurrency 8 --requests 64
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from inference_client import submit_job, wait_for_job
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default=os.getenv('INFERENCE_SERVER_URL', 'http://127.0.0.1:8765'),
+                        help='Inference server base URL')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=64, help='Total requests')
+    parser.add_argument('--image', default=os.path.join(ROOT, 'image1.jpg'), help='Scan to submit')
+    parser.add_argument('--inline', action='store_true',
+                        help='Run predict_tumor in-process per client instead of using the server')
+    parser.add_argument('--model', default=None, help='Model path for --inline')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+
+    if args.inline:
+        from PIL import Image
+        from model_utility import get_model, predict_tumor
+        model = get_model(args.model)
+
+        def one_request():
+            predict_tumor(Image.open(BytesIO(image_bytes)), model)
+    else:
+        def one_request():
+            wait_for_job(submit_job(image_bytes, server_url=args.url), server_url=args.url, poll_interval=0.01)
+
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def timed_request(_):
+        start = time.perf_counter()
+        one_request()
+        elapsed = (time.perf_counter() - start) * 1000
+        with latencies_lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(timed_request, range(args.requests)))
+    wall = time.perf_counter() - start
+
+    mode = 'inline' if args.inline else f"server {args.url}"
+    print(f"{mode}: {args.requests} requests, concurrency {args.concurrency}")
+    print(f"  throughput {args.requests / wall:8.2f} req/s")
+    print(f"  latency    p50 {percentile(latencies, 0.5):8.1f} ms  "
+          f"p95 {percentile(latencies, 0.95):8.1f} ms  "
+          f"p99 {percentile(latencies, 0.99):8.1f} ms  "
+          f"mean {statistics.mean(latencies):8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""
+Per-stage benchmark suite for the segmentation pipeline
+
+Times every stage of an analysis separately, across image sizes and batch
+sizes, on the sample scans (image1-4.jpg) plus synthetic inputs:
+
+    decode          Image.open + load of the sample scans
+    preprocess      preprocess_image_segmentation (resize + normalize)
+    predict         model.predict, per batch size (ms per image)
+    postprocess     postprocess_mask (threshold + remove_small_objects)
+    small_objects   remove_small_objects alone, on masks of each size
+    scoring         prediction_statistics + score_statistics
+    analyze         analyze_prediction (mask, scores and result image)
+    predict_tumor   end to end on each sample scan
+    uploading       upload_utility.uploading into a local Mongo stand-in
+    image_ret       retrieval_utility.image_ret of the uploaded history
+
+When model.keras (or MODEL_PATH / --model) is missing, a small untrained
+encoder-decoder with the same input and output shapes stands in, so the
+suite runs anywhere; model timings are then only comparable with other
+stand-in runs (the JSON records which model was used). Mongo stages use
+mongomock unless --mongo-uri points at a real server.
+
+Results are written as JSON; --compare reports the change against an
+earlier run and exits non-zero when a stage slowed down by more than
+--tolerance.
+
+Usage:
+    python benchmarks/run_suite.py --output bench.json
+    python benchmarks/run_suite.py --sizes 256 1024 --batch-sizes 1 8 --runs 10 --output new.json --compare bench.json
+    python benchmarks/run_suite.py --stages preprocess scoring --stand-in
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import model_utility
+from model_utility import (analyze_prediction, postprocess_mask, prediction_statistics, predict_tumor,
+                           preprocess_image_segmentation, remove_small_objects, score_statistics)
+
+SAMPLE_SCANS = ['image1.jpg', 'image2.jpg', 'image3.jpg', 'image4.jpg']
+STAGES = ['decode', 'preprocess', 'predict', 'postprocess', 'small_objects', 'scoring', 'analyze',
+          'predict_tumor', 'uploading', 'image_ret']
+BENCH_EMAIL = 'benchmark-suite@example.com'
+
+
+def build_stand_in_model(input_shape=(256, 256, 3)):
+    """Untrained encoder-decoder with the segmentation model's input and output shapes."""
+    keras = model_utility.get_tensorflow().keras
+    inputs = keras.Input(shape=input_shape)
+    x = keras.layers.Conv2D(16, 3, padding='same', activation='relu')(inputs)
+    x = keras.layers.MaxPooling2D()(x)
+    x = keras.layers.Conv2D(32, 3, padding='same', activation='relu')(x)
+    x = keras.layers.UpSampling2D()(x)
+    x = keras.layers.Conv2D(16, 3, padding='same', activation='relu')(x)
+    outputs = keras.layers.Conv2D(1, 1, activation='sigmoid')(x)
+    return keras.Model(inputs, outputs, name='stand_in')
+
+
+def get_benchmark_model(model_path=None, stand_in=False):
+    """
+    Load the real model, or build the stand-in when it is missing
+
+    Returns:
+        model: Model with predict()
+        description: Model path, or 'stand-in'
+    """
+    path = model_utility.resolve_model_path(model_path)
+    if not stand_in and os.path.exists(path):
+        return model_utility.load_model(path), path
+    if not stand_in:
+        print(f"{path} not found; using an untrained stand-in model", file=sys.stderr)
+    return build_stand_in_model(), 'stand-in'
+
+
+def synthetic_scan(size, seed=0):
+    """Grayscale noise with a bright elliptical blob, as an RGB PIL image."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    blob = np.exp(-(((yy - size * 0.4) ** 2) / (2 * (size / 8) ** 2) + ((xx - size * 0.6) ** 2) / (2 * (size / 12) ** 2)))
+    pixels = np.clip(40 + rng.normal(0, 12, (size, size)) + 180 * blob, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).convert('RGB')
+
+
+def synthetic_prediction(size, seed=0):
+    """Probability map of shape (1, size, size, 1) with one tumor-like region and speckle."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    blob = np.exp(-(((yy - size * 0.4) ** 2 + (xx - size * 0.6) ** 2) / (2 * (size / 10) ** 2)))
+    prediction = 0.1 + 0.9 * blob + rng.normal(0, 0.15, (size, size))
+    return np.clip(prediction, 0, 1).astype(np.float32)[np.newaxis, ..., np.newaxis]
+
+
+def measure(func, runs, warmup=1, items=1):
+    """
+    Time repeated calls
+
+    Returns:
+        stats: Dictionary of per-call milliseconds (mean, median, p95, min,
+               stdev), runs and items per second
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(samples)
+    mean = statistics.mean(samples)
+    return {
+        'mean_ms': mean,
+        'median_ms': statistics.median(samples),
+        'p95_ms': ordered[math.ceil(len(ordered) * 0.95) - 1],
+        'min_ms': ordered[0],
+        'stdev_ms': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'runs': runs,
+        'items_per_s': items / (mean / 1000) if mean else None
+    }
+
+
+class Suite:
+    """Collects results as {'stage', 'params', stats...} records."""
+
+    def __init__(self, runs, warmup):
+        self.runs = runs
+        self.warmup = warmup
+        self.results = []
+
+    def run(self, stage, params, func, items=1, runs=None):
+        stats = measure(func, runs or self.runs, warmup=self.warmup, items=items)
+        record = {'stage': stage, 'params': params, **stats}
+        self.results.append(record)
+        label = ' '.join(f"{key}={value}" for key, value in params.items())
+        print(f"{stage:<14}{label:<34}{stats['mean_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['items_per_s'] or 0:>11.1f}", flush=True)
+        return record
+
+
+def load_samples():
+    """Sample scans as (name, encoded bytes)."""
+    samples = []
+    for name in SAMPLE_SCANS:
+        with open(os.path.join(ROOT, name), 'rb') as f:
+            samples.append((name, f.read()))
+    return samples
+
+
+def decode(data):
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image
+
+
+def run_compute_stages(suite, stages, model, sizes, batch_sizes):
+    samples = load_samples()
+
+    if 'decode' in stages:
+        for name, data in samples:
+            suite.run('decode', {'input': name}, lambda: decode(data))
+
+    inputs = [(name, decode(data)) for name, data in samples]
+    inputs += [(f"synthetic-{size}", synthetic_scan(size)) for size in sizes]
+
+    if 'preprocess' in stages:
+        for name, image in inputs:
+            suite.run('preprocess', {'input': name, 'size': f"{image.width}x{image.height}"},
+                      lambda: preprocess_image_segmentation(image))
+
+    if 'predict' in stages:
+        model_input = preprocess_image_segmentation(inputs[0][1])
+        for batch_size in batch_sizes:
+            batch = np.repeat(model_input, batch_size, axis=0)
+            record = suite.run('predict', {'batch_size': batch_size},
+                               lambda: model.predict(batch, batch_size=batch_size, verbose=0), items=batch_size)
+            record['ms_per_image'] = record['mean_ms'] / batch_size
+
+    for size in sizes:
+        prediction = synthetic_prediction(size)
+        if 'postprocess' in stages:
+            suite.run('postprocess', {'size': size}, lambda: postprocess_mask(prediction))
+        if 'small_objects' in stages:
+            mask = (prediction[0, ..., 0] > 0.5).astype(np.uint8)
+            work = np.empty_like(mask)
+
+            def clean():
+                # remove_small_objects edits its input in place: restore the
+                # uncleaned mask each run (a memcpy, negligible next to labelling)
+                np.copyto(work, mask)
+                return remove_small_objects(work)
+            suite.run('small_objects', {'size': size}, clean)
+        if 'scoring' in stages:
+            def score():
+                above, stats = prediction_statistics(prediction)
+                return score_statistics(stats, bool(above.any()))
+            suite.run('scoring', {'size': size}, score)
+        if 'analyze' in stages:
+            image = synthetic_scan(size)
+            display = np.asarray(image)
+            suite.run('analyze', {'size': size},
+                      lambda: analyze_prediction(image, prediction, display_image=display))
+
+    if 'predict_tumor' in stages:
+        for name, image in inputs[:len(samples)]:
+            suite.run('predict_tumor', {'input': name}, lambda: predict_tumor(image, model))
+
+
+def run_storage_stages(suite, stages, mongo_uri, history_sizes):
+    """Upload and retrieval timings; returns False when no Mongo is available."""
+    import pymongo
+
+    if mongo_uri is None:
+        try:
+            import mongomock
+        except ImportError:
+            print("mongomock is not installed and no --mongo-uri was given; skipping storage stages",
+                  file=sys.stderr)
+            return False
+        pymongo.MongoClient = mongomock.MongoClient
+    else:
+        os.environ['MONGO_URI'] = mongo_uri
+    os.environ.setdefault('STORAGE_BACKEND', 'inline')
+
+    from db_utility import close_client, get_scans_collection
+    from retrieval_utility import image_ret
+    from upload_utility import uploading
+
+    images = [synthetic_scan(256, seed=seed) for seed in range(max(history_sizes) + suite.runs + suite.warmup)]
+    encoded = []
+    for image in images:
+        byte_io = BytesIO()
+        image.save(byte_io, format='JPEG', quality=90)
+        encoded.append(byte_io.getvalue())
+
+    get_scans_collection().delete_many({'user': BENCH_EMAIL})
+    if 'uploading' in stages:
+        # Distinct scans every call, so content-hash deduplication never short-circuits
+        counter = iter(range(len(images)))
+
+        def upload():
+            index = next(counter)
+            ok, message = uploading(Image.open(BytesIO(encoded[index])), BENCH_EMAIL, source=encoded[index])
+            if not ok:
+                raise RuntimeError(message)
+        suite.run('uploading', {'backend': os.environ['STORAGE_BACKEND'], 'size': 256}, upload)
+
+    if 'image_ret' in stages:
+        collection = get_scans_collection()
+        for count in history_sizes:
+            collection.delete_many({'user': BENCH_EMAIL})
+            for index in range(count):
+                uploading(Image.open(BytesIO(encoded[index])), BENCH_EMAIL, source=encoded[index])
+            suite.run('image_ret', {'images': count}, lambda: image_ret(BENCH_EMAIL), items=count)
+
+    get_scans_collection().delete_many({'user': BENCH_EMAIL})
+    close_client()
+    return True
+
+
+def environment(model_description):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    tf = model_utility.get_tensorflow()
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__,
+        'model': model_description,
+        'inference_backend': os.getenv('INFERENCE_BACKEND', 'keras'),
+        'skimage': model_utility.skimage_available()
+    }
+
+
+def result_key(record):
+    return record['stage'] + ' ' + ' '.join(f"{key}={value}" for key, value in sorted(record['params'].items()))
+
+
+def compare(baseline_path, results, tolerance):
+    """
+    Print the change of each stage's median against a previous run
+
+    Returns:
+        regressions: Number of stages slower than the baseline by more than tolerance
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {result_key(record): record for record in baseline['results']}
+    models = baseline['environment'].get('model'), results['environment']['model']
+    if None not in models and models[0] != models[1]:
+        print(f"note: baseline used model {baseline['environment'].get('model')!r}, "
+              f"this run {results['environment']['model']!r}")
+
+    print(f"\ncompared with {baseline_path} ({baseline['environment'].get('commit')})")
+    print(f"{'stage':<50}{'before ms':>11}{'after ms':>10}{'change':>9}")
+    regressions = 0
+    for record in results['results']:
+        before = previous.get(result_key(record))
+        if before is None:
+            continue
+        change = record['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0.0
+        slower = change > tolerance
+        regressions += slower
+        print(f"{result_key(record):<50}{before['median_ms']:>11.2f}{record['median_ms']:>10.2f}"
+              f"{change * 100:>+8.1f}%{'  ⚠️ slower' if slower else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default=None, help='Model path (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--stand-in', action='store_true', help='Use the stand-in model even if the model exists')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='Stages to run')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024, 2048],
+                        help='Square synthetic image / mask sizes')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16], help='model.predict batch sizes')
+    parser.add_argument('--history-sizes', type=int, nargs='+', default=[10, 50],
+                        help='Stored images for the image_ret stage')
+    parser.add_argument('--runs', type=int, default=10, help='Timed calls per configuration')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed calls before each configuration')
+    parser.add_argument('--mongo-uri', default=None, help='Real MongoDB for the storage stages (default: mongomock)')
+    parser.add_argument('--output', default=None, help='Write results as JSON to this path')
+    parser.add_argument('--compare', default=None, help='Earlier JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown of a median reported as a regression (default: 0.2)')
+    args = parser.parse_args()
+
+    needs_model = {'predict', 'predict_tumor'} & set(args.stages)
+    model, model_description = get_benchmark_model(args.model, args.stand_in) if needs_model else (None, None)
+
+    suite = Suite(args.runs, args.warmup)
+    print(f"{'stage':<14}{'params':<34}{'mean ms':>10}{'p95 ms':>10}{'items/s':>11}")
+    run_compute_stages(suite, args.stages, model, args.sizes, args.batch_sizes)
+    if {'uploading', 'image_ret'} & set(args.stages):
+        run_storage_stages(suite, args.stages, args.mongo_uri, args.history_sizes)
+
+    results = {'environment': environment(model_description), 'results': suite.results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {len(suite.results)} results to {args.output}")
+
+    if args.compare:
+        regressions = compare(args.compare, results, args.tolerance)
+        if regressions:
+            print(f"\n{regressions} stage(s) slower than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics_utility import record_cache_lookup
+from result_utility import CompactResult, PackedMask
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 128
+
+
+class ResultCache:
+    """
+    LRU cache of analysis results with an optional on-disk tier
+
+    Results are keyed by the content hash of the uploaded bytes plus the
+    model version and the post-processing parameters, so a repeat analysis
+    of the same scan can skip inference entirely. Entries are CompactResults
+    (packed mask and scores), so a full cache holds no image pixels.
+
+    Args:
+        max_entries: Maximum number of results kept in memory
+        disk_dir: Optional directory for a persistent second tier
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_hash, model_version, threshold, min_size):
+        """Build the cache key for one analysis."""
+        return f"{image_hash}:{model_version}:{threshold}:{min_size}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def get(self, key):
+        """
+        Look up a result, promoting disk hits into memory
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            result: CompactResult, or None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache_lookup('result', True)
+                return self._entries[key]
+
+        result = None
+        if self.disk_dir:
+            result = self._read_disk(key)
+            record_cache_lookup('result_disk', result is not None)
+
+        with self._lock:
+            record_cache_lookup('result', result is not None)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """
+        Store a result in memory and, if configured, on disk
+
+        Args:
+            key: Key from make_key
+            result: CompactResult
+        """
+        with self._lock:
+            self._remember(key, result)
+        if self.disk_dir:
+            self._write_disk(key, result)
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                # Entries written before the statistics were added lack them
+                values = {field: data[field].item() for field in CompactResult.FIELDS if field in data.files}
+                mask = PackedMask(data['mask_shape'], data['mask_data'].tobytes())
+                return CompactResult(data['image_hash'].item(), mask, **values)
+        except Exception as e:
+            logger.warning("Ignoring unreadable cache entry %s: %s", path, e)
+            return None
+
+    def _write_disk(self, key, result):
+        path = self._disk_path(key)
+        temp_path = path + '.tmp'
+        try:
+            # Write to a temporary file first so readers never see partial entries
+            with open(temp_path, 'wb') as f:
+                scalars = {field: value for field, value in result.to_dict().items() if value is not None}
+                # The mask is already deflated, so plain savez is enough
+                np.savez(f, mask_shape=np.asarray(result.mask.shape),
+                         mask_data=np.frombuffer(result.mask.data, dtype=np.uint8),
+                         image_hash=np.asarray(result.image_hash), **scalars)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("Could not write cache entry %s: %s", path, e)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# Process-wide cache, created lazily on first use
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Get the shared, process-wide result cache
+
+    Configuration comes from the environment:
+
+        RESULT_CACHE_SIZE  in-memory entries (default: 128)
+        RESULT_CACHE_DIR   directory for the on-disk tier (default: disabled)
+
+    Returns:
+        cache: ResultCache shared by all callers
+    """
+    global _result_cache
+
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    max_entries=int(os.getenv('RESULT_CACHE_SIZE', str(DEFAULT_CACHE_SIZE))),
+                    disk_dir=os.getenv('RESULT_CACHE_DIR') or None
+                )
+    return _result_cache
@@ -0,0 +1,131 @@
+import atexit
+import logging
+import os
+import threading
+
+import pymongo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/'
+DATABASE_NAME = 'Brain'
+
+# All users' scans live in one collection, keyed by the 'user' field (their email)
+SCANS_COLLECTION = 'scans'
+
+# Process-wide client, created lazily on first use
+_client = None
+_client_lock = threading.Lock()
+
+# Whether this process already ensured the scans indexes
+_scans_indexed = False
+
+
+def get_client():
+    """
+    Get the shared, process-wide MongoDB client
+
+    The client is created on first use and reused afterwards, so callers
+    share one connection pool instead of paying for connection setup and
+    server discovery on every call. Configuration comes from the environment:
+
+        MONGO_URI                          (default: mongodb://localhost:27017/)
+        MONGO_MAX_POOL_SIZE                (default: 50)
+        MONGO_MIN_POOL_SIZE                (default: 0)
+        MONGO_SERVER_SELECTION_TIMEOUT_MS  (default: 5000)
+
+    Returns:
+        client: pymongo.MongoClient shared by all callers
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            # Re-check under the lock so concurrent first callers build one client
+            if _client is None:
+                _client = pymongo.MongoClient(
+                    os.getenv('MONGO_URI', DEFAULT_MONGO_URI),
+                    maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', '50')),
+                    minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+                    serverSelectionTimeoutMS=int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+                )
+    return _client
+
+
+def get_database():
+    """
+    Get the application database from the shared client
+
+    Returns:
+        db: pymongo Database for the Brain app
+    """
+    return get_client()[DATABASE_NAME]
+
+
+def ensure_scan_indexes(collection):
+    """
+    Create the indexes every scans query relies on
+
+    (user, upload_date, _id) serves history listings and counts; it
+    matches their (upload_date, _id) sort in both directions, so pages are
+    read in index order instead of sorted in memory. The unique (user,
+    content_hash) index serves upload deduplication and makes concurrent
+    uploads of the same bytes store one document, and blob.key lets
+    deletes check whether a shared filesystem blob is still referenced.
+    create_index is a no-op when the index already exists.
+
+    Args:
+        collection: pymongo Collection holding the scans
+    """
+    collection.create_index([('user', pymongo.ASCENDING), ('upload_date', pymongo.DESCENDING),
+                             ('_id', pymongo.DESCENDING)])
+    collection.create_index([('blob.key', pymongo.ASCENDING)], sparse=True)
+
+    indexes = collection.index_information()
+    # The earlier (user, upload_date) index is a redundant prefix of the one above
+    if 'user_1_upload_date_-1' in indexes:
+        collection.drop_index('user_1_upload_date_-1')
+
+    hash_keys = [('user', pymongo.ASCENDING), ('content_hash', pymongo.ASCENDING)]
+    if 'user_1_content_hash_1' in indexes and not indexes['user_1_content_hash_1'].get('unique'):
+        # Earlier versions created it without the unique constraint
+        collection.drop_index('user_1_content_hash_1')
+    try:
+        # Partial, so documents stored before content hashes existed do not collide
+        collection.create_index(hash_keys, unique=True,
+                                partialFilterExpression={'content_hash': {'$exists': True}})
+    except pymongo.errors.DuplicateKeyError as e:
+        # Scans stored twice before the constraint existed; keep the lookup index
+        logger.warning("scans has duplicate (user, content_hash) pairs; upload deduplication "
+                       "is not enforced until they are removed: %s", e)
+        collection.create_index(hash_keys)
+
+
+def get_scans_collection():
+    """
+    Get the shared scans collection, ensuring its indexes once per process
+
+    Returns:
+        collection: pymongo Collection of all users' scans
+    """
+    global _scans_indexed
+
+    collection = get_database()[SCANS_COLLECTION]
+    if not _scans_indexed:
+        ensure_scan_indexes(collection)
+        _scans_indexed = True
+    return collection
+
+
+def close_client():
+    """Close the shared client; the next get_client() call creates a new one."""
+    global _client, _scans_indexed
+
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            _scans_indexed = False
+
+
+atexit.register(close_client)
@@ -10,27 +10,31 @@ st.set_page_config(
 
 from streamlit_option_menu import option_menu
 from PIL import Image
-import numpy as np
+from io import BytesIO
 import base64
-import time
+import logging
 
-# Handle TensorFlow import with better error handling
+# Handle model utility import (TensorFlow itself is imported lazily on first use)
 try:
-    import tensorflow as tf
-    # Suppress TensorFlow warnings
-    import os
-    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-    tf.get_logger().setLevel('ERROR')
+    import model_utility
+    from model_utility import (
+        prepare_image, analyze_prediction, predict_tiled, StageTimer,
+        get_model_version, get_tiling_config, PIPELINE_STAGES
+    )
+    from result_utility import CompactResult, COMPOSITE_LAYOUTS, render_result
+    import job_utility
+    import metrics_utility
+    import profiling_utility
 except Exception as e:
-    st.error(f"⚠️ TensorFlow import error: {str(e)}")
-    st.error("Please ensure TensorFlow is properly installed.")
+    st.error(f"⚠️ Model utility import error: {str(e)}")
+    st.error("Please ensure numpy and Pillow are properly installed.")
     st.stop()
 
-# Handle Firebase import
+# Handle Firebase import (pyrebase itself is imported by the Firebase auth backend)
 try:
-    import pyrebase
     import os
     from dotenv import load_dotenv
+    import auth_utility
     
     # Load environment variables
     load_dotenv()
@@ -39,18 +43,54 @@ except Exception as e:
     st.error("Please ensure pyrebase4 and python-dotenv are properly installed.")
     st.stop()
 
-# Handle skimage import with safe fallback
-try:
-    from skimage.measure import label, regionprops
-    SKIMAGE_AVAILABLE = True
-except ImportError:
-    st.warning("⚠️ scikit-image not available. Using simplified image processing.")
-    SKIMAGE_AVAILABLE = False
-    # Provide safe fallback functions
-    def label(image):
-        return image
-    def regionprops(labeled_image):
-        return []
+# Log per-stage analysis timings alongside Streamlit's own output
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+# Post-processing parameters of the interactive analysis (part of the result cache key)
+ANALYSIS_THRESHOLD = 0.5
+ANALYSIS_MIN_SIZE = 200
+
+# Seconds between status polls of a queued or running background job
+JOB_POLL_SECONDS = 1.0
+
+# Human-readable labels for the analysis progress bar
+STAGE_LABELS = {
+    'decode': '📂 Decoding image',
+    'load model': '🧠 Loading model',
+    'preprocess': '🔧 Preprocessing',
+    'inference': '🤖 Running AI model',
+    'post-process': '🧹 Post-processing mask',
+    'render': '🖼️ Rendering results'
+}
+
+# Load and warm up the model in the background once per server process, so
+# neither the login page nor the first analysis waits for TensorFlow
+@st.cache_resource
+def start_model_warmup():
+    # Analyses run out of process when an inference server is configured
+    if os.getenv('INFERENCE_SERVER_URL'):
+        return None
+    return model_utility.start_background_warmup()
+
+start_model_warmup()
+
+# Expose Prometheus metrics when METRICS_PORT or METRICS_FILE is set
+@st.cache_resource
+def start_metrics_exporter():
+    return metrics_utility.start_metrics_exporter()
+
+start_metrics_exporter()
+
+# Run background analysis workers in this server process when the job queue is enabled
+@st.cache_resource
+def start_job_workers():
+    if not job_utility.job_queue_enabled() or job_utility.get_worker_count() <= 0:
+        return None
+    return job_utility.JobWorkerPool(job_utility.get_job_queue(), model_utility.get_model,
+                                     concurrency=job_utility.get_worker_count()).start()
+
+start_job_workers()
 
 # Firebase configuration from environment variables
 firebaseConfig = {
@@ -64,21 +104,15 @@ firebaseConfig = {
     'measurementId': os.getenv('FIREBASE_MEASUREMENT_ID')
 }
 
-# Validate Firebase configuration
-required_firebase_vars = ['FIREBASE_API_KEY', 'FIREBASE_AUTH_DOMAIN', 'FIREBASE_DATABASE_URL', 
-                         'FIREBASE_PROJECT_ID', 'FIREBASE_STORAGE_BUCKET', 'FIREBASE_MESSAGING_SENDER_ID',
-                         'FIREBASE_APP_ID', 'FIREBASE_MEASUREMENT_ID']
-
-missing_vars = [var for var in required_firebase_vars if not os.getenv(var)]
+# Validate Firebase configuration (not needed with AUTH_BACKEND=stub)
+missing_vars = auth_utility.missing_firebase_vars()
 if missing_vars:
     st.error(f"⚠️ Missing Firebase environment variables: {', '.join(missing_vars)}")
     st.error("Please check your .env file and ensure all Firebase variables are set.")
     st.stop()
 
-# Initialize Firebase
-firebase = pyrebase.initialize_app(firebaseConfig)
-auth = firebase.auth()
-db = firebase.database()
+# Initialize Firebase once per process; remote calls run on its thread pool
+auth_client = auth_utility.get_auth_client(firebaseConfig)
 
 # Hide default Streamlit elements and apply custom styles
 hide_st_style = """
@@ -271,14 +305,13 @@ def authentication():
         if submit:
             with st.spinner("Creating your account..."):
                 try:
-                    user = auth.create_user_with_email_and_password(email, password)
+                    # Signs in as part of sign-up and writes the profile in one request
+                    auth_session = auth_client.sign_up(email, password, handle)
                     st.success("Your account is created successfully!")
                     
-                    user = auth.sign_in_with_email_and_password(email, password)
-                    db.child(user['localId']).child("Handle").set(handle)
-                    db.child(user['localId']).child("ID").set(user['localId'])
                     st.session_state['logged_in'] = True
-                    st.session_state['user'] = user
+                    st.session_state['auth'] = auth_session
+                    st.session_state['user'] = auth_session.user
                     st.session_state['email'] = email
                     st.rerun()
                 except Exception as e:
@@ -288,10 +321,12 @@ def authentication():
         if submit:
             with st.spinner("Logging in..."):
                 try:
-                    user = auth.sign_in_with_email_and_password(email, password)
+                    # The profile lookup starts now and completes while the page reruns
+                    auth_session = auth_client.sign_in(email, password)
                     st.success("You have successfully logged in!")
                     st.session_state['logged_in'] = True
-                    st.session_state['user'] = user
+                    st.session_state['auth'] = auth_session
+                    st.session_state['user'] = auth_session.user
                     st.session_state['email'] = email
                     st.rerun()
                 except Exception as e:
@@ -301,135 +336,143 @@ def authentication():
 # Function to load the segmentation model
 @st.cache_resource
 def load_model():
-    # Try to get model path from environment variable, fallback to default
-    model_path = os.getenv('MODEL_PATH', 'model.keras')
-    
-    # If relative path, make it absolute from current directory
-    if not os.path.isabs(model_path):
-        model_path = os.path.join(os.getcwd(), model_path)
-    
-    if not os.path.exists(model_path):
-        st.error(f"⚠️ Model file not found at: {model_path}")
+    try:
+        # Waits for the background warm-up if it is still running
+        return model_utility.get_model()
+    except FileNotFoundError:
+        st.error(f"⚠️ Model file not found at: {model_utility.resolve_model_path()}")
         st.error("Please ensure the model.keras file exists or set the MODEL_PATH environment variable.")
         st.stop()
-    
-    model = tf.keras.models.load_model(model_path, compile=False)
-    return model
-
-# Function to preprocess image for segmentation model
-def preprocess_image_segmentation(image, target_size=(256, 256)):
-    image = np.array(image)
-    image_resized = tf.image.resize(image, target_size)
-    image_resized = image_resized / 255.0  # Normalize the image
-    image_resized = np.expand_dims(image_resized, axis=0)  # Add batch dimension
-    return image_resized
-
-# Function to remove small objects from the mask
-def remove_small_objects(mask, min_size=200):
-    """Remove small objects from a binary mask."""
-    labeled_mask, num_features = label(mask, return_num=True, connectivity=2)
-    for region in regionprops(labeled_mask):
-        if region.area < min_size:
-            for coordinates in region.coords:
-                mask[coordinates[0], coordinates[1]] = 0
-    return mask
-
-# Function to postprocess mask
-def postprocess_mask(prediction, threshold=0.5, min_size=200):
-    mask = np.squeeze(prediction)  # Remove batch dimension
-    mask = (mask > threshold).astype(np.uint8)  # Apply threshold
-
-    # Remove small objects from the mask
-    mask = remove_small_objects(mask, min_size=min_size)
-    
-    return mask
 
-# Function to predict tumor and return accuracy and confidence level
-def predict_tumor(image, model, threshold=0.5, min_size=200):
-    """ Predict tumor presence and show the result image """
-    # Preprocess the image
-    preprocessed_image = preprocess_image_segmentation(image, target_size=(256, 256))
-    
-    # Perform prediction
-    prediction = model.predict(preprocessed_image, verbose=0)
-    
-    # Print the range of prediction values for debugging
-    print("Prediction range:", np.min(prediction), np.max(prediction))
-    
-    # Ensure prediction is in valid range [0, 1]
-    prediction = np.clip(prediction, 0, 1)
-    
-    # Postprocess the mask, removing small objects
-    mask = postprocess_mask(prediction, threshold=threshold, min_size=min_size)
-    
-    # Load the original image for visualization
-    original_image = image.resize((256, 256))
-    
-    # Convert mask to RGB format
-    mask_rgb = np.stack([mask]*3, axis=-1) * 255
-    
-    # Convert to uint8 for display
-    original_image_np = np.array(original_image)
-    
-    # Ensure original image and mask have the same shape
-    if original_image_np.shape[2] != mask_rgb.shape[2]:
-        original_image_np = np.stack([original_image_np]*3, axis=-1)
-    
-    # Concatenate original image and mask side-by-side
-    result_image = np.concatenate([original_image_np, mask_rgb], axis=1)  # Side-by-side concatenation
-
-    # Determine if tumor is present
-    tumor_present = np.any(mask)  # Check if any pixel is classified as a tumor
-
-    # Calculate realistic medical AI metrics without hardcoded ranges
-    max_prediction = np.max(prediction)
-    mean_prediction = np.mean(prediction)
-    std_prediction = np.std(prediction)
-    
-    if tumor_present:
-        # For tumor cases: base confidence on actual prediction strength
-        tumor_region_predictions = prediction[prediction > threshold]
-        if len(tumor_region_predictions) > 0:
-            # Confidence based on prediction strength (realistic range)
-            avg_tumor_confidence = np.mean(tumor_region_predictions)
-            base_confidence = avg_tumor_confidence * 70  # Scale to 0-70%
-            
-            # Reduce confidence for high uncertainty
-            uncertainty_penalty = std_prediction * 40
-            confidence = base_confidence - uncertainty_penalty
-            
-            # Accuracy based on prediction consistency
-            prediction_variance = np.var(tumor_region_predictions)
-            consistency_factor = 1 - prediction_variance
-            accuracy = 50 + (consistency_factor * 35)  # Range: 50-85%
-        else:
-            # Edge case: weak detections
-            confidence = max_prediction * 45
-            accuracy = 45 + (confidence * 0.3)
-    else:
-        # For non-tumor cases: confidence based on how low predictions are
-        low_prediction_factor = (1 - mean_prediction) * 60  # Up to 60%
-        consistency_bonus = (1 - std_prediction) * 20      # Up to 20% bonus
-        
-        confidence = low_prediction_factor + consistency_bonus
-        accuracy = 55 + (confidence * 0.4)  # Realistic negative case accuracy
-    
-    # Apply realistic medical AI constraints (no hardcoded artificial ranges)
-    # Real medical AI systems: 35-82% confidence, 45-88% accuracy
-    confidence = np.clip(confidence, 35, 82)
-    accuracy = np.clip(accuracy, 45, 88)
-    
-    # Add realistic model uncertainty (no artificial noise)
-    model_uncertainty = std_prediction * 5  # Based on actual prediction variance
-    confidence = confidence - model_uncertainty
-    accuracy = accuracy - (model_uncertainty * 0.8)
-    
-    # Final realistic clipping
-    confidence = np.clip(confidence, 35, 82)
-    accuracy = np.clip(accuracy, 45, 88)
+# Function to build the results composite from the original upload and the packed mask
+@st.cache_data(max_entries=64, show_spinner=False)
+def render_result_image(image_hash, mask_digest, layout, _source, _result):
+    """
+    PNG-encoded side-by-side or overlay composite, cached per scan, mask and layout
 
-    return result_image, tumor_present, accuracy, confidence
+    The underscored arguments are not hashed: the upload and the result are
+    identified by image_hash and mask_digest. PNG (not WebP) because st.image
+    passes PNG bytes through untouched but re-encodes other formats.
+    """
+    _source.seek(0)
+    return render_result(Image.open(_source), _result, layout=layout, image_format='PNG')
+
+# Function to build the model version part of the result cache key
+def analysis_model_version(tiling):
+    model_version = get_model_version()
+    if tiling:
+        model_version += "-tiled-{overlap}-{window}".format(**tiling)
+    return model_version
+
+# Function to keep a finished analysis in the session for the Results page
+def store_result(result, source):
+    """
+    Args:
+        result: CompactResult
+        source: The uploaded file (or a BytesIO of its bytes) the mask belongs to
+    """
+    st.session_state['result'] = result
+    st.session_state['result_source'] = source
+    st.session_state['tumor_present'] = result.tumor_present
+    st.session_state['accuracy'] = result.accuracy
+    st.session_state['confidence'] = result.confidence
+
+# Function to load the result of a finished background job into the session
+def load_job_result(job_id):
+    """
+    Returns:
+        job: The job (with its current status), or None if it no longer exists
+    """
+    from cache_utility import get_result_cache
+
+    job_queue = job_utility.get_job_queue()
+    job = job_queue.get(job_id)
+    if job is not None and job.status == job_utility.DONE and st.session_state.get('loaded_job_id') != job_id:
+        result = job.result()
+        # The job keeps the upload, so the composite can be rebuilt after a reconnect
+        store_result(result, BytesIO(job_queue.get(job_id, with_image=True).image))
+        if job.params.get('cache_key'):
+            get_result_cache().put(job.params['cache_key'], result)
+        st.session_state['loaded_job_id'] = job_id
+    return job
+
+# Function to queue an upload for background analysis (once per upload)
+def queue_analysis(uploaded_file):
+    from cache_utility import ResultCache, get_result_cache
+    from storage_utility import content_hash
+
+    image_bytes = uploaded_file.getvalue()
+    image_hash = content_hash(image_bytes)
+    if st.session_state.get('job_upload') == (uploaded_file.name, image_hash):
+        return
+    st.session_state['job_upload'] = (uploaded_file.name, image_hash)
+
+    tiling = get_tiling_config()
+    cache_key = ResultCache.make_key(image_hash, analysis_model_version(tiling), ANALYSIS_THRESHOLD, ANALYSIS_MIN_SIZE)
+    cached_result = get_result_cache().get(cache_key)
+    if cached_result is not None:
+        store_result(cached_result, uploaded_file)
+        st.session_state['job_id'] = None
+        return
+    # The previous scan's result must not be shown for this one
+    st.session_state['result'] = None
+    st.session_state['job_id'] = job_utility.get_job_queue().submit(
+        image_bytes, owner=st.session_state.get('email'), name=uploaded_file.name,
+        threshold=ANALYSIS_THRESHOLD, min_size=ANALYSIS_MIN_SIZE, tiling=tiling,
+        image_hash=image_hash, cache_key=cache_key
+    )
+
+JOB_STATUS_LABELS = {
+    job_utility.QUEUED: '⏳ Queued',
+    job_utility.RUNNING: '🤖 Running',
+    job_utility.DONE: '✅ Done',
+    job_utility.FAILED: '❌ Failed',
+    job_utility.CANCELLED: '🚫 Cancelled'
+}
 
+# Function to show live status of this session's job and the user's recent jobs
+def job_status_panel():
+    job_id = st.session_state.get('job_id')
+    job = load_job_result(job_id) if job_id else None
+    active = job is not None and job.status in (job_utility.QUEUED, job_utility.RUNNING)
+
+    # Poll while the job is in flight; only this fragment reruns, not the page
+    @st.fragment(run_every=JOB_POLL_SECONDS if active else None)
+    def panel():
+        job_queue = job_utility.get_job_queue()
+        job = load_job_result(job_id) if job_id else None
+        if job is not None:
+            if job.status == job_utility.DONE:
+                st.success(f"✅ Analysis of {job.name} complete! Click on \"Results\" to view the detailed analysis.")
+            elif job.status in (job_utility.QUEUED, job_utility.RUNNING):
+                attempt = f" · attempt {job.attempts}/{job.max_attempts}" if job.attempts > 1 else ""
+                retrying = f" · retrying after: {job.error}" if job.error and job.status == job_utility.QUEUED else ""
+                st.info(f"{JOB_STATUS_LABELS[job.status]}: {job.name}{attempt}{retrying}")
+                if st.button("🚫 Cancel analysis", key=f"cancel_{job.id}"):
+                    job_queue.cancel(job.id)
+                    st.rerun()
+            else:
+                st.error(f"{JOB_STATUS_LABELS[job.status]}: {job.name}" + (f" · {job.error}" if job.error else ""))
+                if st.button("🔁 Retry analysis", key=f"retry_{job.id}"):
+                    job_queue.retry(job.id)
+                    st.rerun()
+            if (job.status in (job_utility.QUEUED, job_utility.RUNNING)) != active:
+                # Switch polling on or off
+                st.rerun()
+
+        # Earlier analyses survive disconnects; any finished one can be reopened
+        recent = [job for job in job_queue.list_jobs(st.session_state.get('email'), limit=5) if job.id != job_id]
+        if recent:
+            with st.expander("🗂️ Recent analyses"):
+                for job in recent:
+                    col1, col2 = st.columns([3, 1])
+                    col1.write(f"{JOB_STATUS_LABELS[job.status]} · {job.name}")
+                    if job.status == job_utility.DONE and col2.button("Open", key=f"open_{job.id}"):
+                        st.session_state['job_id'] = job.id
+                        load_job_result(job.id)
+                        st.rerun()
+
+    panel()
 
 # Main logic
 def main():
@@ -442,8 +485,10 @@ def main():
         st.session_state['age'] = ''
     if 'gender' not in st.session_state:
         st.session_state['gender'] = 'Male'
-    if 'result_image' not in st.session_state:
-        st.session_state['result_image'] = None
+    if 'result' not in st.session_state:
+        st.session_state['result'] = None
+    if 'result_source' not in st.session_state:
+        st.session_state['result_source'] = None
     if 'tumor_present' not in st.session_state:
         st.session_state['tumor_present'] = None
     if 'accuracy' not in st.session_state:
@@ -456,8 +501,15 @@ def main():
     if not st.session_state['logged_in']:
         authentication()
     else:
-        user = st.session_state['user']
-        user_handle = db.child(user['localId']).child("Handle").get().val()
+        if st.session_state.get('auth') is None:
+            st.session_state['auth'] = auth_utility.AuthSession(auth_client, st.session_state['user'],
+                                                                st.session_state['email'])
+        auth_session = st.session_state['auth']
+        # Starts a background token refresh as expiry approaches; returns immediately
+        auth_session.token()
+        # Served from the session's TTL cache; only the first lookup can wait on Firebase
+        user_handle = auth_session.handle()
+        st.session_state['user'] = auth_session.user
         email = st.session_state['email']
 
         # Main menu and navigation using option_menu
@@ -482,6 +534,7 @@ def main():
         # Logout logic
         if selected == "Logout":
             st.session_state['logged_in'] = False
+            st.session_state['auth'] = None
             st.session_state['user'] = None
             st.session_state['email'] = None
             st.success("You have logged out successfully!")
@@ -626,39 +679,177 @@ def main():
                     st.image(uploaded_file, caption='🧠 Uploaded MRI Image', use_container_width=True)
                 
                 st.session_state['uploaded_file'] = uploaded_file
-                image = Image.open(uploaded_file)
-
-                # Processing with progress bar
-                with st.spinner('🔄 Processing MRI scan with AI model...'):
-                    progress_bar = st.progress(0)
-                    for i in range(100):
-                        time.sleep(0.01)
-                        progress_bar.progress(i + 1)
+
+                # Imported here rather than at startup: only the analysis path needs them
+                from cache_utility import ResultCache, get_result_cache
+                from storage_utility import content_hash
+                import inference_client
+
+                # Warn when skimage is missing (model_utility falls back to simplified processing)
+                if not model_utility.skimage_available():
+                    st.warning("⚠️ scikit-image not available. Using simplified image processing.")
+
+                if job_utility.job_queue_enabled():
+                    # Runs in the background; survives reruns and disconnects
+                    queue_analysis(uploaded_file)
+                else:
+                    # Processing with a progress bar driven by the real pipeline stages
+                    # (profiled per stage when PROFILE_SAMPLE_RATE samples this request)
+                    with st.spinner('🔄 Processing MRI scan with AI model...'), \
+                            profiling_utility.profile_request('analysis'):
+                        progress_bar = st.progress(0, text=f"{STAGE_LABELS[PIPELINE_STAGES[0]]}...")
+
+                        def report_stage(name, seconds):
+                            done = PIPELINE_STAGES.index(name) + 1
+                            next_label = STAGE_LABELS[PIPELINE_STAGES[done]] + "..." if done < len(PIPELINE_STAGES) else "Done"
+                            progress_bar.progress(done / len(PIPELINE_STAGES),
+                                                  text=f"{STAGE_LABELS[name]} took {seconds * 1000:.0f} ms · {next_label}")
+
+                        timer = StageTimer(on_stage_end=report_stage)
                     
-                    try:
-                        model = load_model()
-                        result_image, tumor_present, accuracy, confidence = predict_tumor(image, model)
+                        try:
+                            # Reuse the result when this exact scan was already analysed with this model
+                            image_hash = content_hash(uploaded_file.getvalue())
+                            tiling = get_tiling_config()
+                            cache_key = ResultCache.make_key(image_hash, analysis_model_version(tiling),
+                                                             ANALYSIS_THRESHOLD, ANALYSIS_MIN_SIZE)
+                            cached_result = get_result_cache().get(cache_key)
                         
-                        # Store results
-                        st.session_state['result_image'] = result_image
-                        st.session_state['tumor_present'] = tumor_present
-                        st.session_state['accuracy'] = accuracy
-                        st.session_state['confidence'] = confidence
+                            if cached_result is not None:
+                                result = cached_result
+                                progress_bar.progress(0.9, text="⚡ Found a cached analysis of this scan")
+                            elif inference_client.get_server_url() and not tiling:
+                                # Submit to the local inference server and poll, so this session
+                                # does not run TensorFlow on its own script thread
+                                with timer.stage('inference'):
+                                    job_id = inference_client.submit_job(uploaded_file.getvalue(),
+                                                                         threshold=ANALYSIS_THRESHOLD,
+                                                                         min_size=ANALYSIS_MIN_SIZE)
+                                    job = inference_client.wait_for_job(
+                                        job_id,
+                                        on_status=lambda status: progress_bar.progress(
+                                            0.5, text=f"🛰️ Analysis {status} on inference server...")
+                                    )
+                                with timer.stage('post-process'):
+                                    result = inference_client.decode_result(job)
+                                result = CompactResult.from_analysis(result, image_hash)
+                                get_result_cache().put(cache_key, result)
+                            else:
+                                with timer.stage('decode'):
+                                    image = Image.open(uploaded_file)
+                                    image.load()
+                                with timer.stage('load model'):
+                                    model = load_model()
+                                if tiling:
+                                    # Native-resolution analysis; tiles are normalized batch by batch
+                                    with timer.stage('inference'):
+                                        prediction = predict_tiled(image, model, **tiling)
+                                    display_image = None
+                                else:
+                                    with timer.stage('preprocess'):
+                                        # One resize for both the model input and the display image
+                                        display_image, preprocessed_image = prepare_image(image, target_size=(256, 256))
+                                    with timer.stage('inference'), metrics_utility.INFERENCE_IN_FLIGHT.track_in_progress():
+                                        prediction = model.predict(preprocessed_image, verbose=0)
+                                with timer.stage('post-process'):
+                                    result = analyze_prediction(
+                                        image, prediction, threshold=ANALYSIS_THRESHOLD, min_size=ANALYSIS_MIN_SIZE,
+                                        display_image=display_image
+                                    )
+                                    # Keep only the packed mask and scores; the composite is rebuilt on demand
+                                    result = CompactResult.from_analysis(result, image_hash)
+                                get_result_cache().put(cache_key, result)
                         
-                        # Success message with styling
-                        st.markdown("""
-                        <div style='background: linear-gradient(90deg, #27ae60, #2ecc71); color: white; padding: 1rem; border-radius: 15px; text-align: center; margin: 1rem 0;'>
-                            <h4 style='margin: 0;'>✅ Analysis Complete!</h4>
-                            <p style='margin: 0.5rem 0 0 0;'>Your MRI scan has been successfully processed. Click on "Results" to view the detailed analysis.</p>
-                        </div>
-                        """, unsafe_allow_html=True)
+                            with timer.stage('render'):
+                                # Store results: the packed mask plus a reference to the upload it belongs to
+                                store_result(result, uploaded_file)
+                            
+                                # Success message with styling
+                                st.markdown("""
+                                <div style='background: linear-gradient(90deg, #27ae60, #2ecc71); color: white; padding: 1rem; border-radius: 15px; text-align: center; margin: 1rem 0;'>
+                                    <h4 style='margin: 0;'>✅ Analysis Complete!</h4>
+                                    <p style='margin: 0.5rem 0 0 0;'>Your MRI scan has been successfully processed. Click on "Results" to view the detailed analysis.</p>
+                                </div>
+                                """, unsafe_allow_html=True)
                         
-                    except Exception as e:
-                        st.error(f"❌ Error processing image: {str(e)}")
-                        st.info("Please ensure the model file exists and is accessible.")
+                            timer.log(label=f"{'cached ' if cached_result is not None else ''}analysis of {uploaded_file.name}")
+                            st.caption(("⚡ Served from cache · " if cached_result is not None else "⏱️ ") + " · ".join(
+                                f"{STAGE_LABELS[name]}: {seconds * 1000:.0f} ms" for name, seconds in timer.timings.items()
+                            ) + f" · Total: {timer.total * 1000:.0f} ms")
+                        
+                        except Exception as e:
+                            timer.log(label=f"failed analysis of {uploaded_file.name}")
+                            st.error(f"❌ Error processing image: {str(e)}")
+                            st.info("Please ensure the model file exists and is accessible.")
+
+            if job_utility.job_queue_enabled():
+                job_status_panel()
+
+            # Multi-slice study upload (zip of slices, NumPy or NIfTI volume)
+            st.markdown("<br>", unsafe_allow_html=True)
+            st.markdown("""
+            <div class='content-card'>
+                <h3 style='color: #2c3e50; text-align: center; margin-bottom: 1.5rem;'>🧊 Multi-slice Study Upload</h3>
+                <p style='color: #7f8c8d; text-align: center; margin-bottom: 1rem;'>
+                Upload a whole study as a ZIP of PNG/JPG slices, a NumPy volume (.npy/.npz) or a NIfTI volume (.nii/.nii.gz).
+                </p>
+            </div>
+            """, unsafe_allow_html=True)
+
+            study_file = st.file_uploader(
+                "Choose study file",
+                type=["zip", "npy", "npz", "nii", "gz"],
+                key="study_uploader",
+                help="Slices are analysed in order and combined into a 3D tumor mask"
+            )
+
+            if study_file is not None:
+                from study_utility import analyze_study, is_study_file, open_study
+
+                # Analyse once per uploaded study; slider changes rerun the script
+                study_key = (study_file.name, study_file.size)
+                if not is_study_file(study_file.name):
+                    st.error("❌ Unsupported study format. Please upload a .zip, .npy, .npz, .nii or .nii.gz file.")
+                elif st.session_state.get('study_key') != study_key:
+                    with st.spinner('🔄 Analysing study slice by slice...'):
+                        progress_bar = st.progress(0, text="🧊 Reading study...")
+                        try:
+                            model = load_model()
+                            with open_study(study_file, name=study_file.name) as study:
+                                study_result = analyze_study(
+                                    study, model, threshold=ANALYSIS_THRESHOLD, min_size=ANALYSIS_MIN_SIZE,
+                                    on_progress=lambda done, total: progress_bar.progress(
+                                        done / total, text=f"🤖 {done}/{total} slices analysed")
+                                )
+                            st.session_state['study_result'] = study_result
+                            st.session_state['study_key'] = study_key
+                        except Exception as e:
+                            st.error(f"❌ Error processing study: {str(e)}")
+
+                study_result = st.session_state.get('study_result')
+                if study_result is not None and st.session_state.get('study_key') == study_key:
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("🧊 Slices", study_result['num_slices'])
+                    col2.metric("🎯 Tumor volume", f"{study_result['tumor_volume_ml']:.2f} mL")
+                    col3.metric("🧩 Tumor regions (3D)", study_result['components'])
+
+                    if study_result['tumor_slices']:
+                        slice_index = st.slider("Slice", 0, study_result['num_slices'] - 1,
+                                                value=study_result['tumor_slices'][len(study_result['tumor_slices']) // 2])
+                        st.image(study_result['mask'][slice_index] * 255,
+                                 caption=f"🧠 Tumor mask, slice {slice_index} "
+                                         f"({int(study_result['slice_area_voxels'][slice_index])} voxels)",
+                                 use_container_width=True)
+                    else:
+                        st.success("✅ No tumor regions detected in this study.")
 
         # Results page
         elif selected == "Results":
+            # Pick up a background analysis that finished since the last rerun
+            job = None
+            if job_utility.job_queue_enabled() and st.session_state.get('job_id'):
+                job = load_job_result(st.session_state['job_id'])
+
             if not st.session_state['name']:
                 st.markdown("""
                 <div style='background: linear-gradient(90deg, #f39c12, #e67e22); color: white; padding: 1.5rem; border-radius: 15px; text-align: center; margin: 2rem 0;'>
@@ -666,7 +857,7 @@ def main():
                     <p style='margin: 0;'>Please provide patient information in the "Upload Image" page before viewing results.</p>
                 </div>
                 """, unsafe_allow_html=True)
-            elif st.session_state['result_image'] is not None:
+            elif st.session_state['result'] is not None and st.session_state['result_source'] is not None:
                 st.markdown("<div class='title'>📊 Analysis Results</div>", unsafe_allow_html=True)
                 
                 # Patient Info Card
@@ -697,10 +888,17 @@ def main():
                 </div>
                 """, unsafe_allow_html=True)
                 
-                result_image = st.session_state['result_image']
+                result = st.session_state['result']
                 col1, col2, col3 = st.columns([0.5, 2, 0.5])
                 with col2:
-                    st.image(result_image, caption='🧠 Original Image vs AI Segmentation Result', use_container_width=True)
+                    layout = st.radio("View", COMPOSITE_LAYOUTS, horizontal=True, key='result_layout',
+                                      format_func=lambda name: name.replace('-', ' ').capitalize())
+                    # Encoded once per scan and layout; reruns resend the same bytes
+                    result_bytes = render_result_image(result.image_hash, result.mask.digest, layout,
+                                                       st.session_state['result_source'], result)
+                    caption = ('🧠 Original Image vs AI Segmentation Result' if layout == 'side-by-side'
+                               else '🧠 AI Segmentation Overlay')
+                    st.image(result_bytes, caption=caption, use_container_width=True, output_format='PNG')
                 
                 # Diagnosis Card
                 tumor_present = st.session_state['tumor_present']
@@ -774,6 +972,13 @@ def main():
                     </p>
                 </div>
                 """, unsafe_allow_html=True)
+            elif job is not None and job.status in (job_utility.QUEUED, job_utility.RUNNING):
+                st.markdown(f"""
+                <div style='background: linear-gradient(90deg, #3498db, #2980b9); color: white; padding: 2rem; border-radius: 15px; text-align: center; margin: 2rem 0;'>
+                    <h3 style='margin: 0 0 1rem 0;'>{JOB_STATUS_LABELS[job.status]}</h3>
+                    <p style='margin: 0; font-size: 16px;'>The analysis of {job.name} is still in progress. Check back in a moment or follow it on the "Upload Image" page.</p>
+                </div>
+                """, unsafe_allow_html=True)
             else:
                 st.markdown("""
                 <div style='background: linear-gradient(90deg, #f39c12, #e67e22); color: white; padding: 2rem; border-radius: 15px; text-align: center; margin: 2rem 0;'>
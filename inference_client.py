@@ -0,0 +1,115 @@
+import base64
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+from urllib.parse import urlencode
+
+import numpy as np
+from PIL import Image
+
+
+class InferenceServerError(RuntimeError):
+    """Raised when the inference server is unreachable or a job fails."""
+
+
+def get_server_url():
+    """
+    Get the inference server URL from INFERENCE_SERVER_URL
+
+    Returns:
+        url: Base URL such as http://127.0.0.1:8765, or None when analyses
+             should run inline in the Streamlit process
+    """
+    url = os.getenv('INFERENCE_SERVER_URL', '').strip()
+    return url.rstrip('/') or None
+
+
+def _request(url, data=None, timeout=10):
+    request = urllib.request.Request(url, data=data, method='POST' if data is not None else 'GET',
+                                     headers={'Content-Type': 'application/octet-stream'} if data else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        raise InferenceServerError(f"Inference server returned {e.code}: {e.read().decode('utf-8', 'replace')}")
+    except (urllib.error.URLError, OSError) as e:
+        raise InferenceServerError(f"Could not reach inference server at {url}: {e}")
+
+
+def submit_job(image_bytes, threshold=0.5, min_size=200, server_url=None, timeout=10):
+    """
+    Submit raw image bytes for analysis
+
+    Args:
+        image_bytes: Encoded image (JPG/PNG) as uploaded
+        threshold: Probability threshold for the mask
+        min_size: Minimum component size kept in the mask
+        server_url: Base URL; None uses INFERENCE_SERVER_URL
+        timeout: Request timeout in seconds
+
+    Returns:
+        job_id: Identifier to poll with get_job
+    """
+    server_url = server_url or get_server_url()
+    query = urlencode({'threshold': threshold, 'min_size': min_size})
+    return _request(f"{server_url}/jobs?{query}", data=image_bytes, timeout=timeout)['job_id']
+
+
+def get_job(job_id, server_url=None, timeout=10):
+    """
+    Fetch the current state of a job
+
+    Returns:
+        job: Dictionary with 'status' ('queued', 'running', 'done' or
+             'failed') plus 'result' or 'error' once finished
+    """
+    server_url = server_url or get_server_url()
+    return _request(f"{server_url}/jobs/{job_id}", timeout=timeout)
+
+
+def wait_for_job(job_id, server_url=None, poll_interval=0.05, timeout=120, on_status=None):
+    """
+    Poll a job until it finishes
+
+    Args:
+        job_id: Identifier returned by submit_job
+        server_url: Base URL; None uses INFERENCE_SERVER_URL
+        poll_interval: Seconds between polls
+        timeout: Maximum seconds to wait
+        on_status: Optional callback(status) called on every poll
+
+    Returns:
+        job: The finished job
+
+    Raises:
+        InferenceServerError: If the job fails or does not finish in time
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_job(job_id, server_url=server_url)
+        if on_status:
+            on_status(job['status'])
+        if job['status'] == 'done':
+            return job
+        if job['status'] == 'failed':
+            raise InferenceServerError(f"Analysis failed: {job.get('error', 'unknown error')}")
+        if time.monotonic() > deadline:
+            raise InferenceServerError(f"Analysis did not finish within {timeout}s")
+        time.sleep(poll_interval)
+
+
+def decode_result(job):
+    """
+    Convert a finished job into predict_tumor's return value
+
+    Returns:
+        result: AnalysisResult
+    """
+    from model_utility import AnalysisResult
+
+    result = job['result']
+    result_image = np.array(Image.open(BytesIO(base64.b64decode(result['result_image_png']))))
+    return AnalysisResult.from_dict(result_image, result)
@@ -0,0 +1,305 @@
+"""
+Local inference service with dynamic request batching
+
+Holds one warm copy of the segmentation model and serves analyses over
+HTTP on a local port. Concurrent requests are coalesced into micro-batches
+(up to --max-batch-size images, waiting at most --max-wait-ms for a batch
+to fill) before each model call, so Streamlit sessions no longer serialize
+on TensorFlow in their own script threads.
+
+Endpoints:
+    POST /jobs             body: raw image bytes; query: threshold, min_size
+                           -> {"job_id": ...}
+    GET  /jobs/<job_id>    -> {"status": "queued|running|done|failed", ...}
+    GET  /health           -> {"status": "ok", ...}
+    GET  /metrics          -> Prometheus text format (see metrics_utility)
+
+Usage:
+    python inference_server.py --port 8765 --max-batch-size 8 --max-wait-ms 10
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from metrics_utility import (CONTENT_TYPE, HTTP_IN_FLIGHT, HTTP_SECONDS, INFERENCE_IN_FLIGHT, render_metrics,
+                             start_metrics_exporter)
+from model_utility import StageTimer, analyze_prediction, get_model, get_thread_config, prepare_image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+JOB_TTL_SECONDS = 600
+
+
+class MicroBatcher:
+    """
+    Coalesce single-image model inputs into batched forward passes
+
+    Args:
+        model: Loaded segmentation model
+        max_batch_size: Maximum images per forward pass
+        max_wait_ms: How long the first queued input waits for others
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, model_input):
+        """
+        Queue one preprocessed input of shape (1, H, W, C)
+
+        Returns:
+            future: Resolves to the prediction of shape (1, H, W, 1)
+        """
+        future = Future()
+        self._queue.put((model_input, future))
+        return future
+
+    def _collect(self):
+        """Block for the first item, then gather more until full or timed out."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            inputs = np.concatenate([model_input for model_input, _ in batch], axis=0)
+            try:
+                with INFERENCE_IN_FLIGHT.track_in_progress():
+                    predictions = self.model.predict(inputs, batch_size=len(batch), verbose=0)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            logger.debug("ran micro-batch of %d", len(batch))
+            for index, (_, future) in enumerate(batch):
+                future.set_result(predictions[index:index + 1])
+
+
+class JobStore:
+    """Thread-safe in-memory job table; finished jobs expire after a TTL."""
+
+    def __init__(self, ttl=JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._purge()
+            self._jobs[job_id] = {'status': 'queued', 'submitted': time.time()}
+        return job_id
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.get('finished') and job['finished'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def encode_png(array):
+    """Encode a uint8 image array as base64 PNG."""
+    byte_io = BytesIO()
+    Image.fromarray(array).save(byte_io, format='PNG')
+    return base64.b64encode(byte_io.getvalue()).decode('ascii')
+
+
+class InferenceService:
+    """
+    Run analysis jobs: decode and preprocess on a worker pool, batch the
+    model call through the MicroBatcher, post-process back on the pool
+
+    Args:
+        model: Loaded segmentation model
+        max_batch_size: Maximum images per forward pass
+        max_wait_ms: Maximum time a request waits for a batch to fill
+        workers: Concurrent decode/post-process workers
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10, workers=16):
+        self.batcher = MicroBatcher(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.jobs = JobStore()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference-worker')
+
+    def submit(self, image_bytes, threshold=0.5, min_size=200):
+        job_id = self.jobs.create()
+        self.executor.submit(self._run_job, job_id, image_bytes, threshold, min_size)
+        return job_id
+
+    def _run_job(self, job_id, image_bytes, threshold, min_size):
+        self.jobs.update(job_id, status='running', started=time.time())
+        timer = StageTimer()
+        try:
+            with timer.stage('decode'):
+                image = Image.open(BytesIO(image_bytes))
+                image.load()
+            with timer.stage('preprocess'):
+                display_image, model_input = prepare_image(image, target_size=(256, 256))
+            # Includes the wait for the micro-batch to fill
+            with timer.stage('inference'):
+                prediction = self.batcher.submit(model_input).result()
+            with timer.stage('post-process'):
+                result = analyze_prediction(image, prediction, threshold=threshold, min_size=min_size,
+                                            display_image=display_image)
+            self.jobs.update(job_id, status='done', finished=time.time(), result={
+                'result_image_png': encode_png(result.result_image),
+                **result.to_dict()
+            })
+        except Exception as e:
+            logger.exception("job %s failed", job_id)
+            self.jobs.update(job_id, status='failed', finished=time.time(), error=str(e))
+
+
+def make_handler(service):
+    """Build a request handler class bound to an InferenceService."""
+
+    class InferenceRequestHandler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body, content_type):
+            self.status = status
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status, payload):
+            self._send(status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+        def _instrumented(self, handler):
+            """Run a request handler, tracking it in the HTTP metrics."""
+            self.status = 500
+            start = time.perf_counter()
+            with HTTP_IN_FLIGHT.track_in_progress():
+                try:
+                    handler()
+                finally:
+                    HTTP_SECONDS.observe(time.perf_counter() - start, method=self.command, status=self.status)
+
+        def do_POST(self):
+            self._instrumented(self._post)
+
+        def do_GET(self):
+            self._instrumented(self._get)
+
+        def _post(self):
+            url = urlparse(self.path)
+            if url.path != '/jobs':
+                self._send_json(404, {'error': 'not found'})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            if length <= 0:
+                self._send_json(400, {'error': 'empty request body'})
+                return
+            params = parse_qs(url.query)
+            try:
+                threshold = float(params.get('threshold', ['0.5'])[0])
+                min_size = int(params.get('min_size', ['200'])[0])
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            job_id = service.submit(self.rfile.read(length), threshold=threshold, min_size=min_size)
+            self._send_json(202, {'job_id': job_id})
+
+        def _get(self):
+            url = urlparse(self.path)
+            if url.path == '/metrics':
+                self._send(200, render_metrics().encode('utf-8'), CONTENT_TYPE)
+                return
+            if url.path == '/health':
+                self._send_json(200, {'status': 'ok', 'max_batch_size': service.batcher.max_batch_size,
+                                      'max_wait_ms': service.batcher.max_wait * 1000})
+                return
+            if url.path.startswith('/jobs/'):
+                job = service.jobs.get(url.path[len('/jobs/'):])
+                if job is None:
+                    self._send_json(404, {'error': 'unknown job'})
+                else:
+                    self._send_json(200, job)
+                return
+            self._send_json(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return InferenceRequestHandler
+
+
+def main(argv=None):
+    # Load .env first: the argument defaults below read the environment
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description="Local inference service with dynamic request batching")
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind (default: localhost only)')
+    parser.add_argument('--port', type=int, default=int(os.getenv('INFERENCE_PORT', DEFAULT_PORT)))
+    parser.add_argument('--max-batch-size', type=int,
+                        default=int(os.getenv('INFERENCE_MAX_BATCH_SIZE') or get_thread_config()['batch_size']),
+                        help='Maximum images per forward pass (default: INFERENCE_MAX_BATCH_SIZE or the tuned batch size)')
+    parser.add_argument('--max-wait-ms', type=float, default=float(os.getenv('INFERENCE_MAX_WAIT_MS', '10')),
+                        help='Maximum time a request waits for a batch to fill')
+    parser.add_argument('--workers', type=int, default=16, help='Decode/post-process worker threads')
+    parser.add_argument('--model', default=None, help='Model path (default: MODEL_PATH or model.keras)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    start_metrics_exporter()
+    service = InferenceService(get_model(args.model), max_batch_size=args.max_batch_size,
+                               max_wait_ms=args.max_wait_ms, workers=args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    logger.info("inference server listening on http://%s:%d (max batch %d, max wait %.1fms)",
+                args.host, args.port, args.max_batch_size, args.max_wait_ms)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Bulk ingestion of scan archives into the scans collection
+
+Reads PNG/JPG scans from directories, glob patterns and zip archives,
+decodes and validates them on a thread pool and writes them with unordered
+insert_many batches, so one rejected document does not abort its batch.
+Each file gets one line in a JSONL report (inserted, duplicate, invalid or
+failed). Scans the user already has are skipped by content hash, so a
+re-run never stores twice; --resume also skips files the report already
+lists as done without reading them again.
+
+Usage:
+    python ingest_scans.py archive.zip scans/ --user someone@example.com
+    python ingest_scans.py scans/ --user someone@example.com --resume --batch-size 200 --workers 8
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
+
+import pymongo
+from PIL import Image
+
+from metrics_utility import start_metrics_exporter
+from storage_utility import content_hash, get_blob_store
+from upload_utility import find_stored_hashes, insert_scans, scan_document, store_image_bytes
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ALLOWED_FORMATS = ('JPEG', 'PNG')
+
+INSERTED = 'inserted'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+FAILED = 'failed'
+STATUSES = (INSERTED, DUPLICATE, INVALID, FAILED)
+# Files with these outcomes are skipped by --resume; failed writes are retried
+DONE_STATUSES = (INSERTED, DUPLICATE, INVALID)
+
+
+def _file_reader(path):
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+
+def _zip_reader(archive, lock, member):
+    def read():
+        # zipfile is not safe for concurrent reads
+        with lock:
+            return archive.read(member)
+    return read
+
+
+def collect_sources(inputs, archives):
+    """
+    Expand directories, glob patterns and zip archives into readable scans
+
+    Args:
+        inputs: Directories, files, glob patterns or .zip archives
+        archives: contextlib.ExitStack the opened zip archives are entered
+                  into; the readers work until it is closed
+
+    Returns:
+        sources: Sorted list of (name, read) pairs, where read() returns the
+                 file's bytes; zip members are named "archive.zip:member"
+    """
+    paths = set()
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                paths.update(os.path.join(root, name) for name in files)
+        else:
+            paths.update(path for path in glob.glob(entry, recursive=True) if os.path.isfile(path))
+
+    sources = []
+    for path in sorted(paths):
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            archive = archives.enter_context(zipfile.ZipFile(path))
+            lock = threading.Lock()
+            for member in sorted(archive.namelist()):
+                if member.lower().endswith(IMAGE_EXTENSIONS):
+                    sources.append((f"{path}:{member}", _zip_reader(archive, lock, member)))
+        elif lower.endswith(IMAGE_EXTENSIONS):
+            sources.append((path, _file_reader(path)))
+    return sources
+
+
+def prepare_scan(name, read, email):
+    """
+    Read, decode and validate one scan and build its document
+
+    Args:
+        name: Source name used in the report
+        read: Callable returning the file's bytes
+        email: User email the scan is stored under
+
+    Returns:
+        name: The source name
+        data: Original bytes (None if they could not be read)
+        document: Scan document without image bytes, or None if invalid
+        error: Why the scan is invalid, or None
+    """
+    data = None
+    try:
+        data = read()
+        with Image.open(BytesIO(data)) as image:
+            if image.format not in ALLOWED_FORMATS:
+                return name, data, None, f"unsupported format: {image.format}"
+            # Decode fully so truncated files are rejected here, not on display
+            image.load()
+            return name, data, scan_document(image, email, content_hash(data)), None
+    except Exception as e:
+        return name, data, None, f"decode error: {str(e)}"
+
+
+def write_batch(prepared, email, store, executor):
+    """
+    Store one batch of prepared scans and return their report rows
+
+    Args:
+        prepared: prepare_scan results for the batch
+        email: User email the scans are stored under
+        store: Blob store from get_blob_store(), or None for inline storage
+        executor: Thread pool used to write blob-store bytes
+
+    Returns:
+        rows: One report row (dictionary) per scan
+    """
+    rows = []
+    pending = []
+    batch_hashes = set()
+    duplicates = []
+    inserted = {}
+
+    valid = [(name, data, document) for name, data, document, error in prepared if document is not None]
+    rows.extend({'file': name, 'status': INVALID, 'error': error}
+                for name, _, document, error in prepared if document is None)
+    stored = find_stored_hashes(email, {document['content_hash'] for _, _, document in valid}) if valid else {}
+
+    for name, data, document in valid:
+        image_hash = document['content_hash']
+        if image_hash in stored:
+            rows.append({'file': name, 'status': DUPLICATE, 'id': str(stored[image_hash])})
+        elif image_hash in batch_hashes:
+            duplicates.append((name, image_hash))
+        else:
+            batch_hashes.add(image_hash)
+            pending.append((name, data, document))
+
+    def store_bytes(item):
+        name, data, document = item
+        try:
+            store_image_bytes(document, data, store)
+            return None
+        except Exception as e:
+            return str(e)
+
+    documents = []
+    names = []
+    for (name, _, document), error in zip(pending, executor.map(store_bytes, pending)):
+        if error:
+            rows.append({'file': name, 'status': INVALID, 'error': error})
+        else:
+            documents.append(document)
+            names.append(name)
+
+    if documents:
+        for name, document, error in zip(names, documents, insert_scans(documents)):
+            if error:
+                rows.append({'file': name, 'status': FAILED, 'error': error})
+            else:
+                inserted[document['content_hash']] = str(document['_id'])
+                rows.append({'file': name, 'status': INSERTED, 'id': inserted[document['content_hash']]})
+
+    # Repeats of a scan earlier in the same batch point at that scan's document
+    for name, image_hash in duplicates:
+        if image_hash in inserted:
+            rows.append({'file': name, 'status': DUPLICATE, 'id': inserted[image_hash]})
+        else:
+            rows.append({'file': name, 'status': FAILED, 'error': 'first copy in batch was not stored'})
+    return rows
+
+
+def ingest(sources, email, batch_size=100, workers=4, report=None, progress=None):
+    """
+    Ingest scans in batches, decoding the next batch while the current one is written
+
+    Args:
+        sources: (name, read) pairs from collect_sources
+        email: User email the scans are stored under
+        batch_size: Scans per insert_many
+        workers: Decode / blob-store threads
+        report: Optional text file the JSONL report rows are written to
+        progress: Optional callable(done, total) called after each batch
+
+    Returns:
+        counts: Dictionary of scans per status
+    """
+    counts = dict.fromkeys(STATUSES, 0)
+    batches = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+    store = get_blob_store()
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        def submit(batch):
+            return [executor.submit(prepare_scan, name, read, email) for name, read in batch]
+
+        pending = submit(batches[0]) if batches else []
+        for index in range(len(batches)):
+            prepared = [future.result() for future in pending]
+            if index + 1 < len(batches):
+                pending = submit(batches[index + 1])
+
+            for row in write_batch(prepared, email, store, executor):
+                counts[row['status']] += 1
+                if report is not None:
+                    report.write(json.dumps(row) + '\n')
+            if report is not None:
+                report.flush()
+            done += len(prepared)
+            if progress is not None:
+                progress(done, len(sources))
+    return counts
+
+
+def load_done(report_path):
+    """Return the files a previous report lists with a DONE_STATUSES outcome."""
+    done = set()
+    if os.path.exists(report_path):
+        with open(report_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                if row.get('status') in DONE_STATUSES:
+                    done.add(row['file'])
+    return done
+
+
+def main(argv=None):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description="Bulk ingestion of scan archives into the scans collection")
+    parser.add_argument('inputs', nargs='+', help='Directories, files, glob patterns or .zip archives of scans')
+    parser.add_argument('--user', required=True, help='Email of the user the scans are stored under')
+    parser.add_argument('--batch-size', type=int, default=100, help='Scans per insert_many')
+    parser.add_argument('--workers', type=int, default=4, help='Decode / blob-store worker threads')
+    parser.add_argument('--report', default='ingest_report.jsonl', help='Per-file JSONL report')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip files the report already lists as done and append to it')
+    args = parser.parse_args(argv)
+
+    def progress(done, total):
+        print(f"🔄 {done}/{total} scans processed", end='\r', flush=True)
+
+    # Zip archives stay open while their members are ingested and are closed on the way out
+    with ExitStack() as archives:
+        sources = collect_sources(args.inputs, archives)
+        if args.resume:
+            done = load_done(args.report)
+            sources = [(name, read) for name, read in sources if name not in done]
+        if not sources:
+            print("ℹ️ No scans to ingest")
+            return 0
+
+        start_metrics_exporter()
+        start = time.perf_counter()
+        try:
+            with open(args.report, 'a' if args.resume else 'w', encoding='utf-8') as report:
+                counts = ingest(sources, args.user, batch_size=max(1, args.batch_size), workers=args.workers,
+                                report=report, progress=progress)
+        except pymongo.errors.ConnectionFailure:
+            print("\n❌ Could not connect to MongoDB. Please ensure MongoDB is running.")
+            return 1
+
+    elapsed = time.perf_counter() - start
+    processed = sum(counts.values())
+    print(f"\n✅ Ingested {counts[INSERTED]} scans ({counts[DUPLICATE]} duplicates, {counts[INVALID]} invalid, "
+          f"{counts[FAILED]} failed) in {elapsed:.1f}s ({processed / elapsed:.1f} images/s). Report: {args.report}")
+    return 0 if counts[INVALID] == 0 and counts[FAILED] == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
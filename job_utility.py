@@ -0,0 +1,532 @@
+"""
+Persistent background job queue for scan analysis
+
+Jobs live in a local SQLite database (JOB_DB_PATH), so a queued or
+finished analysis survives browser disconnects, Streamlit reruns and
+server restarts. A JobWorkerPool claims queued jobs, runs predict_tumor
+(or its tiled counterpart) and stores the packed mask and scores. Failed
+jobs are retried with exponential backoff up to JOB_MAX_ATTEMPTS; jobs
+whose worker stopped sending heartbeats are put back in the queue.
+
+Cancellation is cooperative: a queued job is cancelled at once, a running
+job at its next stage boundary (a model call in progress runs to the end).
+
+Statuses: queued, running, done, failed, cancelled
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from io import BytesIO
+
+from PIL import Image
+
+from metrics_utility import JOBS_FINISHED, JOBS_RUNNING
+from result_utility import CompactResult, PackedMask
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+DEFAULT_DB_PATH = 'jobs.sqlite3'
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 2.0
+DEFAULT_TTL = 7 * 24 * 3600
+HEARTBEAT_INTERVAL = 5.0
+STALE_AFTER = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT,
+    name TEXT,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    image BLOB NOT NULL,
+    image_hash TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT,
+    mask_shape TEXT,
+    mask_data BLOB,
+    worker TEXT,
+    created REAL NOT NULL,
+    available_at REAL NOT NULL,
+    started REAL,
+    heartbeat REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_by_owner ON jobs (owner, created);
+"""
+
+# Every column except the image bytes, for listings and status polls
+_COLUMNS = ('id', 'owner', 'name', 'status', 'params', 'image_hash', 'attempts', 'max_attempts',
+            'cancel_requested', 'error', 'result', 'mask_shape', 'mask_data', 'worker',
+            'created', 'available_at', 'started', 'heartbeat', 'finished')
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when the job it is running was cancelled."""
+
+
+class Job:
+    """
+    One row of the job table
+
+    Attributes:
+        id, owner, name, status, attempts, max_attempts, error, created,
+        started, finished: As stored
+        params: Dictionary of analysis parameters (threshold, min_size,
+                tiling, cache_key)
+        scores: Dictionary of result scores once done, else None
+        image: Uploaded bytes (only when fetched with_image=True)
+    """
+
+    def __init__(self, row):
+        keys = row.keys()
+        for key in keys:
+            if key not in ('params', 'result', 'image'):
+                setattr(self, key, row[key])
+        self.params = json.loads(row['params'])
+        self.scores = json.loads(row['result']) if row['result'] else None
+        self.image = row['image'] if 'image' in keys else None
+        self.cancel_requested = bool(self.cancel_requested)
+
+    def result(self):
+        """The stored analysis as a CompactResult, or None until the job is done."""
+        if self.status != DONE or self.scores is None:
+            return None
+        mask = PackedMask(json.loads(self.mask_shape), self.mask_data)
+        return CompactResult(self.image_hash, mask, **self.scores)
+
+    def __repr__(self):
+        return f"Job(id={self.id[:12]}, status={self.status}, attempts={self.attempts}/{self.max_attempts})"
+
+
+class JobQueue:
+    """
+    SQLite-backed job table shared by the UI and any number of workers
+
+    Every call opens its own connection, so one JobQueue can be used from
+    any thread and several processes can share the same database file.
+
+    Args:
+        path: Database file
+        max_attempts: Default attempts per job before it is marked failed
+        retry_delay: Seconds before the first retry; doubles on every attempt
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return _Closing(connection)
+
+    def submit(self, image_bytes, owner=None, name=None, threshold=0.5, min_size=200, tiling=None,
+               image_hash=None, cache_key=None, max_attempts=None):
+        """
+        Queue one scan for analysis
+
+        Args:
+            image_bytes: Encoded image (JPG/PNG) as uploaded
+            owner: User the job belongs to (e.g. email), for listings
+            name: Original file name
+            threshold, min_size: Post-processing parameters
+            tiling: Optional tiling configuration from get_tiling_config
+            image_hash: Content hash of image_bytes, stored with the result
+            cache_key: Optional ResultCache key to store the result under
+            max_attempts: Attempts before the job is marked failed
+
+        Returns:
+            job_id: Identifier for get, cancel and retry
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        params = {'threshold': threshold, 'min_size': min_size, 'tiling': tiling, 'cache_key': cache_key}
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, owner, name, status, params, image, image_hash, max_attempts, "
+                "created, available_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, owner, name, QUEUED, json.dumps(params), sqlite3.Binary(image_bytes), image_hash,
+                 max_attempts or self.max_attempts, now, now))
+        return job_id
+
+    def get(self, job_id, with_image=False):
+        """
+        Fetch one job
+
+        Returns:
+            job: Job, or None for an unknown id
+        """
+        columns = ', '.join(_COLUMNS + (('image',) if with_image else ()))
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(row) if row else None
+
+    def list_jobs(self, owner, limit=10):
+        """Most recent jobs of one owner, newest first (without image bytes)."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE owner = ? ORDER BY created DESC LIMIT ?",
+                (owner, limit)).fetchall()
+        return [Job(row) for row in rows]
+
+    def counts(self):
+        """Number of jobs per status."""
+        with self._connect() as connection:
+            return dict(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def claim(self, worker_id):
+        """
+        Atomically take the oldest runnable job
+
+        Returns:
+            job: Job with its image bytes and status 'running', or None
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND available_at <= ? ORDER BY created LIMIT 1",
+                    (QUEUED, now)).fetchone()
+                if row is None:
+                    connection.execute('COMMIT')
+                    return None
+                connection.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started = ?, "
+                    "heartbeat = ?, error = NULL WHERE id = ?",
+                    (RUNNING, worker_id, now, now, row['id']))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        return self.get(row['id'], with_image=True)
+
+    def heartbeat(self, job_ids):
+        """Mark running jobs as alive; returns the ids whose cancellation was requested."""
+        if not job_ids:
+            return set()
+        placeholders = ', '.join('?' * len(job_ids))
+        with self._connect() as connection:
+            connection.execute(f"UPDATE jobs SET heartbeat = ? WHERE id IN ({placeholders}) AND status = ?",
+                               (time.time(), *job_ids, RUNNING))
+            rows = connection.execute(
+                f"SELECT id FROM jobs WHERE id IN ({placeholders}) AND cancel_requested = 1",
+                tuple(job_ids)).fetchall()
+        return {row['id'] for row in rows}
+
+    def is_cancel_requested(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def complete(self, job_id, result):
+        """
+        Store the result of a running job
+
+        Args:
+            job_id: Job being completed
+            result: CompactResult
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, mask_shape = ?, mask_data = ?, finished = ? "
+                "WHERE id = ? AND status = ?",
+                (DONE, json.dumps(result.to_dict()), json.dumps(result.mask.shape),
+                 sqlite3.Binary(result.mask.data), time.time(), job_id, RUNNING))
+
+    def fail(self, job_id, error):
+        """
+        Record a failed attempt, re-queueing the job with backoff while attempts remain
+
+        Returns:
+            status: 'queued' if it will be retried, 'cancelled' if cancellation
+                    was requested meanwhile, otherwise 'failed'
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT attempts, max_attempts, cancel_requested FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+            if row is None:
+                return FAILED
+            if row['cancel_requested']:
+                connection.execute("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? AND status = ?",
+                                   (CANCELLED, error, now, job_id, RUNNING))
+                return CANCELLED
+            if row['attempts'] < row['max_attempts']:
+                delay = self.retry_delay * 2 ** (row['attempts'] - 1)
+                connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, available_at = ?, worker = NULL "
+                    "WHERE id = ? AND status = ?", (QUEUED, error, now + delay, job_id, RUNNING))
+                return QUEUED
+            connection.execute("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? AND status = ?",
+                               (FAILED, error, now, job_id, RUNNING))
+            return FAILED
+
+    def cancel(self, job_id):
+        """
+        Cancel a job: immediately when queued, at its next stage when running
+
+        Returns:
+            cancelled: False if the job had already finished
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute("UPDATE jobs SET status = ?, cancel_requested = 1, finished = ? "
+                                        "WHERE id = ? AND status = ?", (CANCELLED, now, job_id, QUEUED))
+            if cursor.rowcount:
+                return True
+            cursor = connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                                        (job_id, RUNNING))
+            return bool(cursor.rowcount)
+
+    def mark_cancelled(self, job_id):
+        """Called by a worker that stopped a running job on request."""
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                               (CANCELLED, time.time(), job_id, RUNNING))
+
+    def retry(self, job_id):
+        """
+        Put a failed or cancelled job back in the queue with a fresh attempt budget
+
+        Returns:
+            queued: False if the job is not failed or cancelled
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, cancel_requested = 0, error = NULL, finished = NULL, "
+                "available_at = ? WHERE id = ? AND status IN (?, ?)", (QUEUED, now, job_id, FAILED, CANCELLED))
+            return bool(cursor.rowcount)
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        """
+        Recover running jobs whose worker stopped sending heartbeats
+
+        The interrupted run counts as an attempt; jobs out of attempts fail.
+
+        Returns:
+            recovered: Number of jobs re-queued or failed
+        """
+        now = time.time()
+        cutoff = now - stale_after
+        with self._connect() as connection:
+            failed = connection.execute(
+                "UPDATE jobs SET status = ?, error = 'worker stopped', finished = ? "
+                "WHERE status = ? AND heartbeat < ? AND attempts >= max_attempts",
+                (FAILED, now, RUNNING, cutoff)).rowcount
+            queued = connection.execute(
+                "UPDATE jobs SET status = ?, error = 'worker stopped', worker = NULL, available_at = ? "
+                "WHERE status = ? AND heartbeat < ?", (QUEUED, now, RUNNING, cutoff)).rowcount
+        if failed or queued:
+            logger.warning("Recovered %d stale jobs (%d re-queued, %d failed)", failed + queued, queued, failed)
+        return failed + queued
+
+    def purge(self, ttl=DEFAULT_TTL):
+        """Delete finished jobs older than ttl seconds; returns the number removed."""
+        placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+        with self._connect() as connection:
+            return connection.execute(f"DELETE FROM jobs WHERE status IN ({placeholders}) AND finished < ?",
+                                      (*FINISHED_STATUSES, time.time() - ttl)).rowcount
+
+
+class _Closing:
+    """Context manager that closes a sqlite3 connection (sqlite3's own only ends transactions)."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        self.connection.close()
+
+
+def run_analysis(job, model, check_cancelled=lambda: None):
+    """
+    Analyse the scan of a claimed job
+
+    Args:
+        job: Job fetched with its image bytes
+        model: Loaded segmentation model
+        check_cancelled: Called between stages; raises JobCancelled to stop
+
+    Returns:
+        result: CompactResult
+    """
+    from model_utility import predict_tumor, predict_tumor_tiled
+
+    image = Image.open(BytesIO(job.image))
+    image.load()
+    check_cancelled()
+    params = job.params
+    if params.get('tiling'):
+        result = predict_tumor_tiled(image, model, threshold=params['threshold'], min_size=params['min_size'],
+                                     **params['tiling'])
+    else:
+        result = predict_tumor(image, model, threshold=params['threshold'], min_size=params['min_size'])
+    check_cancelled()
+    return CompactResult.from_analysis(result, job.image_hash)
+
+
+class JobWorkerPool:
+    """
+    Threads that claim and run jobs from a JobQueue
+
+    Args:
+        job_queue: JobQueue to work on
+        model_loader: Callable returning the loaded model (called per job,
+                      so it should cache, e.g. model_utility.get_model)
+        concurrency: Number of worker threads
+        poll_interval: Seconds an idle worker waits before polling again
+    """
+
+    def __init__(self, job_queue, model_loader, concurrency=1, poll_interval=0.5):
+        self.queue = job_queue
+        self.model_loader = model_loader
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running = set()
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.queue.requeue_stale()
+        self._threads = [threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+                         for index in range(self.concurrency)]
+        self._threads.append(threading.Thread(target=self._keep_alive, name='job-heartbeat', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info("Started %d job workers on %s", self.concurrency, self.queue.path)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _keep_alive(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            with self._lock:
+                running = list(self._running)
+            try:
+                cancelled = self.queue.heartbeat(running)
+                self.queue.requeue_stale()
+            except sqlite3.Error as e:
+                logger.warning("Job heartbeat failed: %s", e)
+                continue
+            with self._lock:
+                self._cancelled |= cancelled
+
+    def _check_cancelled(self, job_id):
+        with self._lock:
+            cancelled = job_id in self._cancelled
+        if cancelled or self.queue.is_cancel_requested(job_id):
+            raise JobCancelled(job_id)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(self.worker_id)
+            except sqlite3.Error as e:
+                logger.warning("Could not claim a job: %s", e)
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        """Run one claimed job and record its outcome."""
+        with self._lock:
+            self._running.add(job.id)
+        JOBS_RUNNING.inc()
+        start = time.perf_counter()
+        try:
+            self._check_cancelled(job.id)
+            result = run_analysis(job, self.model_loader(), check_cancelled=lambda: self._check_cancelled(job.id))
+            self.queue.complete(job.id, result)
+            JOBS_FINISHED.inc(status=DONE)
+            logger.info("Job %s done in %.0f ms (attempt %d)", job.id, (time.perf_counter() - start) * 1000,
+                        job.attempts)
+        except JobCancelled:
+            self.queue.mark_cancelled(job.id)
+            JOBS_FINISHED.inc(status=CANCELLED)
+            logger.info("Job %s cancelled", job.id)
+        except Exception as e:
+            status = self.queue.fail(job.id, str(e))
+            JOBS_FINISHED.inc(status=status)
+            logger.warning("Job %s attempt %d failed (%s): %s", job.id, job.attempts,
+                           {QUEUED: 'will retry', CANCELLED: 'cancelled'}.get(status, 'giving up'), e)
+        finally:
+            JOBS_RUNNING.dec()
+            with self._lock:
+                self._running.discard(job.id)
+                self._cancelled.discard(job.id)
+
+
+def get_worker_count():
+    """Worker threads the app runs in-process (JOB_WORKERS, default 1; 0 = external workers only)."""
+    return int(os.getenv('JOB_WORKERS', '1'))
+
+
+# Process-wide queue, created lazily on first use
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def job_queue_enabled():
+    """Whether the Upload page submits analyses to the job queue (JOB_QUEUE=1)."""
+    return os.getenv('JOB_QUEUE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_job_queue():
+    """
+    Get the shared, process-wide job queue
+
+    Configuration comes from the environment:
+
+        JOB_DB_PATH        SQLite database file (default: jobs.sqlite3)
+        JOB_MAX_ATTEMPTS   attempts per job before it fails (default: 3)
+        JOB_RETRY_DELAY    seconds before the first retry, doubling (default: 2)
+
+    Returns:
+        job_queue: JobQueue shared by all callers
+    """
+    global _job_queue
+
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(
+                    path=os.getenv('JOB_DB_PATH', DEFAULT_DB_PATH),
+                    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', str(DEFAULT_MAX_ATTEMPTS))),
+                    retry_delay=float(os.getenv('JOB_RETRY_DELAY', str(DEFAULT_RETRY_DELAY)))
+                )
+    return _job_queue
@@ -0,0 +1,74 @@
+"""
+Standalone worker for the background analysis job queue
+
+Runs a JobWorkerPool against the same SQLite job database the app uses,
+so analyses can run outside the Streamlit process (set JOB_WORKERS=0 in
+the app to leave all jobs to external workers). Several worker processes
+can share one database.
+
+Usage:
+    python job_worker.py --workers 2 --db jobs.sqlite3
+    python job_worker.py --status
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import job_utility
+from metrics_utility import start_metrics_exporter
+from model_utility import get_model
+
+
+def main(argv=None):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description="Standalone worker for the background analysis job queue")
+    parser.add_argument('--db', default=os.getenv('JOB_DB_PATH', job_utility.DEFAULT_DB_PATH),
+                        help='Job database file (default: JOB_DB_PATH or jobs.sqlite3)')
+    parser.add_argument('--workers', type=int, default=max(job_utility.get_worker_count(), 1),
+                        help='Concurrent jobs (default: JOB_WORKERS or 1)')
+    parser.add_argument('--model', default=None, help='Model path (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds between polls when idle')
+    parser.add_argument('--purge-days', type=float, default=7, help='Delete finished jobs older than this at start')
+    parser.add_argument('--status', action='store_true', help='Print job counts per status and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    job_queue = job_utility.JobQueue(
+        args.db,
+        max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', str(job_utility.DEFAULT_MAX_ATTEMPTS))),
+        retry_delay=float(os.getenv('JOB_RETRY_DELAY', str(job_utility.DEFAULT_RETRY_DELAY)))
+    )
+    if args.status:
+        for status, count in sorted(job_queue.counts().items()):
+            print(f"{status:<10}{count:>6}")
+        return 0
+
+    start_metrics_exporter()
+    purged = job_queue.purge(ttl=args.purge_days * 24 * 3600)
+    if purged:
+        logging.info("Purged %d finished jobs", purged)
+
+    model = get_model(args.model)
+    pool = job_utility.JobWorkerPool(job_queue, lambda: model, concurrency=args.workers,
+                                     poll_interval=args.poll_interval).start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop(timeout=5)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""
+Process-wide counters, gauges and latency histograms in Prometheus text format
+
+The metrics below are updated by the inference, storage and auth code
+paths. start_metrics_exporter() exposes them without extra dependencies:
+over HTTP at /metrics on METRICS_PORT, and/or by rewriting METRICS_FILE
+every METRICS_INTERVAL seconds (for a node_exporter textfile collector or
+for CLI runs, which also write it once more at exit). Cache hit rates are
+brain_cache_requests_total{result="hit"} over all requests of that cache.
+"""
+import atexit
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_METRICS_HOST = '127.0.0.1'
+DEFAULT_METRICS_INTERVAL = 15
+
+# Seconds; spans a fast Mongo read up to a cold model load
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROBABILITY_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base for a named metric family with a fixed set of label names
+
+    Args:
+        name: Metric name
+        documentation: HELP text
+        labelnames: Names of the labels every update must supply
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        # Unlabelled metrics report zero until first updated
+        if not self.labelnames:
+            self._values[()] = self._initial()
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def _samples(self, key, value):
+        yield self.name + self._labels(key), value
+
+    def render(self):
+        """Return this family's HELP, TYPE and sample lines."""
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            for key, value in items:
+                lines.extend(f"{name} {_format_value(sample)}" for name, sample in self._samples(key, value))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that can go up and down, e.g. requests in flight."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        """Count the enclosed block as in flight while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets
+
+    Args:
+        buckets: Increasing upper bounds; +Inf is added automatically
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames)
+
+    def _initial(self):
+        return [[0] * len(self.buckets), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self._initial()
+            counts = state[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the enclosed block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, **labels):
+        """Decorator form of time() for plain (non-generator) functions."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _samples(self, key, state):
+        counts, total, count = state
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield f"{self.name}_bucket{self._labels(key, [('le', _format_value(bound))])}", cumulative
+        yield f"{self.name}_sum{self._labels(key)}", total
+        yield f"{self.name}_count{self._labels(key)}", count
+
+
+class Registry:
+    """Ordered collection of metric families rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Return every family in Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# Inference
+MODEL_LOAD_SECONDS = REGISTRY.register(Histogram(
+    'brain_model_load_seconds', 'Time to load the segmentation model from disk', ['backend']))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'brain_analysis_stage_seconds', 'Wall time of analysis pipeline stages', ['stage']))
+INFERENCE_IN_FLIGHT = REGISTRY.register(Gauge(
+    'brain_inference_in_flight', 'Model forward passes currently running'))
+PREDICTIONS = REGISTRY.register(Counter(
+    'brain_predictions_total', 'Analysed images by outcome', ['tumor_present']))
+PREDICTION_MAX_PROBABILITY = REGISTRY.register(Histogram(
+    'brain_prediction_max_probability', 'Highest clipped tumor probability per analysed image',
+    buckets=PROBABILITY_BUCKETS))
+
+# Storage
+MONGO_SECONDS = REGISTRY.register(Histogram(
+    'brain_mongo_operation_seconds', 'Latency of MongoDB operations', ['operation']))
+MONGO_ERRORS = REGISTRY.register(Counter(
+    'brain_mongo_errors_total', 'MongoDB operations that failed', ['operation']))
+
+# Auth
+AUTH_SECONDS = REGISTRY.register(Histogram(
+    'brain_auth_call_seconds', 'Latency of auth backend (Firebase) calls', ['call']))
+AUTH_ERRORS = REGISTRY.register(Counter(
+    'brain_auth_errors_total', 'Auth backend (Firebase) calls that failed', ['call']))
+
+# Caches and concurrency
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'brain_cache_requests_total', 'Cache lookups by cache and outcome (hit or miss)', ['cache', 'result']))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    'brain_http_requests_in_flight', 'Inference server requests being handled'))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    'brain_http_request_seconds', 'Inference server request latency', ['method', 'status']))
+JOBS_RUNNING = REGISTRY.register(Gauge(
+    'brain_jobs_running', 'Queued analyses currently running in this process'))
+JOBS_FINISHED = REGISTRY.register(Counter(
+    'brain_jobs_finished_total', 'Job attempts finished by this process, by resulting job status', ['status']))
+
+
+def record_cache_lookup(cache, hit):
+    """Count one lookup of the named cache as a hit or a miss."""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def render_metrics():
+    """Return all metrics in Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+def write_metrics_file(path):
+    """
+    Atomically replace a file with the current metrics
+
+    Args:
+        path: Destination, e.g. a node_exporter textfile collector *.prom file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(render_metrics())
+    os.replace(temp_path, path)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serve the registry at /metrics."""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+# Process-wide exporter, started at most once
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+
+def start_metrics_exporter():
+    """
+    Start exposing metrics as configured by the environment (once per process)
+
+        METRICS_PORT      Serve http://METRICS_HOST:METRICS_PORT/metrics (unset or 0: off)
+        METRICS_HOST      Interface to bind (default: 127.0.0.1)
+        METRICS_FILE      Rewrite this file periodically and at exit (unset: off)
+        METRICS_INTERVAL  Seconds between file writes (default: 15)
+
+    Returns:
+        server: The running ThreadingHTTPServer, or None when not serving
+    """
+    global _exporter_started
+
+    with _exporter_lock:
+        if _exporter_started:
+            return None
+        _exporter_started = True
+
+    server = None
+    port = int(os.getenv('METRICS_PORT', '0') or 0)
+    if port:
+        host = os.getenv('METRICS_HOST', DEFAULT_METRICS_HOST)
+        try:
+            server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        except OSError as e:
+            # e.g. a second app process on the same machine; keep running without the endpoint
+            logger.warning("Could not serve metrics on %s:%d: %s", host, port, e)
+        else:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+            logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+
+    path = os.getenv('METRICS_FILE')
+    if path:
+        interval = float(os.getenv('METRICS_INTERVAL', str(DEFAULT_METRICS_INTERVAL)))
+
+        def write_periodically():
+            while True:
+                try:
+                    write_metrics_file(path)
+                except OSError as e:
+                    logger.warning("Could not write metrics file %s: %s", path, e)
+                time.sleep(interval)
+
+        threading.Thread(target=write_periodically, name='metrics-file', daemon=True).start()
+        atexit.register(write_metrics_file, path)
+    return server
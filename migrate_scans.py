@@ -0,0 +1,236 @@
+"""
+Migrate per-email scan collections into the shared scans collection
+
+Earlier versions stored each user's scans in a collection named after their
+email. This copies every such collection into the single 'scans' collection
+(adding the 'user' field) in batches of upserts keyed by _id, recording the
+last copied _id per source in a 'scan_migrations' checkpoint collection.
+An interrupted run resumes from its checkpoint, and re-running after the
+app wrote more scans to an old collection copies only the new ones. Blob
+references are copied as-is, so GridFS and filesystem bytes are not moved.
+
+Old documents predate content hashes and thumbnails, so each copied scan
+gets the content_hash, thumbnail, image_mode and image_size fields that
+scan_document sets on new uploads. A scan whose bytes a user already has
+in the scans collection is skipped as a duplicate (the (user, content_hash)
+index is unique) and recorded in the checkpoint.
+
+Usage:
+    python migrate_scans.py --dry-run
+    python migrate_scans.py --batch-size 500
+    python migrate_scans.py --user someone@example.com --drop-source
+"""
+import argparse
+import logging
+import os
+import sys
+from contextlib import closing
+from io import BytesIO
+
+import bson
+import pymongo
+from PIL import Image
+
+from db_utility import SCANS_COLLECTION, get_database, get_scans_collection
+from storage_utility import content_hash, get_blob_store
+from upload_utility import THUMBNAIL_FORMAT, make_thumbnail
+
+CHECKPOINT_COLLECTION = 'scan_migrations'
+DEFAULT_BATCH_SIZE = 500
+DUPLICATE_KEY_ERROR = 11000
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_collections(db):
+    """
+    List the per-email collections left over from the previous layout
+
+    Args:
+        db: pymongo Database of the app
+
+    Returns:
+        names: Sorted collection names that look like email addresses
+    """
+    return sorted(name for name in db.list_collection_names()
+                  if '@' in name and not name.startswith('system.') and name != SCANS_COLLECTION)
+
+
+def add_derived_fields(doc):
+    """
+    Fill in the content_hash and thumbnail fields scan_document adds to new scans
+
+    The original bytes are read from the document or its blob store; blob
+    references already carry their SHA-256. Fields the document has are
+    kept.
+
+    Args:
+        doc: Scan document, updated in place
+
+    Returns:
+        doc: The same document
+    """
+    if 'content_hash' in doc and 'thumbnail' in doc:
+        return doc
+    ref = doc.get('blob')
+    if doc.get('image') is not None:
+        stream = BytesIO(doc['image'])
+    elif ref is not None:
+        stream = get_blob_store(ref['backend']).open(ref)
+    else:
+        return doc
+
+    with closing(stream):
+        if 'content_hash' not in doc:
+            doc['content_hash'] = ref['sha256'] if ref and ref.get('sha256') else content_hash(stream)
+        if 'thumbnail' not in doc:
+            try:
+                image = Image.open(stream)
+                doc['thumbnail'] = bson.Binary(make_thumbnail(image))
+                doc['thumbnail_format'] = THUMBNAIL_FORMAT
+                doc.setdefault('image_mode', image.mode)
+                doc.setdefault('image_size', image.size)
+            except OSError as e:
+                logger.warning("No thumbnail for scan %s: %s", doc['_id'], e)
+    return doc
+
+
+def migrate_collection(db, email, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Copy one per-email collection into the scans collection, resuming from its checkpoint
+
+    Args:
+        db: pymongo Database of the app
+        email: Name of the source collection (the user's email)
+        batch_size: Documents read and written per round-trip
+        dry_run: Only count what would be copied
+
+    Returns:
+        copied: Number of documents copied by this run (duplicates excluded)
+    """
+    source = db[email]
+    scans = get_scans_collection()
+    checkpoints = db[CHECKPOINT_COLLECTION]
+
+    checkpoint = checkpoints.find_one({'_id': email}) or {}
+    query = {'_id': {'$gt': checkpoint['last_id']}} if 'last_id' in checkpoint else {}
+    if dry_run:
+        return source.count_documents(query)
+
+    copied = 0
+    cursor = source.find(query).sort('_id', pymongo.ASCENDING).batch_size(batch_size)
+    batch = []
+    for doc in cursor:
+        doc['user'] = email
+        # Listings sort on upload_date; fall back to the ObjectId time like StoredImage does
+        if doc.get('upload_date') is None:
+            doc['upload_date'] = doc['_id'].generation_time.replace(tzinfo=None)
+        batch.append(add_derived_fields(doc))
+        if len(batch) >= batch_size:
+            copied += _flush(scans, checkpoints, email, batch)
+            batch = []
+    if batch:
+        copied += _flush(scans, checkpoints, email, batch)
+    return copied
+
+
+def _flush(scans, checkpoints, email, batch):
+    """Upsert one batch by _id, then advance the source's checkpoint past it."""
+    duplicates = []
+    try:
+        scans.bulk_write([pymongo.ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in batch], ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        # Only duplicate content is skipped; any other failure stops before the checkpoint moves
+        write_errors = e.details.get('writeErrors', [])
+        if e.details.get('writeConcernErrors') or any(error.get('code') != DUPLICATE_KEY_ERROR
+                                                      for error in write_errors):
+            raise
+        duplicates = [batch[error['index']]['_id'] for error in write_errors]
+        logger.warning("%s: skipped %d scans already stored for this user", email, len(duplicates))
+
+    update = {'$set': {'last_id': batch[-1]['_id']}, '$inc': {'copied': len(batch) - len(duplicates)}}
+    if duplicates:
+        update['$addToSet'] = {'duplicate_ids': {'$each': duplicates}}
+    checkpoints.update_one({'_id': email}, update, upsert=True)
+    return len(batch) - len(duplicates)
+
+
+def drop_source(db, email, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Drop a per-email collection once every document in it exists in the scans collection
+
+    Documents the migration skipped as duplicates count as copied.
+
+    Args:
+        db: pymongo Database of the app
+        email: Name of the source collection
+        batch_size: Source IDs checked per query
+
+    Returns:
+        dropped: Boolean indicating whether the collection was dropped
+    """
+    scans = get_scans_collection()
+    checkpoint = db[CHECKPOINT_COLLECTION].find_one({'_id': email}) or {}
+    duplicates = set(checkpoint.get('duplicate_ids', []))
+    cursor = db[email].find({}, {'_id': 1}).batch_size(batch_size)
+    total = migrated = 0
+    ids = []
+    for doc in cursor:
+        if doc['_id'] in duplicates:
+            migrated += 1
+            total += 1
+            continue
+        ids.append(doc['_id'])
+        if len(ids) >= batch_size:
+            migrated += scans.count_documents({'_id': {'$in': ids}, 'user': email})
+            total += len(ids)
+            ids = []
+    if ids:
+        migrated += scans.count_documents({'_id': {'$in': ids}, 'user': email})
+        total += len(ids)
+    if migrated != total:
+        logger.warning("Not dropping %s: %d of %d documents migrated", email, migrated, total)
+        return False
+    db[email].drop()
+    db[CHECKPOINT_COLLECTION].delete_one({'_id': email})
+    return True
+
+
+def main(argv=None):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description="Migrate per-email scan collections into the shared scans collection")
+    parser.add_argument('--user', action='append', default=None,
+                        help='Migrate only this email (repeatable; default: every per-email collection)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Documents per bulk write')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be copied and exit')
+    parser.add_argument('--drop-source', action='store_true',
+                        help='Drop each per-email collection after verifying it was fully copied')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    db = get_database()
+    emails = args.user or legacy_collections(db)
+    if not emails:
+        logger.info("No per-email collections to migrate")
+        return 0
+
+    total = 0
+    for email in emails:
+        copied = migrate_collection(db, email, batch_size=args.batch_size, dry_run=args.dry_run)
+        total += copied
+        logger.info("%s: %s %d documents", email, 'would copy' if args.dry_run else 'copied', copied)
+        if args.drop_source and not args.dry_run and drop_source(db, email, args.batch_size):
+            logger.info("%s: dropped source collection", email)
+    logger.info("%s %d documents from %d collections", 'Would copy' if args.dry_run else 'Copied', total, len(emails))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
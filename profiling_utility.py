@@ -0,0 +1,284 @@
+"""
+Opt-in, sampled cProfile and tracemalloc capture per request
+
+With PROFILE_SAMPLE_RATE > 0, a sampled fraction of calls to functions
+wrapped with @profiled (or blocks wrapped in profile_request) run under
+cProfile and tracemalloc. Each sampled request writes two files to
+PROFILE_DIR:
+
+    <time>-<name>-<id>.prof   cProfile stats (python -m pstats, snakeviz)
+    <time>-<name>-<id>.json   wall time, CPU time and peak allocated bytes
+                              for the request and each StageTimer stage,
+                              plus the largest allocation sites
+
+Nested profiled calls are folded into the outermost request. When
+profiling is off (the default) a wrapped call costs one flag check.
+
+tracemalloc is process-wide, so with concurrent sampled requests the
+peaks include other threads' allocations; profile one request at a time
+(e.g. PROFILE_SAMPLE_RATE=1 on a quiet instance) for exact figures.
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_DIR = 'profiles'
+TOP_ALLOCATIONS = 10
+
+
+class ProfileSession:
+    """
+    Measurements of one sampled request
+
+    Args:
+        name: Request name used in the file names
+        trace_memory: Also trace allocations with tracemalloc
+    """
+
+    def __init__(self, name, trace_memory=True):
+        self.name = name
+        self.id = uuid.uuid4().hex[:8]
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.profiler = cProfile.Profile()
+        self.profiling = False
+        self._open_stages = []
+
+    def start(self):
+        if self.trace_memory:
+            _start_tracing()
+            self.memory_baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self.peak = self.memory_baseline
+        try:
+            self.profiler.enable()
+            self.profiling = True
+        except ValueError as e:
+            # Another profiler is already active (only one at a time on Python 3.12+)
+            logger.debug("cProfile unavailable for %s: %s", self.name, e)
+        self.started_at = datetime.now()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+
+    def _fold_peak(self):
+        """Carry the peak since the last reset into the request and every open stage."""
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak = max(self.peak, peak)
+        for stage in self._open_stages:
+            stage['peak'] = max(stage['peak'], peak)
+
+    def stage_started(self, name):
+        memory = 0
+        if self.trace_memory:
+            # Keep the peaks so far, then measure from the current allocation level
+            self._fold_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._open_stages.append({'stage': name, 'wall': time.perf_counter(), 'cpu': time.thread_time(),
+                                  'memory': memory, 'peak': memory})
+
+    def stage_finished(self, name):
+        if not self._open_stages or self._open_stages[-1]['stage'] != name:
+            return
+        if self.trace_memory:
+            self._fold_peak()
+        stage = self._open_stages.pop()
+        result = {
+            'stage': name,
+            'wall_seconds': time.perf_counter() - stage['wall'],
+            'cpu_seconds': time.thread_time() - stage['cpu']
+        }
+        if self.trace_memory:
+            result['peak_allocated_bytes'] = max(0, stage['peak'] - stage['memory'])
+        self.stages.append(result)
+
+    def finish(self, error=None):
+        """Stop measuring and build the JSON summary."""
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        if self.profiling:
+            self.profiler.disable()
+        summary = {
+            'name': self.name,
+            'id': self.id,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'stages': self.stages,
+            'error': error
+        }
+        if self.trace_memory:
+            self._fold_peak()
+            summary['peak_allocated_bytes'] = max(0, self.peak - self.memory_baseline)
+            snapshot = tracemalloc.take_snapshot()
+            summary['top_allocations'] = [
+                {'location': str(stat.traceback), 'bytes': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            ]
+            _stop_tracing()
+        return summary
+
+    def dump(self, directory, summary):
+        """
+        Write the .prof and .json files for this request
+
+        Returns:
+            path: Path of the JSON summary
+        """
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, f"{self.started_at:%Y%m%d-%H%M%S}-{self.name}-{self.id}")
+        if self.profiling:
+            self.profiler.dump_stats(stem + '.prof')
+        with open(stem + '.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        return stem + '.json'
+
+
+# tracemalloc is process-wide: start it for the first active session and
+# stop it after the last, unless something else was already tracing
+_tracing_lock = threading.Lock()
+_tracing_sessions = 0
+_tracing_owned = False
+
+
+def _start_tracing():
+    global _tracing_sessions, _tracing_owned
+
+    with _tracing_lock:
+        if _tracing_sessions == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_owned = True
+        _tracing_sessions += 1
+
+
+def _stop_tracing():
+    global _tracing_sessions, _tracing_owned
+
+    with _tracing_lock:
+        _tracing_sessions -= 1
+        if _tracing_sessions == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+
+
+class Profiler:
+    """
+    Sampling policy and output directory
+
+    Args:
+        sample_rate: Fraction of requests to profile (0 disables profiling)
+        directory: Where the .prof / .json files go
+        trace_memory: Also trace allocations with tracemalloc
+    """
+
+    def __init__(self, sample_rate=0.0, directory=DEFAULT_PROFILE_DIR, trace_memory=True):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.trace_memory = trace_memory
+        self.enabled = sample_rate > 0
+
+    def should_sample(self):
+        return self.enabled and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+
+# Session of the request running on each thread
+_local = threading.local()
+
+
+def current_session():
+    """The ProfileSession of this thread's sampled request, or None."""
+    return getattr(_local, 'session', None)
+
+
+@contextmanager
+def profile_request(name):
+    """
+    Profile the enclosed block as one request, if it is sampled
+
+    Args:
+        name: Request name used in the file names
+
+    Yields:
+        session: The active ProfileSession, or None when not sampled
+    """
+    profiler = get_profiler()
+    if not profiler.enabled or current_session() is not None or not profiler.should_sample():
+        yield current_session()
+        return
+
+    session = ProfileSession(name, trace_memory=profiler.trace_memory)
+    _local.session = session
+    session.start()
+    error = None
+    try:
+        yield session
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        _local.session = None
+        try:
+            path = session.dump(profiler.directory, session.finish(error))
+            logger.info("Profiled %s -> %s", name, path)
+        except Exception as e:
+            logger.warning("Could not write profile for %s: %s", name, e)
+
+
+def profiled(name=None):
+    """
+    Decorator form of profile_request for plain (non-generator) functions
+
+    Args:
+        name: Request name (default: the function name)
+    """
+    def decorator(func):
+        request_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not get_profiler().enabled:
+                return func(*args, **kwargs)
+            with profile_request(request_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Process-wide profiler settings, read lazily on first use
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """
+    Get the process-wide profiler, configured from the environment
+
+        PROFILE_SAMPLE_RATE  Fraction of requests to profile, 0-1 (default: 0, off)
+        PROFILE_DIR          Output directory (default: profiles)
+        PROFILE_MEMORY       1 to trace allocations with tracemalloc, 0 for CPU only (default: 1)
+
+    Returns:
+        profiler: Profiler shared by all callers
+    """
+    global _profiler
+
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = Profiler(
+                    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0') or 0),
+                    directory=os.getenv('PROFILE_DIR', DEFAULT_PROFILE_DIR),
+                    trace_memory=os.getenv('PROFILE_MEMORY', '1') != '0'
+                )
+    return _profiler
@@ -0,0 +1,172 @@
+"""
+Compact analysis results
+
+An AnalysisResult carries the full side-by-side composite, an (H, 2W, 3)
+uint8 array (384 KB at 256x256). Sessions and the result cache keep a
+CompactResult instead: the mask bit-packed and deflated (typically well
+under 1 KB), the scores, and the content hash of the uploaded scan the mask
+belongs to. The composite is rebuilt from the original upload only when it
+is displayed, and encoded once as lossless PNG or WebP.
+"""
+import hashlib
+import zlib
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from model_utility import AnalysisResult, prepare_image
+
+COMPOSITE_LAYOUTS = ('side-by-side', 'overlay')
+COMPOSITE_FORMATS = ('PNG', 'WEBP')
+
+# Overlay tint for tumor pixels and its opacity
+OVERLAY_COLOR = (231, 76, 60)
+OVERLAY_ALPHA = 0.45
+
+
+class PackedMask:
+    """
+    A binary mask stored as deflated np.packbits output
+
+    Attributes:
+        shape: (height, width) of the mask
+        data: zlib-compressed packed bits, row-major
+    """
+
+    def __init__(self, shape, data):
+        self.shape = tuple(int(size) for size in shape)
+        self.data = bytes(data)
+
+    @classmethod
+    def pack(cls, mask):
+        """Pack a 2D array where non-zero pixels are tumor."""
+        mask = np.asarray(mask)
+        return cls(mask.shape, zlib.compress(np.packbits(mask != 0).tobytes(), 6))
+
+    def unpack(self):
+        """The mask as a (H, W) uint8 array of 0/1."""
+        count = self.shape[0] * self.shape[1]
+        bits = np.frombuffer(zlib.decompress(self.data), dtype=np.uint8)
+        return np.unpackbits(bits, count=count).reshape(self.shape)
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    @property
+    def digest(self):
+        """Short content hash, used to key rendered composites."""
+        return hashlib.sha1(self.data + repr(self.shape).encode('ascii')).hexdigest()[:16]
+
+    def __repr__(self):
+        return f"PackedMask(shape={self.shape}, nbytes={self.nbytes})"
+
+
+class CompactResult:
+    """
+    Analysis result without any image pixels
+
+    Attributes:
+        image_hash: Content hash of the uploaded scan (storage_utility.content_hash)
+        mask: PackedMask of the post-processed tumor mask
+        tumor_present, accuracy, confidence, max_probability,
+        mean_probability, std_probability, tumor_pixels: As on AnalysisResult
+    """
+
+    FIELDS = AnalysisResult.FIELDS
+
+    def __init__(self, image_hash, mask, **values):
+        self.image_hash = image_hash
+        self.mask = mask
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_analysis(cls, result, image_hash):
+        """Drop the composite of an AnalysisResult, keeping its mask and scores."""
+        return cls(image_hash, PackedMask.pack(result.mask), **result.to_dict())
+
+    def to_dict(self):
+        """Scalar fields as JSON-serializable values."""
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @property
+    def nbytes(self):
+        return self.mask.nbytes
+
+    def __repr__(self):
+        return (f"CompactResult(image_hash={self.image_hash[:12]}, mask={self.mask!r}, "
+                f"tumor_present={self.tumor_present})")
+
+
+def composite_image(image, mask, layout='side-by-side'):
+    """
+    Combine the original scan and its mask into one display image
+
+    The scan is resized to the mask's resolution with the same sampling as
+    the model input, so the left half matches what analyze_prediction used.
+
+    Args:
+        image: PIL Image of the original upload
+        mask: (H, W) array, non-zero where tumor
+        layout: 'side-by-side' (scan | white mask) or 'overlay' (tinted scan)
+
+    Returns:
+        composite: uint8 array, (H, 2W, 3) side by side or (H, W, 3) overlay
+    """
+    if layout not in COMPOSITE_LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}")
+    mask = np.asarray(mask) != 0
+    display, _ = prepare_image(image, target_size=mask.shape)
+
+    if layout == 'side-by-side':
+        mask_rgb = np.repeat(mask[..., np.newaxis], 3, axis=-1).view(np.uint8) * np.uint8(255)
+        return np.concatenate([display, mask_rgb], axis=1)
+
+    composite = np.array(display, dtype=np.uint8)
+    tinted = composite[mask].astype(np.float32)
+    tinted += OVERLAY_ALPHA * (np.asarray(OVERLAY_COLOR, dtype=np.float32) - tinted)
+    composite[mask] = (tinted + 0.5).astype(np.uint8)
+    return composite
+
+
+def encode_composite(composite, image_format='PNG'):
+    """
+    Encode a composite for display or download
+
+    Args:
+        composite: uint8 RGB array
+        image_format: 'PNG' or 'WEBP' (lossless)
+
+    Returns:
+        image_bytes: Encoded image
+    """
+    image_format = image_format.upper()
+    if image_format not in COMPOSITE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+    # Grayscale scans give identical channels; one channel encodes to about a third of the size
+    if np.array_equal(composite[..., 0], composite[..., 1]) and np.array_equal(composite[..., 1], composite[..., 2]):
+        composite = composite[..., 0]
+    byte_io = BytesIO()
+    if image_format == 'WEBP':
+        Image.fromarray(composite).save(byte_io, format='WEBP', lossless=True, method=0)
+    else:
+        Image.fromarray(composite).save(byte_io, format='PNG', compress_level=6)
+    return byte_io.getvalue()
+
+
+def render_result(image, result, layout='side-by-side', image_format='PNG'):
+    """
+    Build and encode the composite of a CompactResult
+
+    Args:
+        image: PIL Image of the original upload (the one hashed into result.image_hash)
+        result: CompactResult
+        layout: See composite_image
+        image_format: See encode_composite
+
+    Returns:
+        image_bytes: Encoded composite
+    """
+    return encode_composite(composite_image(image, result.mask.unpack(), layout=layout), image_format)
@@ -1,63 +1,269 @@
 import streamlit as st
+import time
+from contextlib import closing
 from io import BytesIO
 from PIL import Image
+import numpy as np
 import pymongo
+from bson import ObjectId
+from datetime import datetime
+from db_utility import get_scans_collection
+from metrics_utility import MONGO_ERRORS, MONGO_SECONDS
+from profiling_utility import profiled
+from storage_utility import get_blob_store
 
+# Document fields holding encoded image data rather than metadata
+BINARY_FIELDS = ('image', 'thumbnail', 'analysis')
 
-def image_ret(email):
+
+class StoredImage:
     """
-    Retrieve images from MongoDB for a specific user email
+    A stored scan whose image is decoded only when first accessed
+    
+    Attributes:
+        document_id: String form of the MongoDB document ID
+        format: Stored image format
+        upload_date: Upload timestamp (falls back to the ObjectId time)
+        analysis: Stored model outputs (tumor_present, confidence, accuracy),
+                  or None if the scan was uploaded without them
+        metadata: Remaining document fields, without binary payloads
+    """
+
+    def __init__(self, doc):
+        self._image_bytes = doc.get('image')
+        self._blob_ref = doc.get('blob')
+        self._image = None
+        self._thumbnail_bytes = doc.get('thumbnail')
+        self._thumbnail = None
+        self.document_id = str(doc['_id'])
+        self.format = doc.get('format', 'Unknown')
+        self.upload_date = doc.get('upload_date') or getattr(doc['_id'], 'generation_time', None)
+        
+        analysis = doc.get('analysis')
+        self._mask_bytes = analysis.get('mask') if analysis else None
+        self.analysis = {key: value for key, value in analysis.items() if key != 'mask'} if analysis else None
+        self.metadata = {key: value for key, value in doc.items() if key not in BINARY_FIELDS}
+
+    @property
+    def has_image(self):
+        return self._image_bytes is not None or self._blob_ref is not None
+
+    def open_image_stream(self):
+        """
+        Open a binary stream over the original image bytes
+        
+        Blob-backed images are read lazily (GridFS chunk by chunk, or
+        straight from disk) rather than loaded as one buffer. The caller
+        must close the stream.
+        
+        Returns:
+            stream: Binary file object, or None if the image was not fetched
+        """
+        if self._blob_ref is not None:
+            return get_blob_store(self._blob_ref['backend']).open(self._blob_ref)
+        if self._image_bytes is not None:
+            return BytesIO(self._image_bytes)
+        return None
+
+    @property
+    def image(self):
+        """Decode the image on first access (None if it was not fetched)."""
+        if self._image is None and self._blob_ref is not None:
+            # Decode fully so the file handle or GridFS stream is closed right away
+            with closing(self.open_image_stream()) as stream:
+                image = Image.open(stream)
+                image.load()
+            self._image = image
+        elif self._image is None and self._image_bytes is not None:
+            # Inline bytes hold no handle open: PIL only decodes the pixels when they are used
+            self._image = Image.open(BytesIO(self._image_bytes))
+        return self._image
+
+    @property
+    def thumbnail(self):
+        """Decode the stored thumbnail on first access (None if absent)."""
+        if self._thumbnail is None and self._thumbnail_bytes is not None:
+            self._thumbnail = Image.open(BytesIO(self._thumbnail_bytes))
+        return self._thumbnail
+
+    @property
+    def mask(self):
+        """Decode the stored segmentation mask as a uint8 0/1 array (None if absent)."""
+        if self._mask_bytes is None:
+            return None
+        return np.array(Image.open(BytesIO(self._mask_bytes)), dtype=np.uint8)
+
+
+def _projection(include_image, include_thumbnail=True):
+    """Build a find() projection that leaves out unneeded binary fields."""
+    excluded = {}
+    if not include_image:
+        excluded['image'] = 0
+    if not include_thumbnail:
+        excluded['thumbnail'] = 0
+    return excluded or None
+
+
+def _page_token(item):
+    """Encode the (upload_date, _id) position of a page's last scan."""
+    return f"{item.upload_date.isoformat()}|{item.document_id}"
+
+
+def _page_query(email, page_token):
+    """Build the find() filter for the page that follows page_token."""
+    if not page_token:
+        return {'user': email}
+    upload_date, document_id = page_token.rsplit('|', 1)
+    upload_date = datetime.fromisoformat(upload_date)
+    return {'user': email, '$or': [
+        {'upload_date': {'$lt': upload_date}},
+        {'upload_date': upload_date, '_id': {'$lt': ObjectId(document_id)}}
+    ]}
+
+
+def iter_user_images(email, skip=0, limit=0, include_image=True, batch_size=20):
+    """
+    Stream stored scans for a user without materializing the collection
     
     Args:
         email: User email to retrieve images for
+        skip: Number of documents to skip (oldest first)
+        limit: Maximum number of documents to yield (0 for no limit)
+        include_image: Fetch the image bytes; False projects them out so
+                       only metadata travels over the wire
+        batch_size: Documents fetched per round-trip to the server
+        
+    Yields:
+        item: StoredImage with lazily decoded image
+    """
+    # Timed until the caller finishes (or abandons) the iteration
+    start = time.perf_counter()
+    try:
+        collection = get_scans_collection()
+        
+        cursor = (collection.find({'user': email}, _projection(include_image))
+                  .sort([('upload_date', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])
+                  .skip(skip)
+                  .limit(limit)
+                  .batch_size(batch_size))
+        
+        for doc in cursor:
+            yield StoredImage(doc)
+            
+    except pymongo.errors.ConnectionFailure:
+        MONGO_ERRORS.inc(operation='iterate')
+        st.error("❌ Could not connect to MongoDB. Please ensure MongoDB is running.")
+    except Exception as e:
+        MONGO_ERRORS.inc(operation='iterate')
+        st.error(f"❌ Database error: {str(e)}")
+    finally:
+        MONGO_SECONDS.observe(time.perf_counter() - start, operation='iterate')
+
+
+@profiled()
+@MONGO_SECONDS.timed(operation='page')
+def get_image_page(email, page_size=12, page_token=None, include_image=True, include_thumbnail=True):
+    """
+    Fetch one page of a user's scans, newest first
+    
+    Pagination uses the upload date and ID of the previous page's last scan
+    as a cursor token, so each page is a range query read in order from the
+    (user, upload_date, _id) index rather than a growing skip.
+    
+    Args:
+        email: User email to retrieve images for
+        page_size: Number of scans per page
+        page_token: next_page_token from the previous page, or None for the first page
+        include_image: Fetch the image bytes (decoded lazily on access)
+        include_thumbnail: Fetch the stored thumbnail
         
     Returns:
-        images: List of PIL Image objects
+        items: List of StoredImage objects for this page
+        next_page_token: Token for the following page, or None on the last page
     """
-    images = []
-    client = None
+    items = []
     
     try:
-        # Connect to MongoDB
-        client = pymongo.MongoClient('mongodb://localhost:27017/')
-        db = client['Brain']
-        collection = db[email]
-        
-        # Find all documents for this user
-        documents = collection.find()
-        
-        for doc in documents:
-            try:
-                # Extract image bytes from document
-                image_bytes = doc['image']
-                
-                # Convert bytes to PIL Image
-                image = Image.open(BytesIO(image_bytes))
-                images.append(image)
-                
-            except KeyError:
-                st.warning(f"Document missing 'image' field: {doc.get('_id', 'unknown')}")
-                continue
-            except Exception as img_error:
-                st.error(f"Error processing image: {str(img_error)}")
-                continue
-                
+        collection = get_scans_collection()
+        
+        query = _page_query(email, page_token)
+        projection = _projection(include_image, include_thumbnail)
+        
+        # Fetch one extra document to know whether another page exists
+        cursor = (collection.find(query, projection)
+                  .sort([('upload_date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+                  .limit(page_size + 1))
+        items = [StoredImage(doc) for doc in cursor]
+        
     except pymongo.errors.ConnectionFailure:
+        MONGO_ERRORS.inc(operation='page')
         st.error("❌ Could not connect to MongoDB. Please ensure MongoDB is running.")
     except Exception as e:
+        MONGO_ERRORS.inc(operation='page')
         st.error(f"❌ Database error: {str(e)}")
-    finally:
-        # Always close the connection
-        if client:
-            client.close()
+    
+    if len(items) > page_size:
+        items = items[:page_size]
+        return items, _page_token(items[-1])
+    return items, None
+
+
+def get_history_page(email, page_size=24, page_token=None):
+    """
+    List a user's history cheaply: thumbnails and stored results only
+    
+    The full-resolution image is never sent over the wire; use
+    get_image_page or iter_user_images when the original is needed.
+    
+    Args:
+        email: User email to list history for
+        page_size: Number of scans per page
+        page_token: next_page_token from the previous page, or None
+        
+    Returns:
+        items: List of StoredImage objects (thumbnail, analysis, metadata)
+        next_page_token: Token for the following page, or None on the last page
+    """
+    return get_image_page(email, page_size=page_size, page_token=page_token, include_image=False)
+
+
+@profiled()
+def image_ret(email):
+    """
+    Retrieve images from MongoDB for a specific user email
+    
+    Materializes every image; prefer iter_user_images or get_image_page
+    for large histories.
+    
+    Args:
+        email: User email to retrieve images for
+        
+    Returns:
+        images: List of PIL Image objects
+    """
+    images = []
+    
+    for item in iter_user_images(email):
+        try:
+            if not item.has_image:
+                st.warning(f"Document missing 'image' field: {item.document_id}")
+                continue
+            images.append(item.image)
+        except Exception as img_error:
+            st.error(f"Error processing image: {str(img_error)}")
+            continue
     
     return images
 
 
+@profiled()
 def image_ret_with_metadata(email):
     """
     Retrieve images with metadata from MongoDB for a specific user email
     
+    Materializes every image; prefer iter_user_images or get_image_page
+    for large histories.
+    
     Args:
         email: User email to retrieve images for
         
@@ -65,56 +271,32 @@ def image_ret_with_metadata(email):
         results: List of dictionaries containing image and metadata
     """
     results = []
-    client = None
     
-    try:
-        # Connect to MongoDB
-        client = pymongo.MongoClient('mongodb://localhost:27017/')
-        db = client['Brain']
-        collection = db[email]
-        
-        # Find all documents for this user
-        documents = collection.find()
-        
-        for doc in documents:
-            try:
-                # Extract image bytes and metadata
-                image_bytes = doc['image']
-                image_format = doc.get('format', 'Unknown')
-                upload_date = doc.get('_id').generation_time if hasattr(doc.get('_id'), 'generation_time') else None
-                
-                # Convert bytes to PIL Image
-                image = Image.open(BytesIO(image_bytes))
-                
-                # Create result object
-                result = {
-                    'image': image,
-                    'format': image_format,
-                    'upload_date': upload_date,
-                    'document_id': str(doc['_id'])
-                }
-                
-                results.append(result)
-                
-            except KeyError as key_error:
-                st.warning(f"Document missing required field: {str(key_error)}")
+    for item in iter_user_images(email):
+        try:
+            if not item.has_image:
+                st.warning("Document missing required field: 'image'")
                 continue
-            except Exception as img_error:
-                st.error(f"Error processing image: {str(img_error)}")
-                continue
-                
-    except pymongo.errors.ConnectionFailure:
-        st.error("❌ Could not connect to MongoDB. Please ensure MongoDB is running.")
-    except Exception as e:
-        st.error(f"❌ Database error: {str(e)}")
-    finally:
-        # Always close the connection
-        if client:
-            client.close()
+            
+            # Create result object
+            result = {
+                'image': item.image,
+                'format': item.format,
+                'upload_date': getattr(item.metadata['_id'], 'generation_time', None),
+                'document_id': item.document_id
+            }
+            
+            results.append(result)
+            
+        except Exception as img_error:
+            st.error(f"Error processing image: {str(img_error)}")
+            continue
     
     return results
 
 
+@profiled()
+@MONGO_SECONDS.timed(operation='count')
 def get_user_image_count(email):
     """
     Get the count of images for a specific user
@@ -125,25 +307,19 @@ def get_user_image_count(email):
     Returns:
         count: Number of images for the user
     """
-    client = None
     count = 0
     
     try:
-        # Connect to MongoDB
-        client = pymongo.MongoClient('mongodb://localhost:27017/')
-        db = client['Brain']
-        collection = db[email]
+        collection = get_scans_collection()
         
-        # Count documents
-        count = collection.count_documents({})
+        # Count this user's documents (covered by the (user, upload_date, _id) index)
+        count = collection.count_documents({'user': email})
         
     except pymongo.errors.ConnectionFailure:
+        MONGO_ERRORS.inc(operation='count')
         st.error("❌ Could not connect to MongoDB. Please ensure MongoDB is running.")
     except Exception as e:
+        MONGO_ERRORS.inc(operation='count')
         st.error(f"❌ Database error: {str(e)}")
-    finally:
-        # Always close the connection
-        if client:
-            client.close()
     
     return count
\ No newline at end of file
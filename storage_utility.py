@@ -0,0 +1,202 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+import gridfs
+
+from db_utility import get_database
+
+# Supported values for the STORAGE_BACKEND environment variable
+INLINE_BACKEND = 'inline'
+GRIDFS_BACKEND = 'gridfs'
+FILESYSTEM_BACKEND = 'filesystem'
+
+DEFAULT_STORAGE_ROOT = 'blob_store'
+GRIDFS_BUCKET = 'scans'
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_storage_backend():
+    """
+    Get the configured storage backend name
+
+    STORAGE_BACKEND selects where uploaded image bytes live:
+
+        inline      bson.Binary inside the MongoDB document (default, 16MB limit)
+        gridfs      chunked GridFS storage in the Brain database
+        filesystem  local content-addressed store under STORAGE_ROOT
+
+    Returns:
+        backend: One of 'inline', 'gridfs' or 'filesystem'
+    """
+    backend = os.getenv('STORAGE_BACKEND', INLINE_BACKEND).strip().lower()
+    if backend not in (INLINE_BACKEND, GRIDFS_BACKEND, FILESYSTEM_BACKEND):
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return backend
+
+
+def as_stream(source):
+    """
+    Wrap raw bytes in a stream and rewind file objects
+
+    Args:
+        source: bytes, bytearray or a binary file object
+
+    Returns:
+        stream: Binary file object positioned at the start
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BytesIO(source)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source
+
+
+def content_hash(source):
+    """
+    Compute the SHA-256 of raw upload bytes
+
+    Args:
+        source: bytes or a seekable binary file object (rewound afterwards)
+
+    Returns:
+        digest: Hex SHA-256 of the content
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+
+    stream = as_stream(source)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class GridFSBlobStore:
+    """Store blobs as GridFS chunks; reads stream chunk by chunk."""
+
+    backend = GRIDFS_BACKEND
+
+    def __init__(self, db=None, bucket_name=GRIDFS_BUCKET):
+        self.bucket = gridfs.GridFSBucket(db if db is not None else get_database(), bucket_name=bucket_name)
+
+    def put(self, source, filename='scan', content_type=None):
+        """
+        Stream bytes into GridFS without buffering the whole blob
+
+        Args:
+            source: bytes or binary file object
+            filename: Name recorded on the GridFS file
+            content_type: Optional MIME type recorded in the metadata
+
+        Returns:
+            ref: Dictionary reference to store in the scan document
+        """
+        stream = as_stream(source)
+        digest = hashlib.sha256()
+        with self.bucket.open_upload_stream(filename, metadata={'content_type': content_type}) as grid_in:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                grid_in.write(chunk)
+        return {
+            'backend': self.backend,
+            'id': grid_in._id,
+            'size': grid_in.length,
+            'sha256': digest.hexdigest()
+        }
+
+    def open(self, ref):
+        """Open a lazily read, seekable stream over the stored chunks."""
+        return self.bucket.open_download_stream(ref['id'])
+
+    def delete(self, ref):
+        self.bucket.delete(ref['id'])
+
+
+class FileSystemBlobStore:
+    """
+    Content-addressed local blob store
+
+    Blobs are written to <root>/<sha256[:2]>/<sha256[2:4]>/<sha256>, so
+    identical uploads share one file.
+    """
+
+    backend = FILESYSTEM_BACKEND
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv('STORAGE_ROOT', DEFAULT_STORAGE_ROOT)
+
+    def _path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put(self, source, filename='scan', content_type=None):
+        """
+        Stream bytes to a temporary file while hashing, then move into place
+
+        Args:
+            source: bytes or binary file object
+            filename: Unused; kept for interface parity with GridFS
+            content_type: Unused; kept for interface parity with GridFS
+
+        Returns:
+            ref: Dictionary reference to store in the scan document
+        """
+        stream = as_stream(source)
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as temp_file:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        path = self._path(sha256)
+        if os.path.exists(path):
+            # Same content is already stored
+            os.remove(temp_file.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.move(temp_file.name, path)
+
+        return {'backend': self.backend, 'key': sha256, 'size': size, 'sha256': sha256}
+
+    def open(self, ref):
+        """Open the stored file; reads come straight from disk."""
+        return open(self._path(ref['key']), 'rb')
+
+    def delete(self, ref):
+        """
+        Remove the stored file
+
+        Content-addressed blobs may be shared by several documents; callers
+        must only delete once no document references the key (see
+        upload_utility.delete_blob).
+        """
+        try:
+            os.remove(self._path(ref['key']))
+        except FileNotFoundError:
+            pass
+
+
+def get_blob_store(backend=None):
+    """
+    Get a blob store instance
+
+    Args:
+        backend: 'gridfs' or 'filesystem'; None uses STORAGE_BACKEND
+
+    Returns:
+        store: Blob store, or None for the inline backend
+    """
+    backend = backend or get_storage_backend()
+    if backend == GRIDFS_BACKEND:
+        return GridFSBlobStore()
+    if backend == FILESYSTEM_BACKEND:
+        return FileSystemBlobStore()
+    return None
@@ -0,0 +1,361 @@
+"""
+Study-level (multi-slice) analysis
+
+A study is a stack of slices: a zip of PNG/JPG slices, a NumPy volume
+(.npy / .npz) or a NIfTI volume (.nii / .nii.gz, requires nibabel).
+analyze_study streams the slices through decode, preprocess and batched
+inference on bounded queues, so at most a few batches of float32 model
+inputs exist at once, then filters connected components in 3D and reports
+the tumor volume.
+"""
+import logging
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from model_utility import prepare_image, skimage_available
+
+logger = logging.getLogger(__name__)
+
+SLICE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+STUDY_EXTENSIONS = ('.zip', '.npy', '.npz', '.nii', '.nii.gz')
+
+# Marks the end of a stage's output
+_END = object()
+
+
+class _Failure:
+    """Carries an exception from a pipeline thread to the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _natural_key(name):
+    """Sort slice_2.png before slice_10.png."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def is_study_file(name):
+    """Check whether a file name looks like a multi-slice study."""
+    return name.lower().endswith(STUDY_EXTENSIONS)
+
+
+class Study:
+    """
+    A lazily read stack of slices
+
+    Attributes:
+        num_slices: Number of slices along the stacking axis
+        spacing: Voxel spacing (slice, row, column) in millimetres
+        name: Source name, for logs and reports
+    """
+
+    def __init__(self, num_slices, spacing, read_slice, name='study', cleanup=None):
+        self.num_slices = num_slices
+        self.spacing = tuple(float(value) for value in spacing)
+        self.name = name
+        self._read_slice = read_slice
+        self._cleanup = cleanup
+
+    def iter_slices(self):
+        """Yield (index, PIL Image) for every slice, reading one at a time."""
+        for index in range(self.num_slices):
+            yield index, self._read_slice(index)
+
+    def close(self):
+        if self._cleanup:
+            self._cleanup()
+            self._cleanup = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _volume_to_image(pixels, low, high):
+    """Window one volume slice into an 8-bit RGB image."""
+    scale = 255.0 / (high - low) if high > low else 0.0
+    pixels = ((np.asarray(pixels, dtype=np.float32) - low) * scale).clip(0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).convert('RGB')
+
+
+def _intensity_range(num_slices, read_pixels):
+    """Min and max intensity of a volume, computed one slice at a time."""
+    low, high = np.inf, -np.inf
+    for index in range(num_slices):
+        pixels = read_pixels(index)
+        low, high = min(low, float(np.min(pixels))), max(high, float(np.max(pixels)))
+    return low, high
+
+
+def _open_zip(source, name, spacing):
+    archive = zipfile.ZipFile(source)
+    members = sorted((member for member in archive.namelist()
+                      if member.lower().endswith(SLICE_EXTENSIONS) and not os.path.basename(member).startswith('.')),
+                     key=_natural_key)
+    if not members:
+        archive.close()
+        raise ValueError(f"No PNG/JPG slices found in {name}")
+    # zipfile is not safe for concurrent reads; only the decode thread reads
+    lock = threading.Lock()
+
+    def read_slice(index):
+        with lock, archive.open(members[index]) as f:
+            image = Image.open(f)
+            image.load()
+        return image.convert('RGB')
+
+    return Study(len(members), spacing or (1.0, 1.0, 1.0), read_slice, name=name, cleanup=archive.close)
+
+
+def _open_numpy(source, name, spacing):
+    if name.lower().endswith('.npz'):
+        with np.load(source) as archive:
+            volume = archive[archive.files[0]]
+    else:
+        # Memory-map files on disk so slices are paged in as they are read
+        volume = np.load(source, mmap_mode='r' if isinstance(source, str) else None)
+    if volume.ndim == 4 and volume.shape[-1] in (1, 3):
+        volume = volume[..., 0]
+    if volume.ndim != 3:
+        raise ValueError(f"Expected a (slices, height, width) volume in {name}, got shape {volume.shape}")
+    low, high = _intensity_range(volume.shape[0], lambda index: volume[index])
+    return Study(volume.shape[0], spacing or (1.0, 1.0, 1.0),
+                 lambda index: _volume_to_image(volume[index], low, high), name=name)
+
+
+def _open_nifti(source, name, spacing):
+    try:
+        import nibabel
+    except ImportError:
+        raise ImportError("Reading NIfTI studies requires nibabel (pip install nibabel)")
+
+    cleanup = None
+    if not isinstance(source, str):
+        # nibabel reads from paths; spool uploads to a temporary file
+        suffix = '.nii.gz' if name.lower().endswith('.gz') else '.nii'
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            shutil.copyfileobj(source, f)
+        source = f.name
+        cleanup = lambda: os.remove(f.name)
+
+    nifti = nibabel.load(source)
+    if len(nifti.shape) < 3:
+        raise ValueError(f"Expected a 3D volume in {name}, got shape {nifti.shape}")
+    # NIfTI is (x, y, z); slices are along z and read lazily from the proxy
+    proxy = nifti.dataobj
+
+    def read_pixels(index):
+        pixels = proxy[..., index] if len(nifti.shape) == 3 else proxy[..., index, 0]
+        return np.rot90(np.asarray(pixels))
+
+    zooms = nifti.header.get_zooms()
+    low, high = _intensity_range(nifti.shape[2], read_pixels)
+    return Study(nifti.shape[2], spacing or (zooms[2], zooms[1], zooms[0]),
+                 lambda index: _volume_to_image(read_pixels(index), low, high), name=name, cleanup=cleanup)
+
+
+# Function to open a study from a path or an uploaded file
+def open_study(source, name=None, spacing=None):
+    """
+    Open a multi-slice study without reading all slices
+
+    Args:
+        source: Path or binary file-like object (e.g. a Streamlit upload)
+        name: File name used to detect the format; defaults to the path
+        spacing: Optional (slice, row, column) voxel spacing in millimetres;
+                 NIfTI headers provide it, other formats default to 1mm
+
+    Returns:
+        study: Study object
+
+    Raises:
+        ValueError: If the format is unsupported or the study is empty
+    """
+    name = name or getattr(source, 'name', None) or str(source)
+    lower = name.lower()
+    if lower.endswith('.zip'):
+        return _open_zip(source, name, spacing)
+    if lower.endswith(('.npy', '.npz')):
+        return _open_numpy(source, name, spacing)
+    if lower.endswith(('.nii', '.nii.gz')):
+        return _open_nifti(source, name, spacing)
+    raise ValueError(f"Unsupported study format: {name} (expected one of {', '.join(STUDY_EXTENSIONS)})")
+
+
+def _put(output, item, stop):
+    """Block on a full queue until there is room or the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _producer(target, output, stop, *args):
+    """Run one pipeline stage on a thread, forwarding failures downstream."""
+    try:
+        target(output, stop, *args)
+        _put(output, _END, stop)
+    except Exception as e:
+        _put(output, _Failure(e), stop)
+
+
+def _decode_stage(output, stop, study):
+    for index, image in study.iter_slices():
+        if not _put(output, (index, image.size, image), stop):
+            return
+
+
+def _preprocess_stage(output, stop, decoded, target_size):
+    while not stop.is_set():
+        item = decoded.get()
+        if isinstance(item, _Failure):
+            raise item.error
+        if item is _END:
+            return
+        index, size, image = item
+        # Slices are only fed to the model: skip prepare_image's display image
+        model_input = prepare_image(image, target_size=target_size, with_display=False)[1]
+        if not _put(output, (index, size, model_input), stop):
+            return
+
+
+def filter_components_3d(mask, min_size=200):
+    """
+    Remove 26-connected components smaller than min_size voxels in place
+
+    Uses scipy.ndimage (a scikit-image dependency) with int32 labels, which
+    needs a quarter of the memory of skimage's int64 labelling on a volume.
+
+    Returns:
+        mask, components: The filtered mask and the number of kept components
+    """
+    if not skimage_available() or not mask.any():
+        return mask, 0
+    from scipy import ndimage
+    labeled_mask = np.empty(mask.shape, dtype=np.int32)
+    count = ndimage.label(mask, structure=np.ones((3, 3, 3)), output=labeled_mask)
+    # bincount casts to int64, so count a few slices at a time
+    sizes = np.zeros(count + 1, dtype=np.int64)
+    for start in range(0, mask.shape[0], 16):
+        sizes += np.bincount(labeled_mask[start:start + 16].ravel(), minlength=count + 1)
+    small_labels = sizes < min_size
+    small_labels[0] = False
+    mask[small_labels[labeled_mask]] = 0
+    return mask, int(np.count_nonzero(~small_labels[1:]))
+
+
+# Function to analyze a whole study slice by slice
+def analyze_study(study, model, threshold=0.5, min_size=200, batch_size=8, queue_size=16,
+                  target_size=(256, 256), on_progress=None):
+    """
+    Segment every slice of a study and measure the tumor in 3D
+
+    Decode and preprocessing run on their own threads, connected to the
+    batched inference loop by queues of at most queue_size slices, so only
+    a bounded number of float32 slices are in memory at any time. Per-slice
+    masks are thresholded into a uint8 (slices, H, W) volume and small
+    objects are removed with 26-connected components in 3D, so a tumor
+    that is small in one slice but continuous across slices is kept.
+
+    Args:
+        study: Study from open_study
+        model: Loaded segmentation model
+        threshold: Probability threshold for the mask
+        min_size: Minimum 3D component size kept, in voxels
+        batch_size: Slices per model forward pass
+        queue_size: Capacity of each inter-stage queue
+        target_size: Model input size
+        on_progress: Optional callback(done, total) after each batch
+
+    Returns:
+        result: Dictionary with 'mask' ((slices, H, W) uint8), 'tumor_present',
+                'tumor_voxels', 'tumor_volume_ml', 'components',
+                'tumor_slices' (indices with tumor), 'slice_area_voxels',
+                'voxel_volume_mm3' and 'num_slices'
+    """
+    mask = np.zeros((study.num_slices,) + tuple(target_size), dtype=np.uint8)
+    slice_sizes = [None] * study.num_slices
+    decoded = queue.Queue(maxsize=queue_size)
+    preprocessed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    threads = [
+        threading.Thread(target=_producer, args=(_decode_stage, decoded, stop, study),
+                         name='study-decode', daemon=True),
+        threading.Thread(target=_producer, args=(_preprocess_stage, preprocessed, stop, decoded, target_size),
+                         name='study-preprocess', daemon=True)
+    ]
+    for thread in threads:
+        thread.start()
+
+    def run_batch(batch):
+        inputs = np.concatenate([model_input for _, _, model_input in batch], axis=0)
+        predictions = model.predict(inputs, batch_size=len(batch), verbose=0)
+        for (index, size, _), prediction in zip(batch, predictions):
+            mask[index] = prediction[..., 0] > threshold
+            slice_sizes[index] = size
+
+    done = 0
+    batch = []
+    try:
+        while True:
+            item = preprocessed.get()
+            if isinstance(item, _Failure):
+                raise item.error
+            if item is _END:
+                break
+            batch.append(item)
+            if len(batch) == batch_size:
+                run_batch(batch)
+                done += len(batch)
+                batch = []
+                if on_progress:
+                    on_progress(done, study.num_slices)
+        if batch:
+            run_batch(batch)
+            done += len(batch)
+            if on_progress:
+                on_progress(done, study.num_slices)
+    finally:
+        # Release the producers if inference failed part-way
+        stop.set()
+        while not decoded.empty():
+            decoded.get_nowait()
+        decoded.put(_END)
+
+    mask, components = filter_components_3d(mask, min_size=min_size)
+
+    # Slices are resized to the model input, so scale in-plane spacing accordingly
+    slice_spacing, row_spacing, column_spacing = study.spacing
+    width, height = slice_sizes[0] if slice_sizes and slice_sizes[0] else target_size[::-1]
+    voxel_volume = slice_spacing * row_spacing * (height / target_size[0]) * column_spacing * (width / target_size[1])
+
+    slice_area = mask.reshape(mask.shape[0], -1).sum(axis=1)
+    tumor_voxels = int(slice_area.sum())
+    logger.info("study %s: %d slices, %d tumor voxels in %d components",
+                study.name, study.num_slices, tumor_voxels, components)
+    return {
+        'mask': mask,
+        'num_slices': study.num_slices,
+        'tumor_present': tumor_voxels > 0,
+        'tumor_voxels': tumor_voxels,
+        'tumor_volume_ml': tumor_voxels * voxel_volume / 1000.0,
+        'voxel_volume_mm3': voxel_volume,
+        'components': components,
+        'tumor_slices': [int(index) for index in np.flatnonzero(slice_area)],
+        'slice_area_voxels': slice_area
+    }
@@ -0,0 +1,178 @@
+"""
+Autotune TensorFlow CPU threading and the inference batch size
+
+TensorFlow fixes its thread pools when it starts, so every combination of
+intra-op threads, inter-op threads and oneDNN on/off runs in a fresh
+subprocess. Each trial loads the real model, warms it up and times
+model.predict on the bundled sample scans at every batch size. The fastest
+combination (in images/s) is written to TF_THREAD_CONFIG (default:
+tf_thread_config.json), which get_thread_config() and so load_model pick up
+in every later process. Environment variables still override the file.
+
+Run it on the machine (or in the container, with the same CPU limit) that
+serves the model; a file tuned for a different CPU count is ignored.
+
+Usage:
+    python tune_threads.py
+    python tune_threads.py --threads 1 2 4 --inter-op 1 2 --batch-sizes 1 4 8 --onednn 1
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from model_utility import (DEFAULT_THREAD_CONFIG_PATH, available_cpus, get_model_version, load_model,
+                           prepare_image, resolve_model_path, warm_up)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_IMAGES = ['image1.jpg', 'image2.jpg', 'image3.jpg', 'image4.jpg']
+
+
+def thread_candidates(cpus):
+    """Return 1, 2, 4, ... up to cpus, always including cpus itself."""
+    candidates = []
+    threads = 1
+    while threads < cpus:
+        candidates.append(threads)
+        threads *= 2
+    return candidates + [cpus]
+
+
+def sample_batch(model, count):
+    """Preprocess the bundled sample scans, cycled up to count images."""
+    height, width = model.input_shape[1] or 256, model.input_shape[2] or 256
+    channels = model.input_shape[-1] or 3
+    samples = [prepare_image(Image.open(os.path.join(ROOT, name)), target_size=(height, width), channels=channels)[1]
+               for name in SAMPLE_IMAGES]
+    return np.concatenate([samples[i % len(samples)] for i in range(count)])
+
+
+def run_trial(model_path, batch_sizes, images, repeats):
+    """
+    Time the model at each batch size under the current environment's thread settings
+
+    Args:
+        model_path: Model path, or None to resolve it from MODEL_PATH
+        batch_sizes: Batch sizes to time
+        images: Images per timed pass
+        repeats: Timed passes per batch size; the fastest counts
+
+    Returns:
+        results: Dictionary of batch size to images/s
+    """
+    model = load_model(model_path)
+    warm_up(model)
+    results = {}
+    for batch_size in batch_sizes:
+        inputs = sample_batch(model, max(images, batch_size))
+        # Trace the graph for this batch shape before timing
+        model.predict(inputs[:batch_size], batch_size=batch_size, verbose=0)
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for offset in range(0, len(inputs), batch_size):
+                model.predict(inputs[offset:offset + batch_size], batch_size=batch_size, verbose=0)
+            best = min(best, time.perf_counter() - start)
+        results[batch_size] = len(inputs) / best
+    return results
+
+
+def spawn_trial(args, intra, inter, onednn):
+    """Run one trial in a subprocess with the given settings and return its results, or None."""
+    env = dict(os.environ,
+               TF_INTRA_OP_THREADS=str(intra),
+               TF_INTER_OP_THREADS=str(inter),
+               TF_ENABLE_ONEDNN_OPTS='1' if onednn else '0')
+    command = [sys.executable, os.path.abspath(__file__), '--trial',
+               '--images', str(args.images), '--repeats', str(args.repeats),
+               '--batch-sizes', *map(str, args.batch_sizes)]
+    if args.model:
+        command += ['--model', args.model]
+    process = subprocess.run(command, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        print(f"❌ intra {intra}, inter {inter}, oneDNN {onednn}: {process.stderr.strip()[-500:]}")
+        return None
+    # The trial prints its results as the last line of stdout
+    results = json.loads(process.stdout.strip().splitlines()[-1])
+    return {int(batch_size): rate for batch_size, rate in results.items()}
+
+
+def write_config(path, config):
+    """Atomically replace the thread config file."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def main(argv=None):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    cpus = available_cpus()
+    parser = argparse.ArgumentParser(description="Autotune TensorFlow CPU threading and the inference batch size")
+    parser.add_argument('--model', default=None, help='Model path (default: MODEL_PATH or model.keras)')
+    parser.add_argument('--threads', type=int, nargs='+', default=thread_candidates(cpus),
+                        help=f'Intra-op thread counts to try (default: powers of two up to {cpus})')
+    parser.add_argument('--inter-op', type=int, nargs='+', default=sorted({1, min(2, cpus)}),
+                        help='Inter-op thread counts to try')
+    parser.add_argument('--onednn', type=int, nargs='+', choices=(0, 1), default=[1, 0],
+                        help='oneDNN settings to try (1 = on, 0 = off)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16], help='Batch sizes to try')
+    parser.add_argument('--images', type=int, default=32, help='Images per timed pass')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed passes per setting; the fastest counts')
+    parser.add_argument('--output', default=os.getenv('TF_THREAD_CONFIG', DEFAULT_THREAD_CONFIG_PATH),
+                        help='Config file to write (default: TF_THREAD_CONFIG or tf_thread_config.json)')
+    parser.add_argument('--trial', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.trial:
+        results = run_trial(args.model, args.batch_sizes, args.images, args.repeats)
+        print(json.dumps(results))
+        return 0
+
+    if not os.path.exists(resolve_model_path(args.model)):
+        print(f"❌ Model file not found at: {resolve_model_path(args.model)}")
+        return 1
+
+    trials = list(itertools.product(args.threads, args.inter_op, args.onednn))
+    print(f"🔄 Tuning on {cpus} CPUs: {len(trials)} thread settings x {len(args.batch_sizes)} batch sizes")
+    print(f"{'intra':>6}{'inter':>6}{'oneDNN':>8}{'batch':>7}{'images/s':>10}")
+    best = None
+    for intra, inter, onednn in trials:
+        results = spawn_trial(args, intra, inter, onednn)
+        for batch_size, rate in sorted((results or {}).items()):
+            print(f"{intra:>6}{inter:>6}{onednn:>8}{batch_size:>7}{rate:>10.1f}")
+            if best is None or rate > best['images_per_second']:
+                best = {'intra_op_threads': intra, 'inter_op_threads': inter, 'onednn': bool(onednn),
+                        'batch_size': batch_size, 'images_per_second': round(rate, 2)}
+
+    if best is None:
+        print("❌ Every trial failed")
+        return 1
+
+    best.update({
+        'cpus': cpus,
+        'model_version': get_model_version(args.model),
+        'backend': os.getenv('INFERENCE_BACKEND', 'keras').strip().lower(),
+        'tuned_at': datetime.now().isoformat(timespec='seconds')
+    })
+    write_config(args.output, best)
+    print(f"✅ Fastest: intra-op {best['intra_op_threads']}, inter-op {best['inter_op_threads']}, "
+          f"oneDNN {'on' if best['onednn'] else 'off'}, batch {best['batch_size']} "
+          f"({best['images_per_second']:.1f} images/s). Written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,24 +2,207 @@ from io import BytesIO
 from PIL import Image
 import pymongo
 import bson
+import numpy as np
 import streamlit as st
 from datetime import datetime
+from db_utility import get_client, get_scans_collection, DATABASE_NAME, SCANS_COLLECTION
+from metrics_utility import MONGO_ERRORS, MONGO_SECONDS
+from profiling_utility import profiled
+from storage_utility import as_stream, content_hash, get_blob_store
 
+# Longest side of the preview stored next to each upload
+THUMBNAIL_SIZE = (128, 128)
+THUMBNAIL_FORMAT = 'JPEG'
 
-def uploading(image, email):
+# Largest image stored inline in its document (MongoDB caps documents at 16MB)
+MAX_INLINE_BYTES = 16 * 1024 * 1024
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE):
+    """
+    Encode a small preview of an image
+    
+    Args:
+        image: PIL Image object
+        size: Maximum (width, height) of the thumbnail
+        
+    Returns:
+        thumbnail_bytes: JPEG-encoded thumbnail
+    """
+    thumbnail = image.convert('RGB') if image.mode not in ('RGB', 'L') else image.copy()
+    thumbnail.thumbnail(size)
+    byte_io = BytesIO()
+    thumbnail.save(byte_io, format=THUMBNAIL_FORMAT, quality=80)
+    return byte_io.getvalue()
+
+
+def encode_mask(mask):
+    """
+    Encode a binary segmentation mask as a 1-bit PNG
+    
+    Args:
+        mask: 2D array where non-zero pixels are tumor
+        
+    Returns:
+        mask_bytes: PNG-encoded mask
+    """
+    byte_io = BytesIO()
+    Image.fromarray(np.asarray(mask) > 0).save(byte_io, format='PNG', optimize=True)
+    return byte_io.getvalue()
+
+
+def delete_blob(ref):
+    """
+    Delete the externally stored bytes behind a document's blob reference
+    
+    Call after the document itself is deleted (or was never inserted).
+    Content-addressed (filesystem) blobs are shared by every document with
+    the same bytes, so they are only removed once no scan references them.
+    
+    Args:
+        ref: The document's 'blob' field, or None for inline images
+    """
+    if not ref:
+        return
+    if 'key' in ref and get_scans_collection().count_documents({'blob.key': ref['key']}, limit=1):
+        return
+    get_blob_store(ref['backend']).delete(ref)
+
+
+def scan_document(image, email, image_hash, analysis=None):
+    """
+    Build the metadata part of a scan document (everything but the image bytes)
+    
+    Args:
+        image: Decoded PIL Image object
+        email: User email the scan is stored under
+        image_hash: Content hash of the original bytes
+        analysis: Optional model outputs, as for uploading
+        
+    Returns:
+        document: Dictionary ready for store_image_bytes and insertion
+    """
+    image_format = image.format if image.format else 'PNG'
+    document = {
+        'user': email,
+        'format': image_format,
+        'upload_date': datetime.now(),
+        'content_hash': image_hash,
+        'image_mode': image.mode,
+        'image_size': image.size,
+        'thumbnail': bson.Binary(make_thumbnail(image)),
+        'thumbnail_format': THUMBNAIL_FORMAT
+    }
+    
+    # Store model outputs next to the image so listings need no re-analysis
+    if analysis is not None:
+        document['analysis'] = {
+            'tumor_present': bool(analysis.get('tumor_present')),
+            'confidence': float(analysis['confidence']) if analysis.get('confidence') is not None else None,
+            'accuracy': float(analysis['accuracy']) if analysis.get('accuracy') is not None else None,
+            'mask': bson.Binary(encode_mask(analysis['mask'])) if analysis.get('mask') is not None else None
+        }
+    return document
+
+
+def store_image_bytes(document, source, store=None):
+    """
+    Put a scan's original bytes inline in its document or in the blob store
+    
+    Args:
+        document: Document from scan_document, updated in place
+        source: Original bytes or binary file object
+        store: Blob store from get_blob_store(), or None for inline storage
+        
+    Raises:
+        ValueError: If an inline image exceeds MAX_INLINE_BYTES
+    """
+    if store is None:
+        image_bytes = as_stream(source).read()
+        
+        # Validate image size (limit to 16MB for MongoDB)
+        if len(image_bytes) > MAX_INLINE_BYTES:
+            raise ValueError("Image too large (max 16MB; use the gridfs or filesystem STORAGE_BACKEND)")
+        
+        # Serialize the image bytes using BSON
+        document['image'] = bson.Binary(image_bytes)
+        document['size_bytes'] = len(image_bytes)
+    else:
+        # Stream the bytes to the blob store and keep only a reference
+        image_format = document['format']
+        document['blob'] = store.put(source, filename=f"{document['user']}.{image_format.lower()}",
+                                     content_type=Image.MIME.get(image_format))
+        document['size_bytes'] = document['blob']['size']
+
+
+@MONGO_SECONDS.timed(operation='find_hashes')
+def find_stored_hashes(email, hashes):
+    """
+    Look up which content hashes a user already has, in one indexed query
+    
+    Args:
+        email: User email
+        hashes: Content hashes to check
+        
+    Returns:
+        stored: Dictionary mapping each stored hash to its document ID
+    """
+    cursor = get_scans_collection().find({'user': email, 'content_hash': {'$in': list(hashes)}},
+                                         {'content_hash': 1})
+    return {doc['content_hash']: doc['_id'] for doc in cursor}
+
+
+@profiled()
+@MONGO_SECONDS.timed(operation='insert_many')
+def insert_scans(documents):
+    """
+    Insert a batch of scan documents with one unordered insert_many
+    
+    Unordered, so a document the server rejects does not stop the rest of
+    the batch. Blob-store bytes of rejected documents are deleted again.
+    
+    Args:
+        documents: Documents built with scan_document and store_image_bytes
+        
+    Returns:
+        errors: One entry per document, None if it was inserted or the
+                server's error message otherwise
+    """
+    errors = [None] * len(documents)
+    try:
+        get_scans_collection().insert_many(documents, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        MONGO_ERRORS.inc(operation='insert_many')
+        for write_error in e.details.get('writeErrors', []):
+            errors[write_error['index']] = write_error.get('errmsg', 'write error')
+            delete_blob(documents[write_error['index']].get('blob'))
+    return errors
+
+
+@profiled()
+@MONGO_SECONDS.timed(operation='upload')
+def uploading(image, email, analysis=None, source=None):
     """
     Upload image to MongoDB with better error handling
     
+    A small thumbnail is stored alongside the full image so that history
+    listings can skip the full-resolution bytes. The image bytes go to the
+    backend selected by STORAGE_BACKEND (see storage_utility): inline in the
+    document, GridFS chunks, or the local content-addressed store.
+    
     Args:
         image: PIL Image object
-        email: User email for collection identification
+        email: User email the scan is stored under
+        analysis: Optional model outputs to store with the image, a dictionary
+                  with 'mask' (2D array), 'tumor_present', 'confidence' and
+                  'accuracy'
+        source: Optional original uploaded bytes or binary file object; when
+                given it is stored as-is instead of re-encoding the image
         
     Returns:
         success: Boolean indicating upload success
         message: Success or error message
     """
-    client = None
-    
     try:
         # Validate inputs
         if not image:
@@ -30,35 +213,40 @@ def uploading(image, email):
         # Get image format
         image_format = image.format if image.format else 'PNG'
 
-        # Convert the PIL Image to bytes
-        byte_io = BytesIO()
-        image.save(byte_io, format=image_format)
-        image_bytes = byte_io.getvalue()
+        # Only re-encode when the original bytes are not available
+        if source is None:
+            byte_io = BytesIO()
+            image.save(byte_io, format=image_format)
+            source = byte_io.getvalue()
 
-        # Validate image size (limit to 16MB for MongoDB)
-        if len(image_bytes) > 16 * 1024 * 1024:  # 16MB limit
-            return False, "❌ Image too large (max 16MB)"
+        # Key the upload by the content hash of its raw bytes
+        image_hash = content_hash(source)
+        collection = get_scans_collection()
+        
+        # Skip storing bytes this user already has
+        existing = collection.find_one({'user': email, 'content_hash': image_hash}, {'_id': 1})
+        if existing is not None:
+            return True, f"ℹ️ Image already stored. ID: {str(existing['_id'])[:8]}..."
 
-        # Serialize the image bytes using BSON
-        serialized_image = bson.Binary(image_bytes)
-
-        # Connect to MongoDB and store the serialized image along with its format
-        client = pymongo.MongoClient('mongodb://localhost:27017/')
-        db = client['Brain']
-        collection = db[email]
-
-        # Create document with metadata
-        document = {
-            'image': serialized_image,
-            'format': image_format,
-            'upload_date': datetime.now(),
-            'size_bytes': len(image_bytes),
-            'image_mode': image.mode,
-            'image_size': image.size
-        }
+        # Create document with metadata, then store the image bytes
+        document = scan_document(image, email, image_hash, analysis)
+        try:
+            store_image_bytes(document, source, get_blob_store())
+        except ValueError as e:
+            return False, f"❌ {str(e)}"
         
-        # Insert the document
-        result = collection.insert_one(document)
+        # Insert the document; the unique (user, content_hash) index rejects
+        # a concurrent upload of the same bytes that got here first
+        try:
+            result = collection.insert_one(document)
+        except pymongo.errors.DuplicateKeyError:
+            delete_blob(document.get('blob'))
+            existing = collection.find_one({'user': email, 'content_hash': image_hash}, {'_id': 1})
+            return True, f"ℹ️ Image already stored. ID: {str(existing['_id'])[:8] if existing else '?'}..."
+        except Exception:
+            # Do not orphan bytes already written to GridFS or the filesystem store
+            delete_blob(document.get('blob'))
+            raise
         
         if result.inserted_id:
             return True, f"✅ Image uploaded successfully! ID: {str(result.inserted_id)[:8]}..."
@@ -66,15 +254,15 @@ def uploading(image, email):
             return False, "❌ Failed to insert image into database"
             
     except pymongo.errors.ConnectionFailure:
+        MONGO_ERRORS.inc(operation='upload')
         return False, "❌ Could not connect to MongoDB. Please ensure MongoDB is running."
     except Exception as e:
+        MONGO_ERRORS.inc(operation='upload')
         return False, f"❌ Upload error: {str(e)}"
-    finally:
-        # Always close the connection
-        if client:
-            client.close()
 
 
+@profiled()
+@MONGO_SECONDS.timed(operation='delete')
 def delete_user_image(email, document_id):
     """
     Delete a specific image for a user
@@ -87,35 +275,33 @@ def delete_user_image(email, document_id):
         success: Boolean indicating deletion success
         message: Success or error message
     """
-    client = None
-    
     try:
-        # Connect to MongoDB
-        client = pymongo.MongoClient('mongodb://localhost:27017/')
-        db = client['Brain']
-        collection = db[email]
+        collection = get_scans_collection()
         
         # Convert string ID to ObjectId
         from bson import ObjectId
         obj_id = ObjectId(document_id)
         
-        # Delete the document
-        result = collection.delete_one({'_id': obj_id})
+        # Delete the document (only if it belongs to this user), then any
+        # externally stored bytes it referenced
+        deleted = collection.find_one_and_delete({'_id': obj_id, 'user': email}, projection={'blob': 1})
         
-        if result.deleted_count > 0:
+        if deleted is not None:
+            delete_blob(deleted.get('blob'))
             return True, "✅ Image deleted successfully"
         else:
             return False, "❌ Image not found"
             
     except pymongo.errors.ConnectionFailure:
+        MONGO_ERRORS.inc(operation='delete')
         return False, "❌ Could not connect to MongoDB"
     except Exception as e:
+        MONGO_ERRORS.inc(operation='delete')
         return False, f"❌ Deletion error: {str(e)}"
-    finally:
-        if client:
-            client.close()
 
 
+@profiled()
+@MONGO_SECONDS.timed(operation='clear')
 def clear_user_images(email):
     """
     Clear all images for a specific user
@@ -127,16 +313,15 @@ def clear_user_images(email):
         success: Boolean indicating success
         message: Success or error message
     """
-    client = None
-    
     try:
-        # Connect to MongoDB
-        client = pymongo.MongoClient('mongodb://localhost:27017/')
-        db = client['Brain']
-        collection = db[email]
+        collection = get_scans_collection()
         
-        # Delete all documents for this user
-        result = collection.delete_many({})
+        # Delete all documents for this user, then the externally stored
+        # bytes they referenced (shared filesystem blobs are reference-checked)
+        refs = [doc['blob'] for doc in collection.find({'user': email, 'blob': {'$exists': True}}, {'blob': 1})]
+        result = collection.delete_many({'user': email})
+        for ref in refs:
+            delete_blob(ref)
         
         if result.deleted_count > 0:
             return True, f"✅ Deleted {result.deleted_count} images"
@@ -144,12 +329,11 @@ def clear_user_images(email):
             return True, "ℹ️ No images to delete"
             
     except pymongo.errors.ConnectionFailure:
+        MONGO_ERRORS.inc(operation='clear')
         return False, "❌ Could not connect to MongoDB"
     except Exception as e:
+        MONGO_ERRORS.inc(operation='clear')
         return False, f"❌ Clear error: {str(e)}"
-    finally:
-        if client:
-            client.close()
 
 
 def get_database_status():
@@ -157,26 +341,27 @@ def get_database_status():
     Check MongoDB connection status
     
     Returns:
-        status: Dictionary with connection info
+        status: Dictionary with connection info; when connected, 'collections'
+                (collections in the database) and 'scans' (stored scans)
     """
-    client = None
-    
     try:
-        # Connect to MongoDB
-        client = pymongo.MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=2000)
+        client = get_client()
         
-        # Test the connection
-        client.admin.command('ismaster')
-        
-        # Get database info
-        db = client['Brain']
-        collections = db.list_collection_names()
+        # Test the connection (fail fast instead of waiting for the pool's selection timeout)
+        with pymongo.timeout(2):
+            client.admin.command('ping')
+            
+            # Get database info (from collection metadata, without scanning)
+            db = client[DATABASE_NAME]
+            collections = db.list_collection_names()
+            scans = db[SCANS_COLLECTION].estimated_document_count()
         
         return {
             'connected': True,
             'message': '✅ MongoDB connected',
             'collections': len(collections),
-            'database': 'Brain'
+            'scans': scans,
+            'database': DATABASE_NAME
         }
         
     except pymongo.errors.ConnectionFailure:
@@ -191,8 +376,5 @@ def get_database_status():
             'message': '❌ Database error',
             'error': str(e)
         }
-    finally:
-        if client:
-            client.close()
 
 